@@ -0,0 +1,7 @@
+"""Benchmarks for each stage of the compiler and interpreter
+
+Run them with `python -m benchmarks`, see `python -m benchmarks --help`.
+The programs come from a seeded random generator (`generate.py`),
+so the same seed and settings always time the same programs,
+and the results are JSON so they can be compared between commits.
+"""
@@ -0,0 +1,69 @@
+import argparse
+import json
+import sys
+from .generate import generate
+from .run import presets, run_all
+
+
+argument_parser = argparse.ArgumentParser(
+    prog="python -m benchmarks",
+    description="Times each stage of phhe on generated programs, "
+                "and prints the results as JSON"
+)
+
+argument_parser.add_argument(
+    "presets",
+    nargs="*",
+    help="which programs to time, out of %s (all of them by default)"
+         % ', '.join(sorted(presets))
+)
+
+argument_parser.add_argument(
+    "--seed",
+    type=int,
+    default=0,
+    help="the seed for the program generator"
+)
+
+argument_parser.add_argument(
+    "--repeat",
+    type=int,
+    default=3,
+    help="how many times to run each stage, the fastest one counts"
+)
+
+argument_parser.add_argument(
+    "--cc",
+    action="store_true",
+    help="also time compiling the C with cc and running it"
+)
+
+argument_parser.add_argument(
+    "-o", "--output",
+    help="write the JSON here instead of stdout"
+)
+
+argument_parser.add_argument(
+    "--show",
+    metavar="PRESET",
+    choices=sorted(presets),
+    help="just print the program for a preset"
+)
+
+arguments = argument_parser.parse_args()
+for i in arguments.presets:
+    if i not in presets:
+        argument_parser.error("there's no preset called %r" % i)
+if arguments.show:
+    print(generate(arguments.seed, **presets[arguments.show]), end='')
+    sys.exit()
+
+results = run_all(arguments.presets, arguments.seed, arguments.repeat,
+                  arguments.cc)
+if arguments.output:
+    with open(arguments.output, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+else:
+    json.dump(results, sys.stdout, indent=2)
+    print()
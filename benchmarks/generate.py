@@ -0,0 +1,122 @@
+"""Makes random valid programs of whatever size we want
+
+The programs only use ints and `+`, `-` and `*` by small numbers,
+so they type check, mean the same thing in the interpreter and in C,
+and their numbers stay small enough for a C int.
+The C backend can't use an `if` as a value yet, so ifs are only statements
+and function bodies.
+Every function counts down its argument, so they all finish.
+"""
+
+import random
+
+
+class Generator:
+    def __init__(self, seed=0, size=20, depth=3, recursion=20, functions=4):
+        """`size` is how many statements there are at the top level,
+        `depth` is how deeply blocks, ifs and arithmetic nest,
+        `recursion` is how deep the recursive calls go,
+        and `functions` is how many functions there are"""
+        self.random = random.Random(seed)
+        self.size = size
+        self.depth = depth
+        self.recursion = recursion
+        self.functions = functions
+        self.var_number = 0
+        # Names of int variables in scope, one list per scope
+        self.scopes = [[]]
+
+    def fresh(self):
+        self.var_number += 1
+        return 'v%d' % self.var_number
+
+    def names(self):
+        return [name for scope in self.scopes for name in scope]
+
+    def leaf(self):
+        names = self.names()
+        if names and self.random.random() < 0.6:
+            return self.random.choice(names)
+        return str(self.random.randint(0, 9))
+
+    def expr(self, depth):
+        "An int expression that nests at most `depth` deep"
+        r = self.random.random()
+        if depth <= 0 or r < 0.2:
+            return self.leaf()
+        elif r < 0.55:
+            op = self.random.choice('+-')
+            return '%s %s %s' % (self.expr(depth - 1), op,
+                                 self.simple(depth - 1))
+        elif r < 0.75:
+            return '%s * %d' % (self.simple(depth - 1),
+                                self.random.randint(0, 3))
+        else:
+            return self.block(depth - 1)
+
+    def simple(self, depth):
+        "An expression that can go on the right of an operator"
+        e = self.expr(depth)
+        if ' ' in e and not e.startswith(('{', '(')):
+            return '(%s)' % e
+        return e
+
+    def block(self, depth):
+        self.scopes.append([])
+        lines = []
+        for i in range(self.random.randint(0, 2)):
+            name = self.fresh()
+            lines.append('%s = %s' % (name, self.expr(depth)))
+            self.scopes[-1].append(name)
+        lines.append(self.expr(depth))
+        self.scopes.pop()
+        return '{ %s }' % '\n'.join(lines)
+
+    def statement(self, depth):
+        "Something for the top level, or the branch of an if statement"
+        r = self.random.random()
+        if self.functions and r < 0.15:
+            return 'print(f%d(%d))' % (self.random.randrange(self.functions),
+                                       self.recursion)
+        elif r < 0.5:
+            name = self.fresh()
+            line = '%s = %s' % (name, self.expr(depth))
+            self.scopes[-1].append(name)
+            return line
+        elif r < 0.8 or depth <= 0:
+            return 'print(%s)' % self.expr(depth)
+        else:
+            branches = []
+            for i in range(2):
+                self.scopes.append([])
+                branches.append('\n'.join(
+                    self.statement(depth - 1)
+                    for i in range(self.random.randint(1, 3))))
+                self.scopes.pop()
+            return 'if %s then {\n%s\n} else {\n%s\n}' % (
+                self.expr(depth), branches[0], branches[1])
+
+    def function(self, i):
+        """Function `i` counts `n` down to 0, and calls one of the functions
+        before it with 0, which returns straight away"""
+        outer = self.scopes
+        # Scoping is dynamic, so the body only uses what it declares itself
+        self.scopes = [['n']]
+        call = ''
+        if i > 0:
+            call = ' + f%d(0)' % self.random.randrange(i)
+        body = 'if n then { x = %s\nf%d(n - 1) + x%s } else %d' % (
+            self.expr(self.depth), i, call, self.random.randint(0, 9))
+        self.scopes = outer
+        return 'fun f%d(n: {primitive: int}): {primitive: int} = %s' % (i, body)
+
+    def program(self):
+        lines = [self.function(i) for i in range(self.functions)]
+        for i in range(self.size):
+            lines.append(self.statement(self.depth))
+        return '\n'.join(lines) + '\n'
+
+
+def generate(seed=0, size=20, depth=3, recursion=20, functions=4):
+    "Returns the source of a random program, the same one for the same arguments"
+    return Generator(seed, size, depth, recursion, functions).program()
@@ -0,0 +1,112 @@
+"""Times each stage on generated programs"""
+
+import io
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from phhe import pratt
+from phhe.ast import Context
+from phhe.codegen import codegen
+from phhe.infer import infer
+from phhe.native import NativeCache
+from phhe.parse import exprs
+from .generate import generate
+
+
+# Settings for `generate`, from quick to slow
+presets = {
+    'small': dict(size=20, depth=3, recursion=20, functions=4),
+    'wide': dict(size=400, depth=3, recursion=20, functions=8),
+    'deep': dict(size=40, depth=7, recursion=20, functions=4),
+    'recursive': dict(size=20, depth=2, recursion=200, functions=16),
+}
+
+stages = ['parse', 'pratt', 'typecheck', 'eval', 'codegen', 'cc', 'run']
+
+
+def best_time(fn, repeat):
+    "Runs `fn` `repeat` times, and returns the fastest time and the last result"
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        ret = fn()
+        t = time.perf_counter() - start
+        if best is None or t < best:
+            best = t
+    return best, ret
+
+
+def count_nodes(tree):
+    # Any recursive walk would do, but this one's already there
+    from phhe.purity import walk
+    return sum(1 for i in walk(tree))
+
+
+def quiet_eval(tree):
+    "Runs the program without printing anything"
+    with redirect_stdout(io.StringIO()) as out:
+        tree.eval(Context())
+    return out.getvalue()
+
+
+def benchmark(name, params, seed=0, repeat=3, cc=False):
+    """Times every stage on the program for `params`.
+    The cc and run stages only happen if `cc` is True, and the compiler
+    cache isn't used, so every repeat really runs cc"""
+    source = generate(seed, **params)
+    timings = {}
+    timings['parse'], tree = best_time(lambda: exprs.parse(source), repeat)
+    timings['pratt'], _ = best_time(lambda: pratt.parse(source), repeat)
+    timings['typecheck'], _ = best_time(lambda: infer(tree), repeat)
+    timings['eval'], output = best_time(lambda: quiet_eval(tree), repeat)
+    timings['codegen'], c = best_time(
+        lambda: codegen([tree], runtime='runtime.h'), repeat)
+
+    if cc:
+        with tempfile.TemporaryDirectory() as tmp:
+            # -w because functions get used before they're declared
+            cache = NativeCache(tmp, flags=['-O2', '-w'])
+            # The runtime is built once in real use too
+            cache.runtime_object()
+            exe = os.path.join(tmp, 'bench.exe')
+            timings['cc'], _ = best_time(
+                lambda: cache.compile_source(
+                    c, [cache.runtime_object()], exe, '.exe'), repeat)
+            timings['run'], completed = best_time(
+                lambda: subprocess.run([exe], capture_output=True, text=True),
+                repeat)
+            if completed.stdout != output:
+                raise AssertionError("%s: C and the interpreter disagree" % name)
+
+    return {
+        'name': name,
+        'seed': seed,
+        'params': params,
+        'source_bytes': len(source),
+        'nodes': count_nodes(tree),
+        'timings': timings,
+    }
+
+
+def run_all(names=None, seed=0, repeat=3, cc=False):
+    "Runs the presets in `names` (all of them by default), returns a JSON-able dict"
+    names = names or list(presets)
+    # Every level of recursion in the program is a few levels of `eval`
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit or None,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': [benchmark(i, presets[i], seed, repeat, cc) for i in names],
+    }
@@ -0,0 +1,17 @@
+"""Programmer humour hackathon entry
+
+    import phhe
+    phhe.run('print(1 + 2)')
+    c = phhe.compile('print(1 + 2)')
+"""
+
+# These are only imported when they're used, so `python -m phhe.client`
+#   doesn't have to import the whole compiler
+__all__ = ['compile', 'run', 'check', 'Driver']
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import driver
+        return getattr(driver, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,6 +1,11 @@
 import argparse
-from .parse import parse_file, Context
-from .codegen import codegen
+import subprocess
+import sys
+from parsy import ParseError
+from . import batch, server, stream
+from .ast import TypeCheckError
+from .driver import Driver
+from .profiler import Profiler
 
 
 argument_parser = argparse.ArgumentParser(
@@ -12,6 +17,7 @@ argument_parser = argparse.ArgumentParser(
 argument_parser.add_argument(
     "file",
     action="store",
+    nargs="?",
     help="the file to compile"
 )
 
@@ -19,21 +25,252 @@ argument_parser.add_argument(
 argument_parser.add_argument(
     "dest",
     action="store",
-    help="the destination file"
+    nargs="?",
+    help="where to write the C, if it isn't stdout"
+)
+
+argument_parser.add_argument(
+    "--mode",
+    choices=["emit", "interpret", "python", "run", "check", "build"],
+    help="what to do with the file: emit the C, interpret it, turn it into "
+         "Python and run that, compile the C with cc and run it, only "
+         "check it, or compile it and the modules it imports separately to "
+         "the executable `dest`, only recompiling what changed. By default it's emit if "
+         "there's a destination, and interpret if there isn't"
+)
+
+argument_parser.add_argument(
+    "--run",
+    action="store_true",
+    help="the same as --mode run"
+)
+
+argument_parser.add_argument(
+    "--time",
+    action="store_true",
+    help="print how long each stage took to stderr"
+)
+
+argument_parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="always parse the file, instead of using the AST cache"
+)
+
+argument_parser.add_argument(
+    "-O",
+    dest="level",
+    type=int,
+    choices=[0, 1, 2],
+    default=1,
+    help="how much to optimize: -O0 not at all, -O1 (the default) folds "
+         "constants and dead branches, -O2 also propagates constants"
+)
+
+argument_parser.add_argument(
+    "--batch",
+    nargs="+",
+    metavar="PATH",
+    help="compile all of these files and directories of .ph files to C, "
+         "in parallel, instead of `file`"
+)
+
+argument_parser.add_argument(
+    "--out-dir",
+    help="with --batch, where the C goes, instead of next to each file"
+)
+
+argument_parser.add_argument(
+    "-j", "--jobs",
+    type=int,
+    help="with --batch or --serve, how many files to compile at once "
+         "(one per core)"
+)
+
+argument_parser.add_argument(
+    "--cc",
+    action="store_true",
+    help="with --batch, also compile the C to executables with cc"
+)
+
+argument_parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="parse and run (or compile to `dest`) one top-level statement at "
+         "a time, for huge files. `file` can be - for stdin"
+)
+
+argument_parser.add_argument(
+    "--counters",
+    action="store_true",
+    help="make the C count calls to each function and time them, "
+         "and print that when it exits"
+)
+
+argument_parser.add_argument(
+    "--tiered",
+    nargs="?",
+    type=int,
+    const=1000,
+    metavar="CALLS",
+    help="when interpreting, compile a function to native code once it's "
+         "been called CALLS times (1000 by default), if it's simple enough"
+)
+
+argument_parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="time the interpreter, and print the slowest functions and nodes"
+)
+
+argument_parser.add_argument(
+    "--flamegraph",
+    metavar="FILE",
+    help="time the interpreter, and write collapsed stacks to FILE "
+         "for flamegraph.pl or speedscope"
+)
+
+argument_parser.add_argument(
+    "--serve",
+    metavar="SOCKET",
+    help="run a compile server on the Unix socket SOCKET, instead of "
+         "compiling `file`. Send it files with `python -m phhe.client`. "
+         "-j is how many requests it works on at once"
 )
 
 arguments = argument_parser.parse_args()
+if arguments.serve:
+    try:
+        server.serve(arguments.serve, arguments.jobs, not arguments.no_cache)
+    except OSError as e:
+        print("Can't serve on %s: %s" % (arguments.serve, e), file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+if arguments.batch:
+    results = batch.compile_all(arguments.batch, arguments.out_dir,
+                                arguments.jobs, arguments.level,
+                                not arguments.no_cache, arguments.cc)
+    failed = 0
+    for result in results:
+        if result.error is not None:
+            failed += 1
+            print("%s: %s" % (result.path, result.error), file=sys.stderr)
+    print("%d compiled, %d failed" % (len(results) - failed, failed),
+          file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if arguments.file is None:
+    argument_parser.error("a file is needed, unless --batch is given")
+profiling = arguments.profile or arguments.flamegraph
 
-# Load the file in and interpret it
+mode = arguments.mode
+if arguments.run:
+    if mode not in (None, 'run'):
+        argument_parser.error("--run is the same as --mode run")
+    mode = 'run'
+if mode is None:
+    mode = 'emit' if arguments.dest is not None else 'interpret'
+if arguments.dest is not None and mode not in ('emit', 'build'):
+    argument_parser.error("the destination is only for --mode emit or build")
+if profiling and mode != 'interpret':
+    argument_parser.error("--profile only works when interpreting")
+if arguments.tiered is not None and mode != 'interpret':
+    argument_parser.error("--tiered only works when interpreting")
+if arguments.tiered is not None and arguments.stream:
+    # It needs the whole program to find the functions it can compile
+    argument_parser.error("--tiered doesn't work with --stream")
+if arguments.stream and mode not in ('emit', 'interpret'):
+    argument_parser.error("--stream only works with --mode emit or interpret")
+
+driver = Driver(arguments.level, not arguments.no_cache, arguments.counters,
+                tiered=arguments.tiered)
 path = arguments.file
-tree = parse_file(path)
 
-# Generate C and save it to 'dest'
-dest_path = arguments.dest
-dest = open(dest_path, 'w')
-dest.write(str(codegen([tree])))
 
-# And print the evaluated result
-ret = tree.eval(Context())
-if ret is not None:
-    print(ret)
+def finish(status=0):
+    if arguments.time:
+        print(driver.timings.report(), file=sys.stderr)
+    sys.exit(status)
+
+
+# What's wrong with the program rather than with us, which gets
+#   `file: error` instead of a traceback
+errors = (ParseError, TypeCheckError, ImportError,
+          subprocess.CalledProcessError)
+
+
+def fail(e):
+    print("%s: %s: %s" % (path, type(e).__name__, e), file=sys.stderr)
+    finish(1)
+
+
+def open_dest():
+    if arguments.dest is None:
+        return open(sys.stdout.fileno(), 'w', closefd=False)
+    return open(arguments.dest, 'w')
+
+
+if arguments.stream:
+    nodes = stream.optimize_each(
+        stream.statements(stream.read_lines(path)), arguments.level)
+    # Parsing and running are mixed together here, so it's one stage
+    try:
+        with driver.timings.stage('stream'):
+            if mode == 'emit':
+                with open_dest() as dest:
+                    stream.emit(nodes, dest, filename=path,
+                                counters=arguments.counters)
+            else:
+                ret = stream.run(nodes)
+                if ret is not None:
+                    print(ret)
+    except errors as e:
+        fail(e)
+    finish()
+
+if mode == 'build':
+    try:
+        driver.build(path, arguments.dest)
+    except errors as e:
+        fail(e)
+    finish()
+
+try:
+    tree = driver.optimize(driver.parse_file(path))
+    if mode == 'check':
+        driver.check(tree)
+    elif mode == 'emit':
+        # Generate it all first, so a type error doesn't leave half a file
+        c = driver.emit(tree, filename=path)
+        with open_dest() as dest:
+            dest.write(c)
+    elif mode == 'run':
+        # Compile it for real and run that, which is cached between runs
+        completed = driver.execute(tree, filename=path)
+except errors as e:
+    fail(e)
+
+if mode == 'run':
+    finish(completed.returncode)
+
+if mode == 'python':
+    ret = driver.run_python(tree, filename=path)
+    if ret is not None:
+        print(ret)
+
+if mode == 'interpret':
+    if profiling:
+        with Profiler() as profiler:
+            ret = driver.interpret(tree)
+        if arguments.profile:
+            print(profiler.report(), file=sys.stderr)
+        if arguments.flamegraph:
+            with open(arguments.flamegraph, 'w') as f:
+                profiler.write_collapsed(f)
+    else:
+        ret = driver.interpret(tree)
+    if ret is not None:
+        print(ret)
+
+finish()
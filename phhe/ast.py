@@ -6,14 +6,24 @@ The 'type()' methods return the type of the node
 
 
 import operator
+import time
 
 
 class Context:
     """Holds variable definitions and keeps track of scopes,
         both for type checking and interpreting"""
 
-    def __init__(self):
+    def __init__(self, memo=None, tiers=None, out=None, deadline=None):
         self.stack = [{}]
+        # A `purity.Memo`, for memoizing calls to pure functions
+        self.memo = memo
+        # A `tiered.Tiers`, for running hot functions as native code
+        self.tiers = tiers
+        # Where `print` writes to, if it isn't stdout
+        self.out = out
+        # The `time.monotonic()` after which calls raise a TimeoutError,
+        #   so the server can stop programs that never finish
+        self.deadline = deadline
 
     def add_binding(self, name, value):
         self.stack[-1][name] = value
@@ -26,19 +36,166 @@ class Context:
 
     def lookup(self, name):
         # Go up the stack from innermost to outermost
-        for i in self.stack[::-1]:
+        for i in reversed(self.stack):
             v = i.get(name)
             if v is not None:
                 return v
 
+    def check_deadline(self):
+        if time.monotonic() > self.deadline:
+            raise TimeoutError("The program ran out of time")
+
+    def squash(self, base):
+        """Replaces the scopes from `base` up with one scope, which `lookup`
+        gives the same answers for. Only the last scope ever changes,
+        so it's the same as keeping them"""
+        scope = {}
+        for i in self.stack[base:]:
+            scope.update((k, v) for k, v in i.items() if v is not None)
+        self.stack[base:] = [scope]
+
+
+def freeze(value):
+    "A hashable version of `value`, which can have dicts in it, like types do"
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (tuple, list)):
+        return tuple(freeze(i) for i in value)
+    return value
+
 
 class DictEq:
-    """A base class that will implement the __eq__ method the right way"""
+    """A base class that will implement the __eq__ method the right way.
+
+    Nodes list what makes them what they are in `fields`,
+    and use `__slots__` so they don't each need a `__dict__`.
+    Their hash is worked out the first time it's needed and then kept,
+    so after that, comparing two different nodes is usually one int
+    comparison, and comparing a node to itself is always free.
+    Nodes shouldn't be changed after they're made, since the hash would be wrong.
+    Classes without `fields` are just compared by `__dict__`"""
+
+    # `line` is where the node starts in the source, if the parser said.
+    #   It isn't part of what the node is, so == and hash() ignore it
+    __slots__ = ('line',)
+    fields = None
+
+    def key(self):
+        return tuple(getattr(self, i) for i in self.fields)
+
+    def children(self):
+        "The nodes this one is made of that have hashes of their own"
+        for i in self.key():
+            if isinstance(i, tuple):
+                for j in i:
+                    if isinstance(j, DictEq) and j.fields is not None:
+                        yield j
+            elif isinstance(i, DictEq) and i.fields is not None:
+                yield i
+
+    def rehash(self):
+        # Hash the children first, with a loop instead of recursion,
+        #   so long `BinOp` chains don't hit the recursion limit
+        todo = [self]
+        while todo:
+            missing = [i for i in todo[-1].children() if i._hash is None]
+            if missing:
+                todo.extend(missing)
+            else:
+                node = todo.pop()
+                node._hash = hash((type(node), freeze(node.key())))
+        return self._hash
 
     def __eq__(self, other):
-        if type(other) is type(self):
+        if self is other:
+            return True
+        if type(other) is not type(self):
+            return False
+        if self.fields is None:
             return self.__dict__ == other.__dict__
-        return False
+        if self._hash is not None and other._hash is not None and \
+                self._hash != other._hash:
+            return False
+        return self.key() == other.key()
+
+    def __hash__(self):
+        if self.fields is None:
+            raise TypeError("unhashable type: %r" % type(self).__name__)
+        if self._hash is None:
+            return self.rehash()
+        return self._hash
+
+
+class HashCons:
+    """Makes nodes so that equal nodes are one shared object,
+    so a tree with lots of repeats takes a lot less memory:
+        make = HashCons()
+        make(Literal, 1) is make(Literal, 1)
+
+    Shared nodes are the same object everywhere they appear, so they don't
+    mix with tables keyed by node identity (like `infer.Inference`) when the
+    same expression means different things in different places"""
+
+    def __init__(self):
+        self.nodes = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __call__(self, cls, *args):
+        node = cls(*args)
+        return self.nodes.setdefault(node, node)
+
+    def share(self, tree):
+        "Returns a copy of `tree` where equal subtrees are one object"
+        out = []
+        # (node, whether its children are already in `out`)
+        todo = [(tree, False)]
+        while todo:
+            node, ready = todo.pop()
+            if isinstance(node, Block):
+                children = list(node.exprs)
+            elif isinstance(node, BinOp):
+                children = [node.lhs, node.rhs]
+            elif isinstance(node, If):
+                children = [node.cond, node.if_branch, node.else_branch]
+            elif isinstance(node, Function):
+                children = [node.body]
+            elif isinstance(node, Call):
+                children = [node.args]
+            elif isinstance(node, VarDeclare):
+                children = [node.value]
+            else:
+                out.append(self.nodes.setdefault(node, node)
+                           if isinstance(node, (Literal, VarAccess)) else node)
+                continue
+
+            if not ready:
+                todo.append((node, True))
+                todo.extend((i, False) for i in reversed(children))
+                continue
+
+            n = len(children)
+            children = out[len(out) - n:]
+            del out[len(out) - n:]
+            if isinstance(node, Block):
+                new = self(Block, *children)
+            elif isinstance(node, BinOp):
+                new = self(BinOp, children[0], node.op, children[1])
+            elif isinstance(node, If):
+                new = self(If, *children)
+            elif isinstance(node, Function):
+                new = self(Function, node.name, node.args, children[0],
+                           node.ret_type)
+            elif isinstance(node, Call):
+                new = self(Call, node.function, children[0])
+            else:
+                new = self(VarDeclare, node.name, children[0])
+            # The first one of each keeps its line
+            if new.line is None:
+                new.line = node.line
+            out.append(new)
+        return out[0]
 
 
 reservedTags = ["primitive", "struct"]
@@ -46,6 +203,10 @@ primitiveTypes = ["type", "struct", "int", "null", "function"]
 NULL = {"primitive": "null"}
 
 
+class TypeCheckError(TypeError):
+    "The program doesn't type check, as opposed to a bug in here"
+
+
 class TypePrimitive(DictEq):
     def __init__(self, type):
         if type in primitiveTypes:
@@ -96,8 +257,17 @@ class TypeUserDef(DictEq):
 
 
 class Literal(DictEq):
+    __slots__ = ('value', '_hash')
+    fields = ('value',)
+
     def __init__(self, value):
         self.value = value
+        self._hash = None
+        self.line = None
+
+    def key(self):
+        # 1 == 1.0, but they're different literals
+        return (type(self.value), self.value)
 
     def __repr__(self):
         return "Literal(%r)" % self.value
@@ -113,10 +283,15 @@ class If(DictEq):
     """This language currently only has numbers, so that's the condition.
        The else branch is run if the condition is 0, otherwise the if branch is run."""
 
+    __slots__ = ('cond', 'if_branch', 'else_branch', '_hash')
+    fields = ('cond', 'if_branch', 'else_branch')
+
     def __init__(self, cond, if_branch, else_branch=None):
         self.cond = cond
         self.if_branch = if_branch
         self.else_branch = else_branch
+        self._hash = None
+        self.line = None
 
     def __repr__(self):
         return "if (%r) then (%r) else (%r)" % (self.cond, self.if_branch,
@@ -129,6 +304,13 @@ class If(DictEq):
         elif self.else_branch is not None:
             return self.else_branch.eval(ctx)
 
+    def tail_eval(self, ctx):
+        cond = self.cond.eval(ctx)
+        if cond != 0:
+            return tail_eval(self.if_branch, ctx)
+        elif self.else_branch is not None:
+            return tail_eval(self.else_branch, ctx)
+
     def type(self, ctx):
         if self.else_branch is not None:
             # It doesn't return anything if there isn't an else branch
@@ -137,19 +319,25 @@ class If(DictEq):
             if t1 == t2:
                 return t1
             else:
-                raise TypeError("Incompatible types for 'if' branches: %r and %r"
-                                % (t1, t2))
+                raise TypeCheckError(
+                    "Incompatible types for 'if' branches: %r and %r"
+                    % (t1, t2))
 
 
 class Function(DictEq):
     """A function definition"""
 
+    __slots__ = ('name', 'args', 'body', 'ret_type', '_hash')
+    fields = ('name', 'args', 'body', 'ret_type')
+
     def __init__(self, name, args, body, ret_type=None):
         """Right now, 'args' should be a tuple of (name,type)"""
         self.name = name
         self.args = args
         self.body = body
         self.ret_type = ret_type
+        self._hash = None
+        self.line = None
 
     def __repr__(self):
         return "fun %s(%r) = %r" % (self.name, self.args, self.body)
@@ -160,11 +348,16 @@ class Function(DictEq):
     def type(self, ctx):
         if self.ret_type is not None:
             if self.body is not None:
+                # With a declared return type, the body can call itself
+                ctx.add_binding(self.name, {'primitive': 'function',
+                                            'return': self.ret_type,
+                                            'argument': self.args[1]})
                 ret_t = self.body.type(ctx)
                 if ret_t != self.ret_type:
                     # I don't know if this belongs here
-                    raise TypeError('Wrong return type %r, really returns %r',
-                                    self.ret_type, ret_t)
+                    raise TypeCheckError(
+                        'Wrong return type %r, really returns %r'
+                        % (self.ret_type, ret_t))
             else:
                 ret_t = self.ret_type
         else:
@@ -179,30 +372,97 @@ class Function(DictEq):
 
     def call(self, ctx, args):
         if self.body is not None:
+            if ctx.tiers is not None:
+                native = ctx.tiers.native_function(self, args)
+                if native is not None:
+                    ret = native(args)
+                    if ret is not None:
+                        return ret
+            if ctx.memo is not None:
+                return ctx.memo.call(self, ctx, args)
+            return self.run(ctx, args)
+
+    def run(self, ctx, args):
+        """Runs the body, `call()` also checks for memoized results first.
+        Calls in tail position don't grow the Python stack: they come back
+        as a `TailCall`, and we go around again. The function we tail call
+        can still see our variables, so our scopes are squashed into one
+        instead of dropped, which stops `ctx.stack` growing too"""
+        fun = self
+        base = len(ctx.stack)
+        while True:
+            if ctx.deadline is not None:
+                ctx.check_deadline()
             ctx.push_scope()
-            ctx.add_binding(self.args[0], args)
-            ret = self.body.eval(ctx)
-            ctx.pop_scope()
-            return ret
+            ctx.add_binding(fun.args[0], args)
+            ret = tail_eval(fun.body, ctx)
+            if type(ret) is not TailCall:
+                break
+            fun = ret.function
+            args = ret.args
+            if fun.body is None:
+                ret = None
+                break
+            if ctx.tiers is not None:
+                native = ctx.tiers.native_function(fun, args)
+                ret = None if native is None else native(args)
+                if ret is not None:
+                    break
+            ctx.squash(base)
+        del ctx.stack[base:]
+        return ret
+
+
+class TailCall:
+    "A call that `Function.run` still has to make"
+
+    __slots__ = ('function', 'args')
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+
+
+def tail_eval(node, ctx):
+    """Like `node.eval(ctx)`, except that if `node` ends with a call to a
+    `Function` it returns a `TailCall` instead of making it"""
+    if isinstance(node, (Call, If, Block)):
+        return node.tail_eval(ctx)
+    return node.eval(ctx)
 
 
 class Call(DictEq):
     """A function call `f(x)`"""
 
+    __slots__ = ('function', 'args', '_hash')
+    fields = ('function', 'args')
+
     def __init__(self, function, args):
         self.function = function
         self.args = args
+        self._hash = None
+        self.line = None
 
     def __repr__(self):
         return "%r(%r)" % (self.function, self.args)
 
     def eval(self, ctx):
         if self.function == 'print':
-            print(self.args.eval(ctx))
+            print(self.args.eval(ctx), file=ctx.out)
         else:
             fun = ctx.lookup(self.function)
             return fun.call(ctx, self.args.eval(ctx))
 
+    def tail_eval(self, ctx):
+        if self.function == 'print':
+            return self.eval(ctx)
+        fun = ctx.lookup(self.function)
+        args = self.args.eval(ctx)
+        # Memoized calls have to go through `Memo.call`
+        if isinstance(fun, Function) and ctx.memo is None:
+            return TailCall(fun, args)
+        return fun.call(ctx, args)
+
     def type(self, ctx):
         fun = ctx.lookup(self.function)
         if fun:
@@ -214,11 +474,16 @@ class Call(DictEq):
 class BinOp(DictEq):
     """A binary operation (e.g. *, +, ...)"""
 
+    __slots__ = ('lhs', 'op', 'rhs', '_hash')
+    fields = ('lhs', 'op', 'rhs')
+
     def __init__(self, lhs, op, rhs):
         """`op` is a str"""
         self.op = op
         self.lhs = lhs
         self.rhs = rhs
+        self._hash = None
+        self.line = None
 
     def __repr__(self):
         return "BinOp(%r %r %r)" % (self.lhs, self.op, self.rhs)
@@ -248,9 +513,14 @@ class VarDeclare(DictEq):
     """A variable declaration.
     The way it works right now, it also can be a variable assignment"""
 
+    __slots__ = ('name', 'value', '_hash')
+    fields = ('name', 'value')
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
+        self._hash = None
+        self.line = None
 
     def __repr__(self):
         return "%r = %r" % (self.name, self.value)
@@ -271,8 +541,13 @@ class VarDeclare(DictEq):
 class VarAccess(DictEq):
     """A use of a variable"""
 
+    __slots__ = ('name', '_hash')
+    fields = ('name',)
+
     def __init__(self, name):
         self.name = name
+        self._hash = None
+        self.line = None
 
     def __repr__(self):
         return "VarAccess(%r)" % self.name
@@ -289,8 +564,13 @@ class Block(DictEq):
     """A block containing expressions.
     The last one is used as the return value of the block"""
 
+    __slots__ = ('exprs', '_hash')
+    fields = ('exprs',)
+
     def __init__(self, *exprs):
         self.exprs = exprs
+        self._hash = None
+        self.line = None
 
     def __repr__(self):
         ret = '{\n'
@@ -309,6 +589,21 @@ class Block(DictEq):
 
         return ret
 
+    def tail_eval(self, ctx):
+        ret = None
+        ctx.push_scope()
+        for i in self.exprs[:-1]:
+            ret = i.eval(ctx)
+        if self.exprs:
+            ret = tail_eval(self.exprs[-1], ctx)
+            if type(ret) is TailCall:
+                # The function we call can see our variables,
+                #   `Function.run` drops the scope once it's done
+                return ret
+        ctx.pop_scope()
+
+        return ret
+
     def type(self, ctx):
         """The block has the type of the last expression"""
         ret = None
@@ -319,3 +614,26 @@ class Block(DictEq):
         ctx.pop_scope()
 
         return ret
+
+
+class Import(DictEq):
+    """`import name`, which uses the module in `name.ph`.
+    `build.link` puts the module in its place before the program runs"""
+
+    __slots__ = ('name', '_hash')
+    fields = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+        self._hash = None
+        self.line = None
+
+    def __repr__(self):
+        return "import %s" % self.name
+
+    def eval(self, ctx):
+        raise ImportError("Can't import %s here, imports only work at the top "
+                          "level of a file that's been linked" % self.name)
+
+    def type(self, ctx):
+        return NULL
@@ -0,0 +1,221 @@
+"""An on-disk cache of parsed ASTs, keyed by a hash of the source
+
+The AST is stored flattened in postfix order, so neither saving nor loading
+it recurses, and it's written with `marshal`, which is compact and quick.
+The cache directory is kept under a size limit by deleting the least
+recently used entries.
+"""
+
+import hashlib
+import marshal
+import os
+import tempfile
+from .ast import *
+from . import pratt
+
+
+# Change this whenever the parser or the format below changes,
+#   so old entries stop matching
+PARSER_VERSION = b'pratt-3'
+
+default_dir = os.path.join(
+    os.environ.get('PHHE_CACHE_DIR') or
+    os.path.join(os.path.expanduser('~'), '.cache', 'phhe'), 'ast')
+
+
+def flatten(tree):
+    """Turns an AST into a flat list, children before their parents.
+    Each node is a tag, what it needs besides its children, and its line"""
+    out = []
+    todo = [tree]
+    while todo:
+        node = todo.pop()
+        if type(node) is tuple:
+            # A node whose children are already in `out`
+            out.extend(node)
+        elif isinstance(node, Literal):
+            out.extend(('L', node.value, node.line))
+        elif isinstance(node, VarAccess):
+            out.extend(('V', node.name, node.line))
+        elif isinstance(node, BinOp):
+            todo.append(('B', node.op, node.line))
+            todo.append(node.rhs)
+            todo.append(node.lhs)
+        elif isinstance(node, If):
+            has_else = node.else_branch is not None
+            todo.append(('I', has_else, node.line))
+            if has_else:
+                todo.append(node.else_branch)
+            todo.append(node.if_branch)
+            todo.append(node.cond)
+        elif isinstance(node, Function):
+            has_body = node.body is not None
+            todo.append(('F', node.name, node.args, node.ret_type, has_body,
+                         node.line))
+            if has_body:
+                todo.append(node.body)
+        elif isinstance(node, Call):
+            todo.append(('C', node.function, node.line))
+            todo.append(node.args)
+        elif isinstance(node, VarDeclare):
+            todo.append(('D', node.name, node.line))
+            todo.append(node.value)
+        elif isinstance(node, Import):
+            out.extend(('M', node.name, node.line))
+        elif isinstance(node, Block):
+            todo.append(('K', len(node.exprs), node.line))
+            todo.extend(reversed(node.exprs))
+        else:
+            raise TypeError("Can't cache %r" % node)
+    return out
+
+
+def unflatten(data):
+    "The opposite of `flatten`"
+    stack = []
+    i = 0
+    while i < len(data):
+        tag = data[i]
+        if tag == 'L':
+            stack.append(Literal(data[i + 1]))
+            i += 3
+        elif tag == 'V':
+            stack.append(VarAccess(data[i + 1]))
+            i += 3
+        elif tag == 'B':
+            rhs = stack.pop()
+            stack[-1] = BinOp(stack[-1], data[i + 1], rhs)
+            i += 3
+        elif tag == 'I':
+            else_branch = stack.pop() if data[i + 1] else None
+            if_branch = stack.pop()
+            stack[-1] = If(stack[-1], if_branch, else_branch)
+            i += 3
+        elif tag == 'F':
+            name, args, ret_type, has_body = data[i + 1:i + 5]
+            body = stack.pop() if has_body else None
+            stack.append(Function(name, args, body, ret_type))
+            i += 6
+        elif tag == 'C':
+            stack[-1] = Call(data[i + 1], stack[-1])
+            i += 3
+        elif tag == 'D':
+            stack[-1] = VarDeclare(data[i + 1], stack[-1])
+            i += 3
+        elif tag == 'M':
+            stack.append(Import(data[i + 1]))
+            i += 3
+        elif tag == 'K':
+            n = data[i + 1]
+            exprs = stack[len(stack) - n:]
+            del stack[len(stack) - n:]
+            stack.append(Block(*exprs))
+            i += 3
+        else:
+            raise ValueError("Bad AST cache entry")
+        # Every node ends with its line
+        stack[-1].line = data[i - 1]
+    [tree] = stack
+    return tree
+
+
+class ASTCache:
+    def __init__(self, path=None, max_bytes=64 * 1024 * 1024):
+        self.path = path or default_dir
+        self.max_bytes = max_bytes
+
+    def key(self, source):
+        "`source` is bytes"
+        return hashlib.sha256(PARSER_VERSION + b'\0' + source).hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key + '.ast')
+
+    def get(self, source):
+        "Returns the cached AST for `source`, or None"
+        entry = self.entry(self.key(source))
+        try:
+            with open(entry, 'rb') as f:
+                tree = unflatten(marshal.load(f))
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError, IndexError):
+            # Half-written or from some other version, so get rid of it
+            self.remove(entry)
+            return None
+        # The modification time is what eviction goes by
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return tree
+
+    def put(self, source, tree):
+        try:
+            data = marshal.dumps(flatten(tree))
+        except (TypeError, ValueError):
+            return
+        os.makedirs(self.path, exist_ok=True)
+        # Write to a temporary file and rename it,
+        #   so nobody ever reads a half-written entry
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.entry(self.key(source)))
+        self.evict()
+
+    def remove(self, entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+    def evict(self):
+        "Deletes the least recently used entries until we're under `max_bytes`"
+        entries = []
+        total = 0
+        for i in os.scandir(self.path):
+            if i.name.endswith('.ast'):
+                try:
+                    st = i.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, i.path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            for i in os.scandir(self.path):
+                if i.name.endswith('.ast'):
+                    self.remove(i.path)
+
+    def parse(self, source):
+        "Like `pratt.parse`, but uses the cache. `source` is bytes"
+        tree = self.get(source)
+        if tree is None:
+            tree = pratt.parse(source.decode())
+            try:
+                self.put(source, tree)
+            except OSError:
+                # Not being able to cache isn't a reason to fail
+                pass
+        return tree
+
+    def parse_file(self, path):
+        file = open(path, 'rb')
+        source = file.read()
+        file.close()
+        return self.parse(source)
+
+
+def parse_file(path, cache=None):
+    "Like `pratt.parse_file`, but with an `ASTCache`"
+    return (cache or ASTCache()).parse_file(path)
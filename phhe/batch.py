@@ -0,0 +1,140 @@
+"""Compiles lots of files at once, spread over a process pool
+
+Each file is parsed, optimized, type checked and turned into C in a worker
+process, and optionally the C is then compiled with cc, a few at a time.
+Results always come back in the same order (sorted by path, directories
+expanded), whatever order the workers finish in,
+and a file that fails doesn't stop the others.
+Files that would be compiled to the same .c, like `a/x.ph` and `b/x.ph`
+with an `out_dir`, are all errors instead, so none of them is overwritten.
+"""
+
+import os
+import shlex
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from . import pratt, astcache
+from .codegen import codegen
+from .optimize import optimize
+
+
+class Result:
+    "What happened to one file. `error` is None if it worked"
+
+    def __init__(self, path, dest, error=None, exe=None):
+        self.path = path
+        self.dest = dest
+        self.error = error
+        self.exe = exe
+
+    def __repr__(self):
+        return "Result(%r, %r, %r)" % (self.path, self.dest, self.error)
+
+
+def find_sources(paths, out_dir=None):
+    """Returns a sorted list of (source, dest) for `paths`,
+    which are .ph files or directories to look for them in"""
+    jobs = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    if name.endswith('.ph'):
+                        source = os.path.join(root, name)
+                        rel = os.path.relpath(source, path)
+                        jobs[source] = dest_for(source, rel, out_dir)
+        else:
+            jobs[path] = dest_for(path, os.path.basename(path), out_dir)
+    return sorted(jobs.items())
+
+
+def dest_for(source, rel, out_dir):
+    "The .c file for `source`, which is `rel` under `out_dir` if there is one"
+    base = os.path.splitext(rel if out_dir else source)[0] + '.c'
+    if out_dir:
+        return os.path.join(out_dir, base)
+    return base
+
+
+def clashes(sources):
+    "The dests in `sources` that more than one source has"
+    seen = {}
+    for source, dest in sources:
+        dest = os.path.normpath(dest)
+        seen[dest] = seen.get(dest, 0) + 1
+    return {dest for dest, count in seen.items() if count > 1}
+
+
+def compile_one(job):
+    "Runs in a worker: turns one file into C. `job` is (source, dest, level, cache)"
+    source, dest, level, cache = job
+    try:
+        if cache:
+            tree = astcache.parse_file(source)
+        else:
+            tree = pratt.parse_file(source)
+        tree = optimize(tree, level)
+        # Write to a string first, so a type error doesn't leave half a file
+        c = codegen([tree], filename=source)
+        dirname = os.path.dirname(dest)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(dest, 'w') as f:
+            f.write(c)
+    except Exception as e:
+        return Result(source, dest, '%s: %s' % (type(e).__name__, e))
+    return Result(source, dest)
+
+
+def cc_one(result, cc, flags):
+    "Compiles the C for `result` into an executable next to it"
+    exe = os.path.splitext(result.dest)[0]
+    completed = subprocess.run([cc] + flags + [result.dest, '-o', exe],
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        result.error = 'cc failed: %s' % completed.stderr.strip()
+    else:
+        result.exe = exe
+    return result
+
+
+def compile_all(paths, out_dir=None, jobs=None, level=1, cache=True,
+                cc=None, flags=None):
+    """Compiles every .ph file in `paths` to C, and if `cc` is given,
+    compiles that C too. `cc` is the compiler, or True for $CC or cc.
+    Returns a list of `Result`s.
+    `jobs` is how many processes to use, it defaults to one per core"""
+    jobs = jobs or os.cpu_count() or 1
+    sources = find_sources(paths, out_dir)
+    clashing = clashes(sources)
+    work = [(source, dest, level, cache) for source, dest in sources
+            if os.path.normpath(dest) not in clashing]
+
+    if jobs == 1 or len(work) <= 1:
+        done = [compile_one(i) for i in work]
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            # `map` gives them back in order, which keeps it deterministic
+            done = list(pool.map(compile_one, work, chunksize=8))
+
+    # Put the clashes back in, in order
+    done = iter(done)
+    results = []
+    for source, dest in sources:
+        if os.path.normpath(dest) in clashing:
+            results.append(Result(source, dest, 'Another file would also be '
+                                                'compiled to %s' % dest))
+        else:
+            results.append(next(done))
+
+    if cc:
+        if cc is True:
+            cc = os.environ.get('CC') or 'cc'
+        if flags is None:
+            flags = shlex.split(os.environ.get('CFLAGS', '-O2'))
+        ok = [i for i in results if i.error is None]
+        # cc is its own process, so threads are enough here
+        with ThreadPoolExecutor(jobs) as pool:
+            list(pool.map(lambda r: cc_one(r, cc, flags), ok))
+
+    return results
@@ -0,0 +1,232 @@
+"""Modules, and building a program one module at a time
+
+`import name` at the top level of a file uses the module in `name.ph`,
+next to that file. Everything a module defines at the top level is
+visible after that, and the rest of its top level runs right there,
+but only the first time anything imports it.
+
+`link` puts every module in the place it's first imported, which makes
+one big program that runs like any other, so that's what the interpreter
+and `codegen` get.
+
+`Build` compiles each module to its own C file and object file instead,
+and links them together:
+
+    build = Build()
+    exe = build.build('main.ph')
+
+It remembers each module's imports and the types of the functions it
+defines in `graph.json` in the build directory. Next time, a module is only
+compiled again if its source changed, or the types of the functions it
+imports did. Changing the body of a function, but not its type, only
+compiles the module it's in.
+In the C, a module only sees functions from modules it imports itself,
+and names of functions are global, so two modules can't define the same one.
+They can only take and return ints and floats, and only what C converts
+exactly can be passed to an imported function, an int for a float but not
+the other way around. Anything else is a TypeCheckError.
+"""
+
+import json
+import os
+import subprocess
+from .ast import *
+from .codegen import gen_module, load_runtime
+from .native import NativeCache
+from .optimize import optimize
+from .purity import walk
+from . import pratt
+
+
+INT = {'primitive': 'int'}
+FLOAT = {'primitive': 'float'}
+
+
+def type_name(t):
+    return t['primitive'] if t else 'nothing'
+
+
+def module_path(importer, name):
+    "Where `import name` in the file `importer` looks"
+    return os.path.join(os.path.dirname(importer), name + '.ph')
+
+
+def module_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def imports(tree):
+    """The names `tree` imports, in order.
+    Raises an ImportError if there's an `import` that isn't at the top level"""
+    ret = []
+    for node in tree.exprs:
+        if isinstance(node, Import):
+            ret.append(node.name)
+        elif any(isinstance(i, Import) for i in walk(node)):
+            raise ImportError("imports have to be at the top level")
+    return ret
+
+
+def link(path, parse=pratt.parse_file, tree=None):
+    """Returns the program in the file `path` with every `import` replaced by
+    the module it names. `parse` is called with the path of each file,
+    `tree` is the one for `path`, if it's already parsed"""
+    done = {module_name(path)}
+
+    def visit(path, tree, stack):
+        exprs = []
+        for node in tree.exprs:
+            if not isinstance(node, Import):
+                exprs.append(node)
+            elif node.name in stack:
+                raise ImportError("%s imports itself: %s" % (
+                    node.name, ' -> '.join(stack + [node.name])))
+            elif node.name not in done:
+                done.add(node.name)
+                dep = module_path(path, node.name)
+                exprs.extend(visit(dep, parse_module(dep, parse),
+                                   stack + [node.name]))
+        return exprs
+
+    if tree is None:
+        tree = parse(path)
+    imports(tree)
+    ret = Block(*visit(path, tree, [module_name(path)]))
+    ret.line = tree.line
+    return ret
+
+
+def parse_module(path, parse):
+    try:
+        tree = parse(path)
+    except FileNotFoundError:
+        raise ImportError("There's no module %s at %s" % (
+            module_name(path), path)) from None
+    imports(tree)
+    return tree
+
+
+class Build:
+    def __init__(self, directory=None, level=1, native=None):
+        """The C, the objects and the graph go in `directory`,
+        by default `.phhe-build` next to the main file.
+        `native` says which compiler and flags to use, and has the runtime"""
+        self.directory = directory
+        self.level = level
+        self.native = native or NativeCache()
+        # The modules compiled by the last `build`
+        self.rebuilt = []
+
+    def build(self, path, dest=None):
+        """Builds the program in the file `path` into an executable at `dest`,
+        by default `path` without the `.ph`. Returns `dest`"""
+        if dest is None:
+            dest = os.path.splitext(path)[0]
+            if dest == path:
+                dest += '.out'
+        directory = self.directory or os.path.join(
+            os.path.dirname(os.path.abspath(path)), '.phhe-build')
+        os.makedirs(directory, exist_ok=True)
+        graph_path = os.path.join(directory, 'graph.json')
+        try:
+            with open(graph_path) as f:
+                graph = json.load(f)
+        except (FileNotFoundError, ValueError):
+            graph = {}
+
+        self.rebuilt = []
+        main = module_name(path)
+        objects = []
+        for name, module in self.order(path, graph):
+            entry = graph[name]
+            seen = {i: graph[i]['exports'] for i in entry['imports']}
+            obj = os.path.join(directory, name + '.o')
+            if entry.get('seen') != seen or not os.path.exists(obj):
+                self.compile(name, module, entry, seen, name == main, obj)
+                # Save as we go, so a failure later doesn't lose this
+                with open(graph_path, 'w') as f:
+                    json.dump(graph, f)
+            objects.append(obj)
+
+        if self.rebuilt or not os.path.exists(dest):
+            self.cc(objects + [self.native.runtime_object()], dest)
+        return dest
+
+    def order(self, path, graph):
+        """[(name, path)] for every module, each after the ones it imports.
+        Updates the imports in `graph` for modules that have changed"""
+        ret = []
+        done = set()
+
+        def visit(name, path, stack):
+            with open(path, 'rb') as f:
+                source = f.read()
+            key = self.native.hash(load_runtime('runtime.h'), str(self.level),
+                                   source.decode())
+            entry = graph.get(name)
+            if entry is None or entry['hash'] != key:
+                # The `seen` that's there doesn't go with this source
+                tree = pratt.parse(source.decode())
+                entry = graph[name] = {'hash': key, 'imports': imports(tree)}
+            for i in entry['imports']:
+                if i in stack:
+                    raise ImportError("%s imports itself: %s" % (
+                        i, ' -> '.join(stack + [i])))
+                if i not in done:
+                    dep = module_path(path, i)
+                    if not os.path.exists(dep):
+                        raise ImportError("There's no module %s at %s" % (
+                            i, dep))
+                    visit(i, dep, stack + [i])
+            done.add(name)
+            ret.append((name, path))
+
+        visit(module_name(path), path, [module_name(path)])
+        return ret
+
+    def compile(self, name, path, entry, seen, main, obj):
+        "Compiles the module `name` to `obj`, and updates its `entry`"
+        with open(path) as f:
+            tree = optimize(pratt.parse(f.read()), self.level)
+        functions = {}
+        for i in seen.values():
+            functions.update(i)
+        mod = gen_module([tree], 'runtime.h', path, imports=functions,
+                         init=None if main else name)
+        self.check_types(name, tree, mod, functions)
+
+        c_file = os.path.join(os.path.dirname(obj), name + '.c')
+        with open(c_file, 'w') as f:
+            mod.write(f)
+        self.cc(['-c', c_file], obj)
+
+        entry['exports'] = {i.name: mod.types[i] for i in tree.exprs
+                            if isinstance(i, Function)}
+        entry['seen'] = seen
+        self.rebuilt.append(name)
+
+    def check_types(self, name, tree, mod, imports):
+        """Raises a TypeCheckError if the C for the module `name` wouldn't work
+        like the interpreter, `imports` is {name: type}"""
+        for node in walk(tree):
+            if isinstance(node, Call) and node.function in imports:
+                expected = imports[node.function]['argument']
+                got = mod.types[node.args]
+                if got != expected and (got, expected) != (INT, FLOAT):
+                    raise TypeCheckError("%s: %s takes %s, but gets %s" % (
+                        name, node.function, type_name(expected),
+                        type_name(got)))
+        for i in tree.exprs:
+            if isinstance(i, Function):
+                t = mod.types[i]
+                if t['return'] not in (INT, FLOAT) or \
+                        t['argument'] not in (INT, FLOAT, NULL):
+                    raise TypeCheckError(
+                        "%s: %s takes %s and returns %s, but functions can "
+                        "only take and return ints and floats" % (
+                            name, i.name, type_name(t['argument']),
+                            type_name(t['return'])))
+
+    def cc(self, args, dest):
+        subprocess.run([self.native.cc] + self.native.flags + args +
+                       ['-o', dest], check=True)
@@ -0,0 +1,135 @@
+"""A client for the compile server in `server`
+
+It only imports the standard library, so it starts quickly:
+
+    python -m phhe.client /tmp/phhe.sock file.ph file.c
+    python -m phhe.client /tmp/phhe.sock file.ph --mode interpret
+
+From Python:
+
+    with Client('/tmp/phhe.sock') as client:
+        c = client.request('emit', source='print(1)')['c']
+"""
+
+import argparse
+import json
+import socket
+import sys
+
+
+class ServerError(Exception):
+    "The server couldn't do what was asked"
+
+
+class Client:
+    def __init__(self, path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.file = self.sock.makefile('rb')
+
+    def request(self, op, **kwargs):
+        """Sends a request, see `server` for what can be in it,
+        and returns the response as a dict"""
+        kwargs['op'] = op
+        try:
+            self.sock.sendall(json.dumps(kwargs).encode() + b'\n')
+            line = self.file.readline()
+        except ConnectionError:
+            line = None
+        if not line:
+            raise ServerError("The server closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+argument_parser = argparse.ArgumentParser(
+    description="Sends a file to a phhe compile server, started with "
+                "`python -m phhe --serve SOCKET`"
+)
+argument_parser.add_argument("socket", help="where the server is listening")
+argument_parser.add_argument("file", nargs="?", help="the file to compile")
+argument_parser.add_argument("dest", nargs="?",
+                             help="where to write the C, if it isn't stdout")
+argument_parser.add_argument(
+    "--mode",
+    choices=["emit", "interpret", "python", "run", "check"],
+    help="like for `python -m phhe`"
+)
+argument_parser.add_argument("-O", dest="level", type=int, choices=[0, 1, 2],
+                             default=1)
+argument_parser.add_argument("--counters", action="store_true")
+argument_parser.add_argument("--tiered", nargs="?", type=int, const=1000,
+                             metavar="CALLS")
+argument_parser.add_argument("--time", action="store_true",
+                             help="print how long each stage took on the "
+                                  "server to stderr")
+argument_parser.add_argument("--shutdown", action="store_true",
+                             help="tell the server to stop, instead of "
+                                  "sending a file")
+
+
+def main(argv=None):
+    "Works like `python -m phhe`, and returns the exit status"
+    arguments = argument_parser.parse_args(argv)
+    if arguments.file is None and not arguments.shutdown:
+        argument_parser.error("a file is needed, unless --shutdown is given")
+    mode = arguments.mode or (
+        'emit' if arguments.dest is not None else 'interpret')
+    if arguments.dest is not None and mode != 'emit':
+        argument_parser.error("the destination is only for --mode emit")
+
+    try:
+        with Client(arguments.socket) as client:
+            if arguments.shutdown:
+                client.request('shutdown')
+                return 0
+            with open(arguments.file) as f:
+                source = f.read()
+            response = client.request(
+                mode, source=source, filename=arguments.file,
+                level=arguments.level, counters=arguments.counters,
+                tiered=arguments.tiered)
+    except (ServerError, OSError) as e:
+        # The server isn't there, or went away
+        print("%s: %s" % (arguments.file or arguments.socket, e),
+              file=sys.stderr)
+        return 1
+
+    sys.stdout.write(response.get('output', ''))
+    sys.stderr.write(response.get('stderr', ''))
+    if arguments.time:
+        total = 0
+        for name, seconds in response.get('timings', []):
+            print('%-10s %10.6fs' % (name, seconds), file=sys.stderr)
+            total += seconds
+        print('%-10s %10.6fs' % ('total', total), file=sys.stderr)
+    if not response['ok']:
+        print("%s: %s" % (arguments.file, response['error']), file=sys.stderr)
+        return 1
+    if response.get('c') is not None:
+        if arguments.dest is None:
+            sys.stdout.write(response['c'])
+        else:
+            with open(arguments.dest, 'w') as f:
+                f.write(response['c'])
+    if response.get('value') is not None:
+        print(response['value'])
+    return response.get('status', 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""Compiles the AST into a tree of nested Python closures
+
+`Block.eval()` and friends look at the node every time they run it.
+Here each node is turned into a function of the `Context` exactly once,
+with its children, operator and branches already looked up,
+so running the program is just calling closures.
+The result gives the same answers as `node.eval(Context())`.
+"""
+
+import operator
+from .ast import *
+
+
+ops = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv
+}
+
+
+class CompiledFunction:
+    """What a compiled `Function` binds its name to.
+    It has the same `call()` as `Function`, so the two can be mixed"""
+
+    def __init__(self, function, body):
+        self.function = function
+        self.name = function.name
+        self.arg = function.args[0] if function.args else None
+        # This is None for functions without bodies, like `Function`
+        self.body = body
+
+    def __repr__(self):
+        return "CompiledFunction(%r)" % self.name
+
+    def call(self, ctx, args):
+        if self.body is not None:
+            stack = ctx.stack
+            stack.append({self.arg: args})
+            ret = self.body(ctx)
+            stack.pop()
+            return ret
+
+
+def lookup(ctx, name):
+    "Like `Context.lookup`, but without copying the stack"
+    for scope in reversed(ctx.stack):
+        v = scope.get(name)
+        if v is not None:
+            return v
+
+
+def compile_literal(node):
+    value = node.value
+
+    def literal(ctx):
+        return value
+    return literal
+
+
+def compile_binop(node):
+    op = ops[node.op]
+    lhs = compile_closure(node.lhs)
+
+    # Literal operands are common enough to be worth skipping a call for
+    if type(node.rhs) is Literal:
+        r = node.rhs.value
+
+        def binop_const(ctx):
+            return op(lhs(ctx), r)
+        return binop_const
+
+    rhs = compile_closure(node.rhs)
+
+    def binop(ctx):
+        return op(lhs(ctx), rhs(ctx))
+    return binop
+
+
+def compile_if(node):
+    cond = compile_closure(node.cond)
+    if_branch = compile_closure(node.if_branch)
+
+    if node.else_branch is None:
+        def if_then(ctx):
+            if cond(ctx) != 0:
+                return if_branch(ctx)
+        return if_then
+
+    else_branch = compile_closure(node.else_branch)
+
+    def if_then_else(ctx):
+        if cond(ctx) != 0:
+            return if_branch(ctx)
+        return else_branch(ctx)
+    return if_then_else
+
+
+def compile_function(node):
+    body = compile_closure(node.body) if node.body is not None else None
+    compiled = CompiledFunction(node, body)
+    name = node.name
+
+    def function(ctx):
+        ctx.stack[-1][name] = compiled
+    return function
+
+
+def compile_call(node):
+    name = node.function
+    args = compile_closure(node.args)
+
+    if name == 'print':
+        def call_print(ctx):
+            print(args(ctx), file=ctx.out)
+        return call_print
+
+    def call(ctx):
+        # The function is looked up before the argument is evaluated,
+        #   same as in `Call.eval`
+        fun = lookup(ctx, name)
+        if type(fun) is not CompiledFunction:
+            return fun.call(ctx, args(ctx))
+        # Skip a level of calls for our own functions
+        body = fun.body
+        if body is not None:
+            stack = ctx.stack
+            stack.append({fun.arg: args(ctx)})
+            ret = body(ctx)
+            stack.pop()
+            return ret
+    return call
+
+
+def compile_var_declare(node):
+    name = node.name
+    value = compile_closure(node.value)
+    # `VarDeclare.eval` returns the node, not the value
+    ret = node.value
+
+    def var_declare(ctx):
+        ctx.stack[-1][name] = value(ctx)
+        return ret
+    return var_declare
+
+
+def compile_var_access(node):
+    name = node.name
+
+    def var_access(ctx):
+        return lookup(ctx, name)
+    return var_access
+
+
+def compile_block(node):
+    exprs = tuple(compile_closure(i) for i in node.exprs)
+
+    if len(exprs) == 1:
+        only = exprs[0]
+
+        def block_one(ctx):
+            stack = ctx.stack
+            stack.append({})
+            ret = only(ctx)
+            stack.pop()
+            return ret
+        return block_one
+
+    def block(ctx):
+        ret = None
+        stack = ctx.stack
+        stack.append({})
+        for i in exprs:
+            ret = i(ctx)
+        stack.pop()
+        return ret
+    return block
+
+
+compilers = {
+    Literal: compile_literal,
+    BinOp: compile_binop,
+    If: compile_if,
+    Function: compile_function,
+    Call: compile_call,
+    VarDeclare: compile_var_declare,
+    VarAccess: compile_var_access,
+    Block: compile_block,
+}
+
+
+def compile_closure(node):
+    """Turns `node` into a function that takes a `Context`.
+    Nodes we don't know how to compile just use their own `eval()`"""
+    compiler = compilers.get(type(node))
+    if compiler is None:
+        return node.eval
+    return compiler(node)
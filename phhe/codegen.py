@@ -1,34 +1,90 @@
 """Generates C code from the AST. We could have another method on AST nodes,
     but that makes it harder to switch code generators in the future"""
 
+import io
+import pathlib
 from .ast import *
+from .infer import Inference
 
 
 class CBlock:
     def __init__(self):
         self.exprs = []
+        # The line the last `#line` directive in here said, if it still holds
+        self.line = None
 
     def add(self, node):
         self.exprs.append(node)
 
-    def __str__(self):
-        ret = ' {\n'
+    def write(self, out, newline=True):
+        """Writes the C code to the file-like object `out`.
+        Statements can be strs or anything else with a `write()` method"""
+        out.write(' {\n')
+        self.write_exprs(out)
+        out.write('}\n' if newline else '}')
 
+    def write_exprs(self, out):
+        "Writes just the statements, without the braces"
         for i in self.exprs:
-            ret += '\t%s;\n' % i
+            if isinstance(i, CLine):
+                i.write(out)
+                continue
+            out.write('\t')
+            write(i, out)
+            out.write(';\n')
 
-        ret += '}\n'
-        return ret
+    def __str__(self):
+        return to_str(self)
+
+
+class CLine:
+    "A `#line` directive, so compiler errors and profilers show our source"
+
+    def __init__(self, line, filename):
+        self.line = line
+        self.filename = filename
+
+    def write(self, out):
+        out.write('#line %d "%s"\n' % (
+            self.line, self.filename.replace('\\', '\\\\').replace('"', '\\"')))
+
+
+class CIf:
+    """An if statement. `if_block` and `else_block` are `CBlock`s,
+    `else_block` can be None"""
+
+    def __init__(self, cond, if_block, else_block=None, newline=True):
+        self.cond = cond
+        self.if_block = if_block
+        self.else_block = else_block
+        self.newline = newline
+
+    def strip(self):
+        "Like `str.strip`, this gets rid of the newline at the end"
+        return CIf(self.cond, self.if_block, self.else_block, False)
+
+    def write(self, out):
+        out.write('if (%s) ' % self.cond)
+        if self.else_block is None:
+            self.if_block.write(out, self.newline)
+        else:
+            self.if_block.write(out)
+            out.write(' else ')
+            self.else_block.write(out, self.newline)
+
+    def __str__(self):
+        return to_str(self)
 
 
 class CFunction:
-    def __init__(self, name, args=None, ret_type=None):
+    def __init__(self, name, args=None, ret_type=None, line=None):
         self.block = CBlock()
         self.name = name
         self.args = args
         self.ret_type = ret_type
+        self.line = line
 
-    def __str__(self):
+    def write(self, out):
         arg_str = ""
         if self.args:
             arg_str = "%s %s" % (self.args[1]['primitive'], self.args[0])
@@ -36,56 +92,237 @@ class CFunction:
             ret_type = self.ret_type['primitive']
         else:
             ret_type = 'void'
-        ret = "%s %s(%s)" % (ret_type, self.name, arg_str)
+        out.write("%s %s(%s)" % (ret_type, self.name, arg_str))
 
         if self.block.exprs:
-            ret += ' %s' % self.block
-            return ret
+            out.write(' ')
+            self.block.write(out)
         else:
-            ret += ';\n'
-            return ret
+            out.write(';\n')
+
+    def __str__(self):
+        return to_str(self)
+
+
+def write(node, out):
+    "Writes a statement, which is either a str or has a `write()` method"
+    if isinstance(node, str):
+        out.write(node)
+    else:
+        node.write(out)
+
+
+def to_str(node):
+    out = io.StringIO()
+    node.write(out)
+    return out.getvalue()
+
+
+# Runtime files are read the first time they're needed, and then kept
+runtime_sources = {}
+
+
+def load_runtime(name='runtime.c'):
+    """Returns the contents of `name`, which is 'runtime.c',
+    or 'runtime.h' if the runtime gets linked in separately"""
+    source = runtime_sources.get(name)
+    if source is None:
+        with open(pathlib.Path(__file__).resolve().parent / name) as rts:
+            source = rts.read()
+        # runtime.c has the declarations from runtime.h, but the C it's
+        #   pasted into won't be next to runtime.h, so paste that in too
+        include = '#include "runtime.h"\n'
+        if include in source:
+            source = source.replace(include, load_runtime('runtime.h'))
+        runtime_sources[name] = source
+    return source
+
+
+# The int operators `Module(checked=True)` checks for overflow
+checked_names = {'+': 'add', '-': 'sub', '*': 'mul'}
+checked_ops = '''static _Thread_local int phhe_overflow = 0;
+// How many calls deep we are, which can't go past `phhe_max_depth`
+static _Thread_local int phhe_depth = 0;
+int phhe_max_depth = 1000;
+
+int phhe_overflowed() {
+    int ret = phhe_overflow;
+    phhe_overflow = 0;
+    return ret;
+}
+''' + ''.join('''
+static int phhe_%s(int a, int b) {
+    int ret;
+    if (__builtin_%s_overflow(a, b, &ret))
+        phhe_overflow = 1;
+    return ret;
+}
+''' % (i, i) for i in checked_names.values()) + '\n'
 
 
 class Module:
-    def __init__(self):
-        self.functions = [CFunction('main', ret_type={'primitive': 'int'})]
+    def __init__(self, runtime='runtime.c', filename=None, counters=False,
+                 imports=None, init=None, checked=False):
+        """With a `filename`, the C has `#line` directives pointing there.
+        With `counters`, every function counts its calls and times itself,
+        and the program prints them all when it exits.
+        `imports` is {name: type} for functions defined in other modules,
+        and with `init`, this is one of those modules, called `init`.
+        Then instead of `main` the top level goes in `init$init()`,
+        which only runs the first time it's called. See `build`.
+        With `checked`, int +, - and * that overflow still wrap, but
+        `phhe_overflowed()` returns 1 the next time it's called, see `tiered`.
+        Going more than `phhe_max_depth` calls deep does that too, and
+        after that every call returns straight away, so it unwinds quickly"""
+        self.runtime = runtime
+        self.filename = filename
+        self.counters = counters
+        self.checked = checked
+        # Global declarations, which go before all the functions
+        self.globals = [checked_ops] if checked else []
+        # The line of the source we're generating C for
+        self.line = None
+        if init is None:
+            self.functions = [CFunction('main', ret_type={'primitive': 'int'})]
+        else:
+            self.functions = [CFunction('%s$init' % init)]
         self.block = [self.functions[0].block]
-        self.type_ctx = Context()
         self.name_ctx = Context()
+        # The types of every node, worked out once by `gen_module`
+        self.types = Inference()
 
         self.name_ctx.add_binding('print', 'print')
-        self.type_ctx.add_binding('print', Function(
-            'print', ('i', {'primitive': 'int'}), None, None).type(self.type_ctx))
+        # Modules we've declared the `init` function of
+        self.imported = set()
+        if init is not None:
+            self.add('static int done$ = 0')
+            self.add('if (done$) return')
+            self.add('done$ = 1')
+        for name, t in (imports or {}).items():
+            self.declare(name, t)
 
         self.var_number = 0
+        # (function node, whether it tail calls itself) for each function
+        #   we're generating, innermost last
+        self.fun_stack = []
 
     def push(self):
         self.name_ctx.push_scope()
-        self.type_ctx.push_scope()
 
     def pop(self):
         self.name_ctx.pop_scope()
-        self.type_ctx.pop_scope()
+
+    def declare(self, name, t):
+        "Declares a function from another module, which has the type `t`"
+        args = None
+        if t['argument'] != NULL:
+            args = ('x', t['argument'])
+        self.globals.append(to_str(CFunction(name, args, t['return'])))
+        self.name_ctx.add_binding(name, name)
+        self.types.ctx.add_binding(name, t)
+
+    def add_import(self, name):
+        "Returns the call that runs the top level of the module `name`"
+        if name not in self.imported:
+            self.imported.add(name)
+            self.globals.append('void %s$init();\n' % name)
+        return '%s$init()' % name
 
     def add_fun(self, node):
         self.push()
 
         if node.args:
             self.name_ctx.add_binding(node.args[0], node.args[0])
-            self.type_ctx.add_binding(node.args[0], node.args[1])
-        node_type = node.type(self.type_ctx)
+        node_type = self.types[node]
 
-        self.start_fun(CFunction(node.name, node.args, node_type['return']))
+        fun = CFunction(node.name, node.args, node_type['return'], node.line)
+        # Declaring every function means it doesn't matter what order
+        #   they're written in
+        self.globals.append(to_str(CFunction(node.name, node.args,
+                                             node_type['return'])))
+        self.start_fun(fun)
 
         if node.body:
+            self.fun_stack.append([node, False])
             self.add_str(gen_expr(node.body, self, True))
+            if self.fun_stack.pop()[1]:
+                # Tail calls jump back here, see `tail_call`
+                fun.block.exprs.insert(0, 'tail$:')
 
         self.pop()
         self.end_fun()
 
+        if node.body and self.checked:
+            self.add_depth_check(fun)
+        if node.body and self.counters:
+            self.add_counter(fun)
+
         # Right now we don't do this scope-based name mangling for functions
         self.name_ctx.add_binding(node.name, node.name)
-        self.type_ctx.add_binding(node.name, node_type)
+
+    def add_depth_check(self, fun):
+        """Renames `fun` to `name$checked`, and puts a function that keeps
+        track of how deep the calls go in its place"""
+        name = fun.name
+        arg = fun.args[0] if fun.args else ''
+        returns = fun.ret_type and fun.ret_type['primitive'] != 'null'
+
+        fun.name = '%s$checked' % name
+        self.globals.append(to_str(CFunction(fun.name, fun.args, fun.ret_type)))
+
+        wrapper = CFunction(name, fun.args, fun.ret_type, fun.line)
+        give_up = CBlock()
+        give_up.add('phhe_overflow = 1')
+        give_up.add('return 0' if returns else 'return')
+        wrapper.block.add(CIf('phhe_overflow || phhe_depth >= phhe_max_depth',
+                              give_up).strip())
+        wrapper.block.add('phhe_depth++')
+        if returns:
+            wrapper.block.add('%s ret = %s(%s)' % (
+                fun.ret_type['primitive'], fun.name, arg))
+        else:
+            wrapper.block.add('%s(%s)' % (fun.name, arg))
+        wrapper.block.add('phhe_depth--')
+        if returns:
+            wrapper.block.add('return ret')
+        self.functions.append(wrapper)
+
+    def add_counter(self, fun):
+        """Renames `fun` to `name$body`, and puts a function that counts
+        and times calls in its place"""
+        name = fun.name
+        arg = fun.args[0] if fun.args else ''
+        returns = fun.ret_type and fun.ret_type['primitive'] != 'null'
+        counter = '%s$counter' % name
+
+        fun.name = '%s$body' % name
+        # `add_fun` declared `name` already
+        self.globals.append(to_str(CFunction(fun.name, fun.args, fun.ret_type)))
+        self.globals.append('struct phhe_counter %s = {"%s", "%s", %d};\n' % (
+            counter, name, self.filename or '', fun.line or 0))
+
+        wrapper = CFunction(name, fun.args, fun.ret_type, fun.line)
+        wrapper.block.add('phhe_enter(&%s)' % counter)
+        if returns:
+            wrapper.block.add('%s ret = %s(%s)' % (
+                fun.ret_type['primitive'], fun.name, arg))
+        else:
+            wrapper.block.add('%s(%s)' % (fun.name, arg))
+        wrapper.block.add('phhe_exit(&%s)' % counter)
+        if returns:
+            wrapper.block.add('return ret')
+        self.functions.append(wrapper)
+
+    def add(self, s, block=None):
+        "Adds the statement `s` to `block`, by default the current one"
+        if block is None:
+            block = self.block[-1]
+        if self.filename is not None and self.line is not None and \
+                block.line != self.line:
+            block.add(CLine(self.line, self.filename))
+        block.add(s)
+        # Anything with lines of its own moves the C line number on
+        block.line = self.line if isinstance(s, str) else None
 
     def start_block(self):
         block = CBlock()
@@ -110,48 +347,87 @@ class Module:
 
         r = "%s %s = %s" % (type['primitive'], fresh_name, value)
 
-        self.type_ctx.add_binding(name, type)
         self.name_ctx.add_binding(name, fresh_name)
 
-        self.block[-1].add(r)
+        self.add(r)
+
+    def tail_call(self, node):
+        """If the `Call` `node` is a call to the function we're in,
+        returns the statements that loop instead, otherwise None"""
+        if not self.fun_stack:
+            return None
+        fun = self.fun_stack[-1]
+        # The name could be a variable in here instead of the function
+        if node.function != fun[0].name or \
+                self.name_ctx.lookup(node.function) not in (None, node.function):
+            return None
+        fun[1] = True
+        if not fun[0].args:
+            return 'goto tail$'
+        return '%s = %s; goto tail$' % (fun[0].args[0],
+                                        gen_expr(node.args, self))
 
     def add_str(self, s):
         s = s.strip()
         if s:
-            self.block[-1].add(s)
+            self.add(s)
+
+    def write(self, out):
+        out.write(load_runtime(self.runtime))
+        out.write('\n')
+        self.write_definitions(out, self.functions)
+
+    def write_definitions(self, out, functions):
+        "Writes the globals, and then `functions` in reverse"
+        for i in self.globals:
+            out.write(i)
+        if self.globals:
+            out.write('\n')
+
+        for i in functions[::-1]:
+            if self.filename is not None and i.line is not None:
+                CLine(i.line, self.filename).write(out)
+            i.write(out)
+            out.write('\n')
 
     def __str__(self):
-        import pathlib
-        rts = open(pathlib.Path(__file__).resolve().parent / 'runtime.c')
-        ret = rts.read() + '\n'
-        rts.close()
-
-        for i in self.functions[::-1]:
-            ret += str(i) + '\n'
-
-        return ret
+        return to_str(self)
 
     def name(self, name):
         self.name_ctx.lookup(name)
 
-    def type(self, name):
-        self.type_ctx.lookup(type)
+    def type(self, node):
+        return self.types[node]
 
 
 def gen_expr(node, mod, is_return=False):
     return_string = "return " if is_return else ""
+    line = node.line
+    # Statements get added after the expression they're for is generated,
+    #   so they end up with the line of whatever came last in it
+    if line is not None:
+        mod.line = line
     if isinstance(node, Literal):
         return "%s%r" % (return_string, node.value)
     elif isinstance(node, BinOp):
+        if mod.checked and node.op in checked_names and \
+                mod.types[node] == {'primitive': 'int'}:
+            return "%sphhe_%s(%s, %s)" % (
+                return_string,
+                checked_names[node.op],
+                gen_expr(node.lhs, mod),
+                gen_expr(node.rhs, mod))
         return "%s(%s) %s (%s)" % (
             return_string,
             gen_expr(node.lhs, mod),
             node.op,
             gen_expr(node.rhs, mod))
     elif isinstance(node, VarDeclare):
-        t = node.value.type(mod.type_ctx)
-        mod.add_var(t, node.name, gen_expr(
-            node.value, mod))
+        t = mod.types[node.value]
+        value = gen_expr(node.value, mod)
+        if line is not None:
+            mod.line = line
+        mod.add_var(t, node.name, value)
         return ''
 
     elif isinstance(node, VarAccess):
@@ -164,13 +440,17 @@ def gen_expr(node, mod, is_return=False):
         for expr in node.exprs:
             i += 1
             mod.add_str(ret)
-            ret = '%s' % gen_expr(
-                expr, mod, is_return and (i == len(node.exprs)))
+            ret = gen_expr(expr, mod, is_return and (i == len(node.exprs)))
 
         mod.pop()
         return ret
 
     elif isinstance(node, Call):
+        if is_return:
+            # Calling ourselves last is just a loop
+            loop = mod.tail_call(node)
+            if loop is not None:
+                return loop
         return "%s%s(%s)" % (return_string, node.function, gen_expr(node.args, mod))
 
     elif isinstance(node, Function):
@@ -178,6 +458,9 @@ def gen_expr(node, mod, is_return=False):
 
         return ''
 
+    elif isinstance(node, Import):
+        return mod.add_import(node.name)
+
     elif isinstance(node, If):
         mod.push()
         cond = gen_expr(node.cond, mod)
@@ -185,29 +468,45 @@ def gen_expr(node, mod, is_return=False):
         true = CBlock()
         mod.block.append(true)
         mod.push()
-        true.add(gen_expr(node.if_branch, mod, is_return))
+        mod.add(gen_expr(node.if_branch, mod, is_return), true)
         mod.pop()
         mod.end_block()
 
+        false = None
         if node.else_branch is not None:
             false = CBlock()
             mod.block.append(false)
             mod.push()
-            false.add(gen_expr(node.else_branch, mod, is_return))
+            mod.add(gen_expr(node.else_branch, mod, is_return), false)
             mod.pop()
             mod.end_block()
-            ret = 'if (%s) %s else %s' % (cond, true, false)
-        else:
-            ret = 'if (%s) %s' % (cond, true)
         mod.pop()
-        return ret
+        # The `if` itself goes wherever the `If` started
+        if line is not None:
+            mod.line = line
+        return CIf(cond, true, false)
 
 
-def codegen(nodes):
-    ret = Module()
+def gen_module(nodes, runtime='runtime.c', filename=None, counters=False,
+               imports=None, init=None, checked=False):
+    ret = Module(runtime, filename, counters, imports, init, checked)
 
     for node in nodes:
         # Pattern matching would be awesome here
+        ret.types.infer(node)
         ret.add_str(gen_expr(node, ret))
 
-    return str(ret)
+    return ret
+
+
+def codegen(nodes, out=None, runtime='runtime.c', filename=None,
+            counters=False):
+    """Returns the C code for `nodes` as a str,
+    or if `out` is given, writes it there bit by bit instead.
+    With `runtime='runtime.h'` the runtime is declared but not included,
+    so it has to be linked in.
+    `filename` and `counters` are like for `Module`"""
+    mod = gen_module(nodes, runtime, filename, counters)
+    if out is None:
+        return str(mod)
+    mod.write(out)
@@ -0,0 +1,174 @@
+"""Runs the stages of the compiler, only as far as they're needed
+
+    parse -> optimize -> check types -> emit C
+                                     -> interpret
+                                     -> transpile to Python and run that
+                                     -> compile with cc and run
+                                     -> compile with cc and load it
+
+or for a program made of modules, compile each one with cc and link them.
+
+Each stage is timed, so `--time` can say where the time goes.
+`compile` and `run` are the short way to do the whole thing from Python,
+they're also `phhe.compile` and `phhe.run`.
+"""
+
+import contextlib
+import time
+from .ast import *
+from . import pratt
+from .astcache import ASTCache
+from .build import Build, link
+from .codegen import codegen
+from .infer import infer
+from .native import NativeCache
+from .optimize import optimize
+from .pyback import transpile
+from .tiered import Tiers
+from . import shared
+
+
+class Timings:
+    "How long each stage took, in the order they ran"
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # [name, seconds], a stage that runs twice is added up
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            for i in self.stages:
+                if i[0] == name:
+                    i[1] += elapsed
+                    break
+            else:
+                self.stages.append([name, elapsed])
+
+    def total(self):
+        return sum(i[1] for i in self.stages)
+
+    def report(self):
+        lines = ['%-10s %10.6fs' % (name, seconds)
+                 for name, seconds in self.stages]
+        lines.append('%-10s %10.6fs' % ('total', self.total()))
+        return '\n'.join(lines)
+
+
+class Driver:
+    """Holds the options that apply to every stage.
+    With `cache`, parsing goes through the on-disk AST cache.
+    With `tiered`, the interpreter compiles functions to C once they've
+    been called that many times, see `tiered`"""
+
+    def __init__(self, level=1, cache=False, counters=False, timings=None,
+                 tiered=None):
+        self.level = level
+        self.cache = ASTCache() if cache is True else cache or None
+        self.counters = counters
+        self.timings = timings or Timings()
+        self.tiered = tiered
+
+    def parse(self, source):
+        "`source` is the program as a str"
+        with self.timings.stage('parse'):
+            if self.cache is not None:
+                return self.cache.parse(source.encode())
+            return pratt.parse(source)
+
+    def parse_file(self, path):
+        """Parses the file at `path`, with any modules it imports put in,
+        see `build.link`"""
+        tree = self.parse_one(path)
+        if any(isinstance(i, Import) for i in tree.exprs):
+            tree = link(path, self.parse_one, tree)
+        return tree
+
+    def parse_one(self, path):
+        "Parses just the file at `path`"
+        with self.timings.stage('read'):
+            with open(path) as f:
+                source = f.read()
+        return self.parse(source)
+
+    def optimize(self, tree):
+        with self.timings.stage('optimize'):
+            return optimize(tree, self.level)
+
+    def check(self, tree):
+        "Raises a TypeCheckError if `tree` doesn't type check"
+        with self.timings.stage('check'):
+            return infer(tree)
+
+    def emit(self, tree, out=None, filename=None, runtime='runtime.c'):
+        "Like `codegen`, which type checks as it goes"
+        with self.timings.stage('codegen'):
+            return codegen([tree], out, runtime, filename, self.counters)
+
+    def interpret(self, tree, ctx=None):
+        if ctx is None:
+            ctx = Context()
+            if self.tiered is not None:
+                ctx.tiers = Tiers(tree, self.tiered)
+        with self.timings.stage('interpret'):
+            return tree.eval(ctx)
+
+    def transpile(self, tree, filename='<phhe>'):
+        "Returns a `PythonProgram`, see `pyback`"
+        with self.timings.stage('transpile'):
+            return transpile(tree, filename)
+
+    def run_python(self, tree, ctx=None, filename='<phhe>'):
+        "Like `interpret`, but it runs `tree` as Python"
+        program = self.transpile(tree, filename)
+        with self.timings.stage('execute'):
+            return program.run(ctx)
+
+    def execute(self, tree, filename=None, native=None, **kwargs):
+        """Compiles `tree` with cc and runs it, with `kwargs` passed to
+        `subprocess.run`. Returns the `CompletedProcess`"""
+        native = native or NativeCache()
+        c = self.emit(tree, filename=filename, runtime='runtime.h')
+        with self.timings.stage('cc'):
+            native.build(c)
+        with self.timings.stage('execute'):
+            # It's cached now, so this only runs it
+            return native.run(c, **kwargs)
+
+    def load(self, tree, filename=None, native=None):
+        """Compiles `tree` into a shared library and loads it into this
+        process, see `shared`. Returns the `SharedProgram`"""
+        with self.timings.stage('load'):
+            return shared.load(tree, native, self.counters, filename)
+
+    def build(self, path, dest=None, directory=None, native=None):
+        """Compiles the program at `path` and its modules to an executable
+        at `dest`, only recompiling the modules that need it, see `build`.
+        Returns the `Build`"""
+        build = Build(directory, self.level, native)
+        with self.timings.stage('build'):
+            build.build(path, dest)
+        return build
+
+
+def compile(source, level=1, filename=None, counters=False):
+    "Returns the C for the program `source`"
+    driver = Driver(level, counters=counters)
+    return driver.emit(driver.optimize(driver.parse(source)), filename=filename)
+
+
+def run(source, level=1, ctx=None):
+    "Interprets the program `source`, and returns its value"
+    driver = Driver(level)
+    return driver.interpret(driver.optimize(driver.parse(source)), ctx)
+
+
+def check(source):
+    "Raises a TypeCheckError if `source` doesn't type check"
+    driver = Driver(0)
+    driver.check(driver.parse(source))
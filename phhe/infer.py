@@ -0,0 +1,144 @@
+"""Type inference in one pass over the AST
+
+The `type()` methods on AST nodes work things out again every time they're
+asked, so asking for the type of every declaration in nested functions and
+blocks walks the same subtrees over and over.
+This walks the tree once and remembers the type of every node it sees,
+which `codegen` then looks up instead.
+
+The types are the same dicts `type()` gives, and the rules are the same,
+except that scopes follow the generated C (an `If` branch is its own scope)
+and every function's argument is in scope in its body, even for nested
+functions.
+The types are kept in a table next to the tree, not on the nodes, so the
+nodes still compare equal to freshly parsed ones.
+"""
+
+from .ast import *
+
+
+class Inference:
+    def __init__(self):
+        # id(node) -> (node, type). Keeping the node around means
+        #   its id can't be reused for another node
+        self.types = {}
+        self.ctx = Context()
+        self.ctx.add_binding('print', {'primitive': 'function',
+                                       'return': NULL,
+                                       'argument': {'primitive': 'int'}})
+
+    def __getitem__(self, node):
+        return self.types[id(node)][1]
+
+    def __contains__(self, node):
+        return id(node) in self.types
+
+    def get(self, node, default=None):
+        entry = self.types.get(id(node))
+        if entry is None:
+            return default
+        return entry[1]
+
+    def infer(self, node):
+        "Works out the type of `node` and everything in it, and returns it"
+        t = self.visit(node)
+        self.types[id(node)] = (node, t)
+        return t
+
+    def visit(self, node):
+        ctx = self.ctx
+        if isinstance(node, Literal):
+            return {'primitive': type(node.value).__name__}
+        elif isinstance(node, BinOp):
+            # Long chains nest on the left, so walk down those with a loop
+            spine = []
+            while isinstance(node, BinOp):
+                spine.append(node)
+                node = node.lhs
+            t = self.infer(node)
+            for i in reversed(spine):
+                rhs_t = self.infer(i.rhs)
+                # Like `BinOp.type`, mixing types gives null, for now
+                t = t if t == rhs_t else NULL
+                if i is not spine[0]:
+                    self.types[id(i)] = (i, t)
+            return t
+        elif isinstance(node, VarAccess):
+            return ctx.lookup(node.name)
+        elif isinstance(node, VarDeclare):
+            ctx.add_binding(node.name, self.infer(node.value))
+            return NULL
+        elif isinstance(node, Block):
+            t = None
+            ctx.push_scope()
+            for i in node.exprs:
+                t = self.infer(i)
+            ctx.pop_scope()
+            return t
+        elif isinstance(node, If):
+            return self.visit_if(node)
+        elif isinstance(node, Call):
+            self.infer(node.args)
+            fun = ctx.lookup(node.function)
+            if fun:
+                return fun['return']
+            return NULL
+        elif isinstance(node, Function):
+            return self.visit_function(node)
+        # Anything else knows its own type
+        return node.type(ctx)
+
+    def visit_if(self, node):
+        ctx = self.ctx
+        ctx.push_scope()
+        self.infer(node.cond)
+        branches = []
+        for i in (node.if_branch, node.else_branch):
+            if i is not None:
+                ctx.push_scope()
+                branches.append(self.infer(i))
+                ctx.pop_scope()
+        ctx.pop_scope()
+
+        # It doesn't return anything if there isn't an else branch
+        if len(branches) == 2:
+            t1, t2 = branches
+            if t1 != t2:
+                raise TypeCheckError(
+                    "Incompatible types for 'if' branches: %r and %r"
+                    % (t1, t2))
+            return t1
+
+    def visit_function(self, node):
+        ctx = self.ctx
+        arg_t = node.args[1] if node.args else NULL
+        ret_t = node.ret_type
+        if node.body is not None:
+            ctx.push_scope()
+            if node.args:
+                ctx.add_binding(node.args[0], node.args[1])
+            if node.ret_type is not None:
+                # With a declared return type, the body can call itself
+                ctx.add_binding(node.name, {'primitive': 'function',
+                                            'return': node.ret_type,
+                                            'argument': arg_t})
+            body_t = self.infer(node.body)
+            ctx.pop_scope()
+            if node.ret_type is None:
+                ret_t = body_t
+            elif body_t != node.ret_type:
+                raise TypeCheckError('Wrong return type %r, really returns %r'
+                                     % (node.ret_type, body_t))
+        elif ret_t is None:
+            ret_t = NULL
+
+        t = {'primitive': 'function', 'return': ret_t, 'argument': arg_t}
+        ctx.add_binding(node.name, t)
+        return t
+
+
+def infer(tree):
+    "Returns an `Inference` with the types of everything in `tree`"
+    ret = Inference()
+    ret.infer(tree)
+    return ret
@@ -0,0 +1,127 @@
+"""Compiles generated C with the system C compiler, and caches the results
+
+Executables are stored under a hash of the C code, the compiler and its flags,
+so running an unchanged program again skips the compiler entirely.
+The runtime is compiled once into an object file that every program links
+against, which is why the C handed to `build()` should be generated with
+`codegen(..., runtime='runtime.h')`.
+It can build shared libraries too, which `shared` loads into this process.
+
+Several processes can share a cache directory: everything is built under a
+temporary name and renamed into place, which is atomic.
+"""
+
+import hashlib
+import os
+import shlex
+import subprocess
+import tempfile
+from .codegen import load_runtime
+
+
+default_dir = os.path.join(
+    os.environ.get('PHHE_CACHE_DIR') or
+    os.path.join(os.path.expanduser('~'), '.cache', 'phhe'), 'native')
+
+
+class NativeCache:
+    def __init__(self, path=None, cc=None, flags=None, max_entries=64):
+        self.path = path or default_dir
+        self.cc = cc or os.environ.get('CC') or 'cc'
+        if flags is None:
+            flags = shlex.split(os.environ.get('CFLAGS', '-O2'))
+        self.flags = list(flags)
+        self.max_entries = max_entries
+
+    def hash(self, *parts):
+        h = hashlib.sha256()
+        for i in [self.cc] + self.flags + list(parts):
+            h.update(i.encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def compile(self, args, dest, suffix):
+        """Runs the compiler on a temporary output file,
+        then renames that to `dest`"""
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=suffix + '.tmp')
+        os.close(fd)
+        try:
+            subprocess.run([self.cc] + self.flags + args + ['-o', tmp],
+                           check=True)
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def compile_source(self, source, args, dest, suffix):
+        "Like `compile`, but for C code that's in a str"
+        fd, c_file = tempfile.mkstemp(dir=self.path, suffix='.c')
+        with os.fdopen(fd, 'w') as f:
+            f.write(source)
+        try:
+            self.compile(args + [c_file], dest, suffix)
+        finally:
+            os.remove(c_file)
+
+    def runtime_object(self, pic=False):
+        "Returns the path of the compiled runtime, building it if needed"
+        extra = ['-fPIC'] if pic else []
+        source = load_runtime('runtime.c')
+        obj = os.path.join(self.path, 'runtime-%s.o' % self.hash(source, *extra))
+        if not os.path.exists(obj):
+            os.makedirs(self.path, exist_ok=True)
+            self.compile_source(source, ['-c'] + extra, obj, '.o')
+        return obj
+
+    def build(self, source, shared=False):
+        """Returns the path of an executable for the C code `source`,
+        compiling it if it isn't cached yet.
+        With `shared`, it's a shared library instead, for `shared.load`"""
+        extra = ['-shared', '-fPIC'] if shared else []
+        suffix = '.so' if shared else '.exe'
+        exe = os.path.join(self.path, self.hash(load_runtime('runtime.c'),
+                                                source, *extra) + suffix)
+        try:
+            # Using an entry counts as a use for eviction
+            os.utime(exe)
+            return exe
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(self.path, exist_ok=True)
+        runtime = self.runtime_object(pic=shared)
+        self.compile_source(source, extra + [runtime], exe, suffix)
+        self.evict()
+        return exe
+
+    def run(self, source, **kwargs):
+        """Builds and runs `source`, with `kwargs` passed to `subprocess.run`.
+        Returns the `CompletedProcess`"""
+        exe = self.build(source)
+        try:
+            return subprocess.run([exe], **kwargs)
+        except FileNotFoundError:
+            # Another process evicted it between building and running
+            return subprocess.run([self.build(source)], **kwargs)
+
+    def entries(self):
+        "(mtime, path) for each cached executable or library, oldest first"
+        ret = []
+        for i in os.scandir(self.path):
+            if i.name.endswith(('.exe', '.so')):
+                try:
+                    ret.append((i.stat().st_mtime, i.path))
+                except OSError:
+                    pass
+        ret.sort()
+        return ret
+
+    def evict(self):
+        """Deletes the least recently used entries over `max_entries`.
+        A library that's loaded keeps working after it's deleted"""
+        entries = self.entries()
+        for mtime, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
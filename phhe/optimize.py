@@ -0,0 +1,247 @@
+"""An optimizer that runs on the AST, before `eval` or `codegen`
+
+    -O0  does nothing
+    -O1  folds arithmetic on literals, and drops `If` branches that can't run
+    -O2  also replaces variables that hold a known literal with the literal,
+         and deletes declarations of variables that are never used
+
+It never changes what a program prints or returns, in either engine.
+That's why some things that look foldable aren't:
+`1 / 2` is 0.5 in the interpreter but 0 in C, so int division stays,
+and ints that don't fit in a C int stay as they are.
+Scoping is dynamic, so constants are never propagated into function bodies:
+there a name means whatever the caller has, not what's around the definition.
+
+`optimize` returns a new tree and doesn't change the one it's given.
+"""
+
+import math
+import operator
+from .ast import *
+from .purity import walk
+
+
+ops = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv
+}
+
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+# In a scope, this means we don't know what the variable holds
+UNKNOWN = object()
+
+
+def fold(lhs, op, rhs):
+    """Returns the `Literal` for `lhs op rhs`, or None if we can't work it out.
+    Both sides have to be the same type, since C and Python
+    don't agree on what mixing them does"""
+    if not (isinstance(lhs, Literal) and isinstance(rhs, Literal)):
+        return None
+    a = lhs.value
+    b = rhs.value
+    if type(a) is not type(b) or type(a) not in (int, float):
+        return None
+    if op == '/' and (type(a) is int or b == 0):
+        return None
+    fn = ops.get(op)
+    if fn is None:
+        return None
+
+    value = fn(a, b)
+    if type(value) is int and not INT_MIN <= value <= INT_MAX:
+        return None
+    if type(value) is float and not math.isfinite(value):
+        return None
+    return Literal(value)
+
+
+def constant(node):
+    "Whether `node` is a literal number, so we know how an `If` on it goes"
+    return isinstance(node, Literal) and type(node.value) in (int, float)
+
+
+def declared_names(node):
+    """Names that running `node` could declare in the current scope.
+    This includes ones inside nested blocks, which is more than it has to"""
+    ret = set()
+    for i in walk(node):
+        if isinstance(i, (VarDeclare, Function)):
+            ret.add(i.name)
+    return ret
+
+
+def leaks(node):
+    """Whether `node` declares something in the scope it runs in.
+    An `If` doesn't have its own scope in the interpreter but does in C,
+    so we can't take a branch like that out of its `If`"""
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        if isinstance(node, (VarDeclare, Function)):
+            return True
+        elif isinstance(node, BinOp):
+            todo.append(node.lhs)
+            todo.append(node.rhs)
+        elif isinstance(node, If):
+            todo.append(node.cond)
+            todo.append(node.if_branch)
+            if node.else_branch is not None:
+                todo.append(node.else_branch)
+        elif isinstance(node, Call):
+            todo.append(node.args)
+    return False
+
+
+def removable(node):
+    "Whether evaluating `node` does nothing besides giving a value"
+    return isinstance(node, (Literal, VarAccess))
+
+
+class Optimizer:
+    def __init__(self, level=1):
+        self.level = level
+        # Known values of variables, like `Context.stack`
+        self.scopes = [{}]
+
+    def lookup(self, name):
+        for i in reversed(self.scopes):
+            if name in i:
+                v = i[name]
+                return None if v is UNKNOWN else v
+
+    def forget(self, names):
+        for i in names:
+            self.scopes[-1][i] = UNKNOWN
+
+    def visit(self, node):
+        ret = self.visit_node(node)
+        # New nodes keep the line of the one they replace
+        if isinstance(ret, DictEq) and ret.line is None:
+            ret.line = node.line
+        return ret
+
+    def visit_node(self, node):
+        if isinstance(node, BinOp):
+            # Long chains nest on the left, so walk down those with a loop
+            spine = []
+            while isinstance(node, BinOp):
+                spine.append(node)
+                node = node.lhs
+            ret = self.visit(node)
+            for i in reversed(spine):
+                rhs = self.visit(i.rhs)
+                ret = fold(ret, i.op, rhs) or BinOp(ret, i.op, rhs)
+                ret.line = i.line
+            return ret
+        elif isinstance(node, VarAccess):
+            if self.level >= 2:
+                value = self.lookup(node.name)
+                if value is not None:
+                    return value
+            return node
+        elif isinstance(node, VarDeclare):
+            value = self.visit(node.value)
+            # A None value doesn't hide outer variables, so only
+            #   literals we can see aren't None count
+            known = isinstance(value, Literal) and value.value is not None
+            self.scopes[-1][node.name] = value if known else UNKNOWN
+            return VarDeclare(node.name, value)
+        elif isinstance(node, If):
+            return self.visit_if(node)
+        elif isinstance(node, Block):
+            self.scopes.append({})
+            exprs = [self.visit(i) for i in node.exprs]
+            self.scopes.pop()
+            # Things that do nothing don't need to be there,
+            #   unless they're the value of the block
+            last = exprs[-1:]
+            exprs = [i for i in exprs[:-1]
+                     if not (isinstance(i, Literal) or i == Block())]
+            return Block(*(exprs + last))
+        elif isinstance(node, Call):
+            return Call(node.function, self.visit(node.args))
+        elif isinstance(node, Function):
+            self.forget([node.name])
+            if node.body is None:
+                return node
+            # The body only sees what the caller has, which we don't know
+            outer = self.scopes
+            self.scopes = [{node.args[0]: UNKNOWN} if node.args else {}]
+            body = self.visit(node.body)
+            self.scopes = outer
+            return Function(node.name, node.args, body, node.ret_type)
+        return node
+
+    def visit_if(self, node):
+        cond = self.visit(node.cond)
+        if constant(cond):
+            branch = node.if_branch if cond.value != 0 else node.else_branch
+            if branch is None:
+                # An `If` that doesn't run anything
+                return Block()
+            if not leaks(branch):
+                return self.visit(branch)
+
+        branches = []
+        for i in (node.if_branch, node.else_branch):
+            if i is None:
+                branches.append(None)
+                continue
+            self.scopes.append({})
+            branches.append(self.visit(i))
+            self.scopes.pop()
+            # In the interpreter these stay after the `If`, but we don't
+            #   know which branch ran
+            self.forget(declared_names(i))
+        return If(cond, *branches)
+
+    def sweep(self, tree):
+        "Deletes declarations of variables that are never read"
+        used = set()
+        for i in walk(tree):
+            if isinstance(i, VarAccess):
+                used.add(i.name)
+            elif isinstance(i, Call):
+                used.add(i.function)
+        return self.sweep_node(tree, used)
+
+    def sweep_node(self, node, used):
+        ret = self.sweep_children(node, used)
+        ret.line = node.line
+        return ret
+
+    def sweep_children(self, node, used):
+        if isinstance(node, Block):
+            exprs = [self.sweep_node(i, used) for i in node.exprs]
+            last = exprs[-1:]
+            exprs = [i for i in exprs[:-1]
+                     if not (isinstance(i, VarDeclare) and
+                             i.name not in used and removable(i.value))]
+            return Block(*(exprs + last))
+        elif isinstance(node, If):
+            else_branch = node.else_branch
+            if else_branch is not None:
+                else_branch = self.sweep_node(else_branch, used)
+            return If(node.cond, self.sweep_node(node.if_branch, used),
+                      else_branch)
+        elif isinstance(node, Function) and node.body is not None:
+            return Function(node.name, node.args,
+                            self.sweep_node(node.body, used), node.ret_type)
+        return node
+
+    def optimize(self, tree):
+        if self.level <= 0:
+            return tree
+        tree = self.visit(tree)
+        if self.level >= 2:
+            tree = self.sweep(tree)
+        return tree
+
+
+def optimize(tree, level=1):
+    "Returns an optimized copy of `tree`, `level` is like the -O flag"
+    return Optimizer(level).optimize(tree)
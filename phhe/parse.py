@@ -10,6 +10,67 @@ def parse_file(path):
     return exprs.parse(source)
 
 
+class Packrat:
+    """Memoizes parsers by input offset, so backtracking never parses
+    the same text with the same parser twice.
+    It's off by default, turn it on with `enable_packrat()`"""
+
+    def __init__(self):
+        self.enabled = False
+        self.max_entries = 100000
+        self.table = {}
+        # The table is only good for one input, so we remember which
+        self.stream = None
+
+    def clear(self):
+        self.table.clear()
+        self.stream = None
+
+
+packrat_state = Packrat()
+
+
+def enable_packrat(max_entries=100000):
+    """Turns on memoization for the parsers wrapped with `packrat`.
+    At most `max_entries` results are kept, the oldest are dropped first"""
+    packrat_state.clear()
+    packrat_state.max_entries = max_entries
+    packrat_state.enabled = True
+
+
+def disable_packrat():
+    packrat_state.enabled = False
+    packrat_state.clear()
+
+
+def packrat(parser):
+    "Wraps a parser so it's memoized when packrat parsing is enabled"
+    state = packrat_state
+
+    @Parser
+    def memo_parser(stream, index):
+        if not state.enabled:
+            return parser(stream, index)
+
+        table = state.table
+        if stream is not state.stream:
+            table.clear()
+            state.stream = stream
+
+        key = (parser, index)
+        result = table.get(key)
+        if result is None:
+            result = parser(stream, index)
+            if table and len(table) >= state.max_entries:
+                # Parsing goes left to right, so the oldest entries are
+                #   the least likely to be needed again
+                del table[next(iter(table))]
+            table[key] = result
+        return result
+
+    return memo_parser
+
+
 # These parsers return strings, and are used in other parsers
 
 # Newlines can't be ignored, because we don't use semicolons
@@ -20,8 +81,8 @@ ident_char = regex(r'[a-zA-Z_0-9]')
 full_identifier = ident_start + ident_char.many().concat()
 keyword = string_from('fun', 'let') << ident_char.should_fail('keyword')
 # An identifier that isn't a keyword
-identifier = keyword.should_fail(
-    'non-keyword identifier') >> full_identifier.desc('identifier')
+identifier = packrat(keyword.should_fail(
+    'non-keyword identifier') >> full_identifier.desc('identifier'))
 
 
 # These parsers return AST objects
@@ -44,6 +105,7 @@ def var_declare():
 
 # Some of this is adapted from the Parsy examples
 # See https://parsy.readthedocs.io/en/latest/howto/lexing.html#calculator
+@packrat
 @generate
 def mul_div():
     "Note that this function also matches simple expressions"
@@ -60,6 +122,7 @@ def mul_div():
     return lhs
 
 
+@packrat
 @generate('binary operator')
 def binop():
     "Note that this function also matches simple expressions"
@@ -75,10 +138,11 @@ def binop():
     return lhs
 
 
+@packrat
 @generate
 def expr():
     "Parses any expression"
-    r = yield fun | if_expr | var_declare | binop
+    r = yield fun | import_stmt | if_expr | var_declare | binop
     return r
 
 
@@ -108,6 +172,7 @@ def block():
     return r
 
 
+@packrat
 @generate
 def call():
     f = yield identifier << space
@@ -167,6 +232,14 @@ def fun():
         return Function(name, args, None, ret_type)
 
 
+@generate
+def import_stmt():
+    "`import name`, otherwise `import` is just a name"
+    yield string('import') >> regex(r'[ \t]+')
+    name = yield identifier << space
+    return Import(name)
+
+
 @generate
 def if_expr():
     yield string('if') << space
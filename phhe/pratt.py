@@ -0,0 +1,277 @@
+"""A hand-written lexer and precedence climbing parser
+
+This parses the same language as the parsy grammar in `parse.py`,
+and gives the same AST as `exprs.parse`,
+but it reads the source once into tokens and only backtracks in one place
+(an `if` that turns out not to be an if expression),
+so it doesn't re-parse the same text over and over.
+
+Every node gets the line it starts on, for `#line` directives and the like.
+
+It's a bit more relaxed than the parsy grammar: spaces are allowed anywhere
+on a line, so `( 3)` parses here and not there.
+Keywords have to be whole words, so things like `ifx then 1`,
+which the parsy grammar reads as `if x then 1`, are just identifiers here.
+"""
+
+import bisect
+import re
+from parsy import ParseError
+from .ast import *
+
+
+token_re = re.compile(r'''
+    (?P<space>[ \t]+)
+    # Newlines and comments can only go between expressions, so they're tokens
+  | (?P<nl>(?:[ \t]*(?:[\r\n\f\v]|\#[^\n]*))+)
+  | (?P<num>[0-9]+\.[0-9]+|[0-9]+)
+  | (?P<ident>[a-zA-Z_][a-zA-Z_0-9]*)
+  | (?P<punct>[-+*/=(){}:])
+''', re.VERBOSE)
+
+# These can't be used as identifiers
+keywords = ('fun', 'let')
+
+# Binary operators and how tightly they bind
+precedence = {'+': 1, '-': 1, '*': 2, '/': 2}
+
+
+def tokenize(source):
+    """Returns a list of (kind, text, start, end) tuples.
+    `kind` is 'num', 'ident', 'nl', 'eof', or the punctuation character itself"""
+    tokens = []
+    append = tokens.append
+    match = token_re.match
+    pos = 0
+    end = len(source)
+    while pos < end:
+        m = match(source, pos)
+        if m is None:
+            raise ParseError('a token', source, pos)
+        kind = m.lastgroup
+        start = pos
+        pos = m.end()
+        if kind == 'space':
+            continue
+        text = m.group(kind)
+        if kind == 'punct':
+            kind = text
+        append((kind, text, start, pos))
+    append(('eof', '', end, end))
+    return tokens
+
+
+class Parser:
+    def __init__(self, source, first_line=1):
+        """`first_line` is the line `source` starts on,
+        if it's only part of a file"""
+        self.source = source
+        self.tokens = tokenize(source)
+        self.i = 0
+        self.newlines = [m.start() for m in re.finditer('\n', source)]
+        self.first_line = first_line
+
+    def at(self, node, start):
+        "Gives `node` the line of token number `start`, and returns it"
+        node.line = bisect.bisect_left(self.newlines, self.tokens[start][2]) + \
+            self.first_line
+        return node
+
+    def error(self, expected):
+        raise ParseError(expected, self.source, self.tokens[self.i][2])
+
+    def peek(self):
+        return self.tokens[self.i]
+
+    def next(self):
+        tok = self.tokens[self.i]
+        self.i += 1
+        return tok
+
+    def expect(self, kind):
+        tok = self.tokens[self.i]
+        if tok[0] != kind:
+            self.error(kind)
+        self.i += 1
+        return tok
+
+    def expect_word(self, word):
+        tok = self.tokens[self.i]
+        if tok[0] != 'ident' or tok[1] != word:
+            self.error(word)
+        self.i += 1
+
+    def skip_newlines(self):
+        if self.tokens[self.i][0] == 'nl':
+            self.i += 1
+
+    def identifier(self):
+        tok = self.tokens[self.i]
+        if tok[0] != 'ident' or tok[1] in keywords:
+            self.error('identifier')
+        self.i += 1
+        return tok[1]
+
+    def is_identifier(self, tok):
+        return tok[0] == 'ident' and tok[1] not in keywords
+
+    def signed_number(self):
+        "Whether we're at a `+` or `-` that's part of a number literal"
+        tok = self.tokens[self.i]
+        if tok[0] == '+' or tok[0] == '-':
+            after = self.tokens[self.i + 1]
+            return after[0] == 'num' and after[2] == tok[3]
+        return False
+
+    def starts_expr(self):
+        kind, text = self.tokens[self.i][:2]
+        if kind == 'ident':
+            return text != 'let'
+        return kind in ('num', '{', '(') or self.signed_number()
+
+    def exprs(self):
+        "Expressions separated by newlines or nothing at all, like `exprs`"
+        self.skip_newlines()
+        start = self.i
+        es = []
+        while self.starts_expr():
+            es.append(self.expr())
+            self.skip_newlines()
+        return self.at(Block(*es), start)
+
+    def expr(self):
+        tok = self.tokens[self.i]
+        if tok[0] == 'ident':
+            if tok[1] == 'fun':
+                return self.fun()
+            if tok[1] == 'import' and \
+                    self.is_identifier(self.tokens[self.i + 1]):
+                start = self.i
+                self.i += 1
+                return self.at(Import(self.identifier()), start)
+            if tok[1] == 'if':
+                start = self.i
+                try:
+                    return self.if_expr()
+                except ParseError:
+                    # Then `if` is just a name
+                    self.i = start
+            if tok[1] not in keywords and self.tokens[self.i + 1][0] == '=':
+                return self.var_declare()
+        return self.binop()
+
+    def var_declare(self):
+        start = self.i
+        name = self.identifier()
+        self.expect('=')
+        return self.at(VarDeclare(name, self.expr()), start)
+
+    def binop(self, min_precedence=1):
+        start = self.i
+        lhs = self.simple()
+        while True:
+            kind = self.tokens[self.i][0]
+            prec = precedence.get(kind)
+            if prec is None or prec < min_precedence:
+                return lhs
+            self.i += 1
+            rhs = self.binop(prec + 1)
+            lhs = self.at(BinOp(lhs, kind, rhs), start)
+
+    def simple(self):
+        "A literal, block, call, variable or parenthesised expression"
+        start = self.i
+        tok = self.tokens[start]
+        kind = tok[0]
+        if kind == 'num' or self.signed_number():
+            text = tok[1]
+            if kind != 'num':
+                self.i += 1
+                text += self.tokens[self.i][1]
+            self.i += 1
+            if '.' in text:
+                return self.at(Literal(float(text)), start)
+            return self.at(Literal(int(text)), start)
+        elif kind == 'ident':
+            name = self.identifier()
+            if self.tokens[self.i][0] == '(':
+                self.i += 1
+                args = self.expr()
+                self.expect(')')
+                return self.at(Call(name, args), start)
+            return self.at(VarAccess(name), start)
+        elif kind == '{':
+            self.i += 1
+            r = self.exprs()
+            self.expect('}')
+            return self.at(r, start)
+        elif kind == '(':
+            self.i += 1
+            r = self.expr()
+            self.expect(')')
+            return r
+        self.error('an expression')
+
+    def type_dec(self):
+        self.expect('{')
+        ret = {}
+        while self.is_identifier(self.tokens[self.i]):
+            key = self.identifier()
+            self.expect(':')
+            ret[key] = self.identifier()
+        self.expect('}')
+        return ret
+
+    def fun(self):
+        start = self.i
+        self.expect_word('fun')
+        name = self.identifier()
+
+        self.expect('(')
+        args = None
+        if self.is_identifier(self.tokens[self.i]):
+            arg_name = self.identifier()
+            self.expect(':')
+            args = (arg_name, self.type_dec())
+        self.expect(')')
+
+        ret_type = None
+        if self.tokens[self.i][0] == ':':
+            self.i += 1
+            ret_type = self.type_dec()
+
+        if self.tokens[self.i][0] == '=':
+            self.i += 1
+            return self.at(Function(name, args, self.expr(), ret_type), start)
+        return self.at(Function(name, args, None, ret_type), start)
+
+    def if_expr(self):
+        start = self.i
+        self.expect_word('if')
+        cond = self.expr()
+        self.expect_word('then')
+        if_branch = self.expr()
+        else_branch = None
+        tok = self.tokens[self.i]
+        if tok[0] == 'ident' and tok[1] == 'else':
+            self.i += 1
+            else_branch = self.expr()
+        return self.at(If(cond, if_branch, else_branch), start)
+
+    def parse(self):
+        ret = self.exprs()
+        self.expect('eof')
+        return ret
+
+
+def parse(source):
+    "Parses a whole program, like `exprs.parse`"
+    return Parser(source).parse()
+
+
+def parse_file(path):
+    "A helper function that parses an entire file into an AST object"
+    file = open(path, 'r')
+    source = file.read()
+    file.close()
+    return parse(source)
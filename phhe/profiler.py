@@ -0,0 +1,207 @@
+"""A profiler for the interpreter
+
+While a `Profiler` is active, the `eval()` methods of the AST nodes and
+`Function.run` are swapped for versions that time themselves.
+They're put back afterwards, so when it's off, nothing costs anything extra.
+
+    with Profiler() as profiler:
+        tree.eval(Context())
+    print(profiler.report())
+
+It counts calls, cumulative time and self time for every node and every
+function, and keeps self time for each stack of function calls, which
+`write_collapsed` writes in the format flamegraph.pl and speedscope read.
+A tail call replaces the calling function on the stack, like it does in
+the interpreter.
+"""
+
+import sys
+import time
+from . import ast
+from .ast import *
+
+
+class Stats:
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        # Including everything it called, and without
+        self.total = 0.0
+        self.self_time = 0.0
+        # How many times it's on the stack right now. Only the outermost
+        #   one adds to `total`, so recursion isn't counted twice
+        self.active = 0
+
+
+def label(node):
+    "A short description of a node for reports"
+    if isinstance(node, Literal):
+        return 'Literal %r' % (node.value,)
+    elif isinstance(node, VarAccess):
+        return 'VarAccess %s' % node.name
+    elif isinstance(node, VarDeclare):
+        return 'VarDeclare %s' % node.name
+    elif isinstance(node, BinOp):
+        return 'BinOp %s' % node.op
+    elif isinstance(node, Call):
+        return 'Call %s' % node.function
+    elif isinstance(node, Function):
+        return 'Function %s' % node.name
+    return type(node).__name__
+
+
+# Only one profiler can have the methods swapped at once
+active = None
+
+
+class Profiler:
+    # The classes whose methods get timed
+    node_classes = (Literal, VarAccess, VarDeclare, BinOp, Call, If, Block,
+                    Function)
+    tail_classes = (Call, If, Block)
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # id(node) -> (node, Stats), the node keeps its id from being reused
+        self.nodes = {}
+        self.functions = {}
+        # Tuple of function names -> self time
+        self.stacks = {}
+        # [Stats, start, time in children] for each node being evaluated
+        self.node_stack = []
+        # [Function, Stats, start, time in children] for each call
+        self.function_stack = []
+        self.patched = []
+
+    def stats(self, table, node):
+        entry = table.get(id(node))
+        if entry is None:
+            entry = table[id(node)] = (node, Stats(label(node)))
+        return entry[1]
+
+    def enter(self, stack, stats, *extra):
+        stats.count += 1
+        stats.active += 1
+        stack.append(list(extra) + [stats, self.clock(), 0.0])
+
+    def exit(self, stack):
+        "Returns the self time of the frame that ended"
+        stats, start, children = stack[-1][-3:]
+        stack.pop()
+        elapsed = self.clock() - start
+        stats.active -= 1
+        if stats.active == 0:
+            stats.total += elapsed
+        stats.self_time += elapsed - children
+        if stack:
+            stack[-1][-1] += elapsed
+        return elapsed - children
+
+    def enter_function(self, function):
+        self.enter(self.function_stack, self.stats(self.functions, function),
+                   function)
+
+    def exit_function(self):
+        key = tuple(i[0].name for i in self.function_stack)
+        self_time = self.exit(self.function_stack)
+        self.stacks[key] = self.stacks.get(key, 0.0) + self_time
+
+    def patch(self, owner, name, wrapper):
+        original = owner.__dict__[name]
+        self.patched.append((owner, name, original))
+        setattr(owner, name, wrapper(original))
+
+    def wrap_eval(self, original):
+        def eval(node, ctx):
+            self.enter(self.node_stack, self.stats(self.nodes, node))
+            try:
+                return original(node, ctx)
+            finally:
+                self.exit(self.node_stack)
+        return eval
+
+    def wrap_run(self, original):
+        def run(function, ctx, args):
+            self.enter_function(function)
+            try:
+                return original(function, ctx, args)
+            finally:
+                self.exit_function()
+        return run
+
+    def wrap_tail_eval(self, original):
+        def tail_eval(node, ctx):
+            ret = original(node, ctx)
+            if type(ret) is TailCall and self.function_stack and \
+                    node is self.function_stack[-1][0].body:
+                # `Function.run` is going to loop around into another
+                #   function, so that one takes this one's place
+                self.exit_function()
+                self.enter_function(ret.function)
+            return ret
+        return tail_eval
+
+    def start(self):
+        global active
+        if active is not None:
+            raise RuntimeError("Another profiler is already running")
+        active = self
+        # The wrappers add a Python frame for every node and call,
+        #   so programs need more room to recurse
+        self.recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(self.recursion_limit * 3)
+        for cls in self.node_classes:
+            self.patch(cls, 'eval', self.wrap_eval)
+        for cls in self.tail_classes:
+            self.patch(cls, 'tail_eval', self.wrap_eval)
+        self.patch(Function, 'run', self.wrap_run)
+        self.patch(ast, 'tail_eval', self.wrap_tail_eval)
+        # Time outside any function goes to the program itself
+        self.enter_function(Function('<main>', None, None))
+
+    def stop(self):
+        global active
+        while self.function_stack:
+            self.exit_function()
+        # These only end early if there was an exception
+        while self.node_stack:
+            self.exit(self.node_stack)
+        while self.patched:
+            owner, name, original = self.patched.pop()
+            setattr(owner, name, original)
+        sys.setrecursionlimit(self.recursion_limit)
+        active = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def top(self, table, n):
+        return sorted((stats for node, stats in table.values()),
+                      key=lambda i: i.self_time, reverse=True)[:n]
+
+    def report(self, n=20):
+        "The `n` functions and nodes with the most self time, as a str"
+        lines = []
+        for title, table in [('functions', self.functions),
+                             ('nodes', self.nodes)]:
+            lines.append('Top %d %s by self time:' % (n, title))
+            lines.append('%10s %12s %12s  %s' % ('calls', 'total (s)',
+                                                  'self (s)', 'what'))
+            for i in self.top(table, n):
+                lines.append('%10d %12.6f %12.6f  %s' % (
+                    i.count, i.total, i.self_time, i.label))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        "Lines of `stack;of;names microseconds`, for flamegraph tools"
+        return ['%s %d' % (';'.join(key), round(t * 1e6))
+                for key, t in sorted(self.stacks.items())]
+
+    def write_collapsed(self, out):
+        for i in self.collapsed():
+            out.write(i + '\n')
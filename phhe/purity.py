@@ -0,0 +1,204 @@
+"""Finds pure functions, and memoizes calls to them in the interpreter
+
+A function is pure if what it returns only depends on its argument:
+it doesn't `print`, doesn't call functions without bodies (those are C
+functions), only calls pure functions, and doesn't read any variable it
+didn't declare itself.
+That last part matters because scoping is dynamic, so a function could
+otherwise see its caller's variables.
+
+To use it, give the `Context` a `Memo`:
+    ctx = Context(memo=Memo(tree))
+"""
+
+from collections import OrderedDict
+from .ast import *
+
+
+def walk(tree):
+    "Every node in the tree, in no particular order"
+    todo = [tree]
+    while todo:
+        node = todo.pop()
+        yield node
+        if isinstance(node, BinOp):
+            todo.append(node.lhs)
+            todo.append(node.rhs)
+        elif isinstance(node, If):
+            todo.append(node.cond)
+            todo.append(node.if_branch)
+            if node.else_branch is not None:
+                todo.append(node.else_branch)
+        elif isinstance(node, Function):
+            if node.body is not None:
+                todo.append(node.body)
+        elif isinstance(node, Call):
+            todo.append(node.args)
+        elif isinstance(node, VarDeclare):
+            todo.append(node.value)
+        elif isinstance(node, Block):
+            todo.extend(node.exprs)
+
+
+class Analysis:
+    """Works out which functions are pure. Since lookups are dynamic,
+    a function only counts as a callee if its name is defined exactly once
+    in the whole program and never used for anything else"""
+
+    def __init__(self, tree):
+        defs = {}
+        other_names = set()
+        for node in walk(tree):
+            if isinstance(node, Function):
+                defs.setdefault(node.name, []).append(node)
+                if node.args:
+                    other_names.add(node.args[0])
+            elif isinstance(node, VarDeclare):
+                other_names.add(node.name)
+
+        self.functions = {}
+        for name, nodes in defs.items():
+            if len(nodes) == 1 and name not in other_names:
+                self.functions[name] = nodes[0]
+
+        # Start by assuming everything is pure and returns a value,
+        #   and take that back for functions until nothing changes.
+        #   That way recursive functions can be pure
+        self.pure = set(self.functions)
+        self.returns_value = set(self.functions)
+        changed = True
+        while changed:
+            changed = False
+            for name, node in self.functions.items():
+                if name not in self.pure:
+                    continue
+                pure, returns_value = self.check(node)
+                if not pure:
+                    self.pure.discard(name)
+                    changed = True
+                if not returns_value and name in self.returns_value:
+                    self.returns_value.discard(name)
+                    changed = True
+
+    def check(self, function):
+        "Returns (pure, never returns None) for a function"
+        if function.body is None or not function.args:
+            return False, False
+        self.ok = True
+        # Names we know have a value that isn't None, one set per scope.
+        #   A None value would mean lookups go to the caller's scope
+        scopes = [{function.args[0]}]
+        ret = self.visit(function.body, scopes)
+        return self.ok, ret
+
+    def visit(self, node, scopes):
+        """Returns whether `node` can't evaluate to None,
+        and sets `self.ok` to False if it's impure"""
+        if isinstance(node, Literal):
+            return node.value is not None
+        elif isinstance(node, BinOp):
+            self.visit(node.lhs, scopes)
+            self.visit(node.rhs, scopes)
+            return True
+        elif isinstance(node, VarAccess):
+            if not any(node.name in i for i in scopes):
+                self.ok = False
+            return True
+        elif isinstance(node, VarDeclare):
+            if self.visit(node.value, scopes):
+                scopes[-1].add(node.name)
+            else:
+                # It might be None, so the name doesn't count as declared
+                scopes[-1].discard(node.name)
+            return True
+        elif isinstance(node, If):
+            self.visit(node.cond, scopes)
+            # Declarations in the branches might not happen,
+            #   so they don't count afterwards
+            a = self.visit(node.if_branch, [set(i) for i in scopes])
+            if node.else_branch is None:
+                return False
+            b = self.visit(node.else_branch, [set(i) for i in scopes])
+            return a and b
+        elif isinstance(node, Block):
+            scopes.append(set())
+            ret = False
+            for i in node.exprs:
+                ret = self.visit(i, scopes)
+            scopes.pop()
+            return ret
+        elif isinstance(node, Call):
+            self.visit(node.args, scopes)
+            if node.function not in self.pure:
+                self.ok = False
+            return node.function in self.returns_value
+        else:
+            # Function definitions, and anything else we don't know about
+            self.ok = False
+            return False
+
+
+def pure_functions(tree):
+    "Returns {name: Function} for the pure functions in `tree`"
+    analysis = Analysis(tree)
+    return {i: analysis.functions[i] for i in analysis.pure}
+
+
+class LRUCache:
+    "A dict that only keeps the `maxsize` most recently used entries"
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        "Returns the value for `key`, or None, and counts a hit or miss"
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+
+class Memo:
+    "Memoizes calls to the pure functions in `tree`"
+
+    def __init__(self, tree, maxsize=1024):
+        self.caches = {}
+        for name, function in pure_functions(tree).items():
+            self.caches[name] = (function, LRUCache(maxsize))
+
+    def call(self, function, ctx, args):
+        entry = self.caches.get(function.name)
+        # It has to be the function we analysed, not just the same name
+        if entry is None or entry[0] is not function or args is None:
+            return function.run(ctx, args)
+        try:
+            # 1 and 1.0 are equal, but give different answers
+            key = (type(args), args)
+            ret = entry[1].get(key)
+        except TypeError:
+            return function.run(ctx, args)
+
+        if ret is None:
+            ret = function.run(ctx, args)
+            if ret is not None:
+                entry[1].put(key, ret)
+        return ret
+
+    def stats(self):
+        "Returns {name: (hits, misses)} for each memoized function"
+        return {name: (cache.hits, cache.misses)
+                for name, (function, cache) in self.caches.items()}
@@ -0,0 +1,479 @@
+"""Turns the AST into Python source, which is compiled once and run in process
+
+Every `Function` becomes a real `def`, variables become Python locals,
+and an `If` whose branches are plain expressions becomes `a if c else b`,
+so running it is just Python running Python, without `eval()` on every node.
+It gives the same answers as `tree.eval(Context())`, `/` and `print`
+included.
+
+Scoping is dynamic, so a function can see its caller's variables, and
+a variable that's None doesn't hide the ones further out.
+A Python local can't do either of those, so first we work out which names
+need to work like that: ones read where they aren't certainly declared in the
+same function with a value that isn't None.
+Those are kept in a stack of dicts like `Context.stack`, and only the blocks
+and calls that declare one of them push a dict onto it.
+Everything else is a local.
+
+A function calling itself last is a `while` loop, like in the C, which
+squashes its dicts on the stack like `Function.run` does.
+Other tail calls are real calls, so unlike the interpreter, long chains of
+functions tail calling each other use up the Python stack.
+
+    program = transpile(tree)
+    print(program.source)
+    program.run()
+"""
+
+from .ast import *
+
+
+def lookup(stack, name):
+    "Like `Context.lookup`"
+    for scope in reversed(stack):
+        v = scope.get(name)
+        if v is not None:
+            return v
+
+
+def declarations(nodes):
+    """Names declared by `nodes` in the scope they run in, which includes ones
+    in `If` branches and call arguments, but not nested blocks"""
+    ret = set()
+    todo = list(nodes)
+    while todo:
+        node = todo.pop()
+        if isinstance(node, (VarDeclare, Function)):
+            ret.add(node.name)
+            if isinstance(node, VarDeclare):
+                todo.append(node.value)
+        elif isinstance(node, BinOp):
+            todo.append(node.lhs)
+            todo.append(node.rhs)
+        elif isinstance(node, If):
+            todo.append(node.cond)
+            todo.append(node.if_branch)
+            if node.else_branch is not None:
+                todo.append(node.else_branch)
+        elif isinstance(node, Call):
+            todo.append(node.args)
+    return ret
+
+
+def scope_of(node):
+    "The nodes that run directly in the scope `node` makes"
+    return node.exprs if isinstance(node, Block) else (node,)
+
+
+class Analysis:
+    """Works out which names have to be dynamic.
+    A name is local where it's been declared in the same function with a
+    value that can't be None, in every way we could have got there"""
+
+    def __init__(self, tree):
+        self.functions = {}
+        for i in walk_functions(tree):
+            self.functions.setdefault(i.name, []).append(i)
+        # Whether calling each name certainly doesn't give None. Start by
+        #   assuming it doesn't, and take that back until nothing changes
+        self.returns_value = {name: all(i.body is not None and i.args
+                                        for i in nodes)
+                              for name, nodes in self.functions.items()}
+        self.nullable_args = False
+        while True:
+            self.dynamic = set()
+            before = (dict(self.returns_value), self.nullable_args)
+            self.visit_body(tree, [{}])
+            for nodes in self.functions.values():
+                for i in nodes:
+                    if i.body is not None and i.args:
+                        status = 'maybe' if self.nullable_args else 'ok'
+                        ok = self.visit_body(i.body, [{i.args[0]: status}])
+                        if not ok:
+                            self.returns_value[i.name] = False
+            if (self.returns_value, self.nullable_args) == before:
+                break
+
+    def visit_body(self, node, scopes):
+        self.conditional = 0
+        return self.visit(node, scopes)
+
+    def declare(self, name, ok, scopes):
+        scope = scopes[-1]
+        if self.conditional:
+            # It might not happen, so it's only certain if it already was
+            ok = ok and scope.get(name) == 'ok'
+        scope[name] = 'ok' if ok else 'maybe'
+
+    def visit(self, node, scopes):
+        "Returns whether `node` certainly doesn't evaluate to None"
+        if isinstance(node, Literal):
+            return node.value is not None
+        elif isinstance(node, BinOp):
+            # Long chains like `1 + 2 + 3 + ...` nest on the left,
+            #   so we walk down those with a loop instead of recursion
+            spine = []
+            while isinstance(node, BinOp):
+                spine.append(node.rhs)
+                node = node.lhs
+            self.visit(node, scopes)
+            for i in reversed(spine):
+                self.visit(i, scopes)
+            return True
+        elif isinstance(node, VarAccess):
+            for scope in reversed(scopes):
+                if node.name in scope:
+                    if scope[node.name] == 'ok':
+                        return True
+                    break
+            self.dynamic.add(node.name)
+            return False
+        elif isinstance(node, VarDeclare):
+            self.declare(node.name, self.visit(node.value, scopes), scopes)
+            return True
+        elif isinstance(node, Block):
+            # Everything in a block happens, if the block does
+            conditional = self.conditional
+            self.conditional = 0
+            scopes.append({})
+            ret = False
+            for i in node.exprs:
+                ret = self.visit(i, scopes)
+            scopes.pop()
+            self.conditional = conditional
+            return ret
+        elif isinstance(node, If):
+            self.visit(node.cond, scopes)
+            self.conditional += 1
+            ret = self.visit(node.if_branch, scopes)
+            if node.else_branch is None:
+                ret = False
+            else:
+                ret = self.visit(node.else_branch, scopes) and ret
+            self.conditional -= 1
+            return ret
+        elif isinstance(node, Call):
+            if not self.visit(node.args, scopes):
+                self.nullable_args = True
+            if node.function == 'print':
+                return False
+            # Calls look the name up just like a `VarAccess`
+            self.visit(VarAccess(node.function), scopes)
+            return self.returns_value.get(node.function, False)
+        elif isinstance(node, Function):
+            # Functions are never None, but defining one gives None
+            self.declare(node.name, True, scopes)
+            return False
+        return False
+
+
+def walk_functions(tree):
+    "Every `Function` in `tree`"
+    todo = [tree]
+    while todo:
+        node = todo.pop()
+        if isinstance(node, Function):
+            yield node
+            if node.body is not None:
+                todo.append(node.body)
+        elif isinstance(node, BinOp):
+            todo.append(node.lhs)
+            todo.append(node.rhs)
+        elif isinstance(node, If):
+            todo.append(node.cond)
+            todo.append(node.if_branch)
+            if node.else_branch is not None:
+                todo.append(node.else_branch)
+        elif isinstance(node, Call):
+            todo.append(node.args)
+        elif isinstance(node, VarDeclare):
+            todo.append(node.value)
+        elif isinstance(node, Block):
+            todo.extend(node.exprs)
+
+
+def simple(node):
+    "Whether `node` can be a Python expression, without any statements"
+    if isinstance(node, (Literal, VarAccess)):
+        return True
+    elif isinstance(node, BinOp):
+        return simple(node.lhs) and simple(node.rhs)
+    elif isinstance(node, Call):
+        return simple(node.args)
+    elif isinstance(node, If):
+        return simple(node.cond) and simple(node.if_branch) and \
+            (node.else_branch is None or simple(node.else_branch))
+    return False
+
+
+class Writer:
+    "The source of one Python function"
+
+    def __init__(self, node, name):
+        self.node = node
+        self.name = name
+        self.lines = []
+        self.indent = 1
+        self.temps = 0
+        # Whether it pushes anything onto the stack, so returns clean up
+        self.pushes = False
+        # Whether it tail calls itself, so the body is a loop
+        self.loops = False
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def temp(self):
+        self.temps += 1
+        return 't%d' % self.temps
+
+
+class Transpiler:
+    def __init__(self, tree):
+        self.tree = tree
+        self.analysis = Analysis(tree)
+        self.dynamic = self.analysis.dynamic
+        # Values that aren't numbers, which the code gets from `K`
+        self.consts = []
+        self.defs = []
+        self.def_names = {}
+        self.names = 0
+
+    def fresh(self, prefix, name):
+        self.names += 1
+        return '%s_%s_%d' % (prefix, name, self.names)
+
+    def const(self, value):
+        if type(value) in (int, float):
+            return repr(value)
+        self.consts.append(value)
+        return 'K[%d]' % (len(self.consts) - 1)
+
+    def pushes(self, nodes):
+        "The dynamic names `nodes` declare, if they need a dict on the stack"
+        return sorted(declarations(nodes) & self.dynamic)
+
+    def source(self):
+        main = Writer(None, 'main')
+        # Like `tree.eval(ctx)`, anything it declares outside of a block
+        #   goes in the scope that's already there
+        self.stmt(main, self.tree, [{}], 'return')
+        return '\n'.join(self.defs + [self.finish(main, 'ctx')]) + '\n'
+
+    def function(self, node):
+        "Adds the `def` for `node`, and returns its name"
+        if id(node) in self.def_names:
+            return self.def_names[id(node)]
+        name = self.def_names[id(node)] = self.fresh('f', node.name)
+        if node.body is None:
+            self.defs.append('def %s(ctx, arg):\n    return None\n' % name)
+        elif not node.args:
+            # `Function.run` fails on these too
+            self.defs.append("def %s(ctx, arg):\n    raise TypeError("
+                             "\"'NoneType' object is not subscriptable\")\n"
+                             % name)
+        else:
+            writer = Writer(node, name)
+            arg = node.args[0]
+            if arg in self.dynamic:
+                scope = {}
+                writer.pushes = True
+            else:
+                scope = {arg: 'a_' + arg}
+            self.write_body(writer, node.body, [scope], arg)
+            self.defs.append(self.finish(writer, 'ctx, ' + (
+                'arg' if arg in self.dynamic else 'a_' + arg)))
+        return name
+
+    def write_body(self, writer, body, scopes, arg):
+        "Writes a function's body, in a scope with its argument"
+        # Like `Function.run`, every call and time around the loop checks
+        writer.emit('if ctx.deadline is not None:')
+        writer.emit('    ctx.check_deadline()')
+        dynamic = self.pushes(scope_of(body) if not isinstance(body, Block)
+                              else ())
+        if arg in self.dynamic or dynamic:
+            writer.pushes = True
+            writer.emit('stack.append({%s})' % (
+                "'%s': arg" % arg if arg in self.dynamic else ''))
+        self.stmt(writer, body, scopes, 'return')
+
+    def finish(self, writer, params):
+        "The whole `def` for `writer`"
+        lines = ['def %s(%s):' % (writer.name, params)]
+        if any('stack' in i for i in writer.lines):
+            lines.append('    stack = ctx.stack')
+        if writer.pushes:
+            lines.append('    base = len(stack)')
+        body = writer.lines
+        if writer.loops:
+            lines.append('    while True:')
+            body = ['    ' + i for i in body]
+        return '\n'.join(lines + body) + '\n'
+
+    def lookup(self, name, scopes):
+        if name not in self.dynamic:
+            for scope in reversed(scopes):
+                if name in scope:
+                    return scope[name]
+        return 'lookup(stack, %r)' % name
+
+    def bind(self, writer, name, value, scopes):
+        if name in self.dynamic:
+            writer.emit('stack[-1][%r] = %s' % (name, value))
+            return
+        scope = scopes[-1]
+        if name not in scope:
+            scope[name] = self.fresh('v', name)
+        writer.emit('%s = %s' % (scope[name], value))
+
+    def ret(self, writer, value):
+        "Returns `value`. It's worked out before the stack is cleaned up"
+        if writer.pushes:
+            if not value.isidentifier():
+                value = self.hoist(writer, value)
+            # The dicts from any blocks we're in go too
+            writer.emit('del stack[base:]')
+        writer.emit('return %s' % value)
+
+    def assign(self, writer, target, value, pure=False):
+        "Puts `value` in `target`, which is a temp, 'return' or None"
+        if target == 'return':
+            self.ret(writer, value)
+        elif target is not None:
+            writer.emit('%s = %s' % (target, value))
+        elif not pure:
+            writer.emit(value)
+
+    def expr(self, writer, node, scopes):
+        """Returns a Python expression for `node`.
+        Any statements it needs first are written to `writer`"""
+        if isinstance(node, Literal):
+            return self.const(node.value)
+        elif isinstance(node, VarAccess):
+            return self.lookup(node.name, scopes)
+        elif isinstance(node, BinOp):
+            lhs = self.expr(writer, node.lhs, scopes)
+            if not simple(node.rhs) and not isinstance(node.lhs, Literal):
+                # The rhs has statements, which have to come after the lhs
+                lhs = self.hoist(writer, lhs)
+            rhs = self.expr(writer, node.rhs, scopes)
+            return '(%s %s %s)' % (lhs, node.op, rhs)
+        elif isinstance(node, Call):
+            if node.function == 'print':
+                return 'print(%s, file=ctx.out)' % self.expr(
+                    writer, node.args, scopes)
+            fun = self.lookup(node.function, scopes)
+            if not simple(node.args):
+                fun = self.hoist(writer, fun)
+            return '%s(ctx, %s)' % (fun, self.expr(writer, node.args, scopes))
+        elif isinstance(node, If) and simple(node):
+            else_branch = 'None'
+            if node.else_branch is not None:
+                else_branch = self.expr(writer, node.else_branch, scopes)
+            return '(%s if %s != 0 else %s)' % (
+                self.expr(writer, node.if_branch, scopes),
+                self.expr(writer, node.cond, scopes), else_branch)
+        temp = writer.temp()
+        self.stmt(writer, node, scopes, temp)
+        return temp
+
+    def hoist(self, writer, value):
+        temp = writer.temp()
+        writer.emit('%s = %s' % (temp, value))
+        return temp
+
+    def stmt(self, writer, node, scopes, target):
+        "Writes the statements for `node`, with its value going to `target`"
+        if isinstance(node, Block):
+            pushes = self.pushes(node.exprs)
+            if pushes:
+                writer.pushes = True
+                writer.emit('stack.append({})')
+            scopes.append({})
+            for i in node.exprs[:-1]:
+                self.stmt(writer, i, scopes, None)
+            if node.exprs:
+                self.stmt(writer, node.exprs[-1], scopes, target)
+            else:
+                self.assign(writer, target, 'None', True)
+            scopes.pop()
+            if pushes and target != 'return':
+                writer.emit('stack.pop()')
+        elif isinstance(node, VarDeclare):
+            self.bind(writer, node.name, self.expr(writer, node.value, scopes),
+                      scopes)
+            # `VarDeclare.eval` gives the value's node
+            self.assign(writer, target, self.const(node.value), True)
+        elif isinstance(node, Function):
+            self.bind(writer, node.name, self.function(node), scopes)
+            self.assign(writer, target, 'None', True)
+        elif isinstance(node, If) and not (target is None and simple(node)):
+            writer.emit('if %s != 0:' % self.expr(writer, node.cond, scopes))
+            self.branch(writer, node.if_branch, scopes, target)
+            if node.else_branch is not None or target is not None:
+                writer.emit('else:')
+                self.branch(writer, node.else_branch or Literal(None),
+                            scopes, target)
+        elif isinstance(node, Call) and target == 'return' and \
+                writer.node is not None and node.function != 'print':
+            self.tail_call(writer, node, scopes)
+        else:
+            pure = isinstance(node, (Literal, VarAccess))
+            self.assign(writer, target, self.expr(writer, node, scopes), pure)
+
+    def branch(self, writer, node, scopes, target):
+        "The inside of an `if` statement"
+        writer.indent += 1
+        start = len(writer.lines)
+        self.stmt(writer, node, scopes, target)
+        if len(writer.lines) == start:
+            writer.emit('pass')
+        writer.indent -= 1
+
+    def tail_call(self, writer, node, scopes):
+        """A call that `Function.run` would loop around into.
+        If it's to us, we loop too"""
+        fun = self.hoist(writer, self.lookup(node.function, scopes))
+        arg = self.hoist(writer, self.expr(writer, node.args, scopes))
+        if node.function != writer.node.name:
+            self.ret(writer, '%s(ctx, %s)' % (fun, arg))
+            return
+        writer.emit('if %s is %s:' % (fun, writer.name))
+        writer.indent += 1
+        if writer.pushes:
+            # Going around again can still see what we pushed
+            writer.emit('ctx.squash(base)')
+        name = writer.node.args[0]
+        # Going around again pushes the argument if it's dynamic
+        writer.emit('%s = %s' % ('arg' if name in self.dynamic else 'a_' + name,
+                                 arg))
+        writer.emit('continue')
+        writer.indent -= 1
+        writer.loops = True
+        self.ret(writer, '%s(ctx, %s)' % (fun, arg))
+
+
+class PythonProgram:
+    "The result of `transpile`, which can be run any number of times"
+
+    def __init__(self, source, consts, filename='<phhe>'):
+        self.source = source
+        self.code = compile(source, filename, 'exec')
+        self.namespace = {'lookup': lookup, 'K': consts}
+        exec(self.code, self.namespace)
+
+    def run(self, ctx=None):
+        "Runs the program and returns its value, like `tree.eval(ctx)`"
+        return self.namespace['main'](ctx or Context())
+
+
+def transpile(tree, filename='<phhe>'):
+    "Returns a `PythonProgram` for `tree`, usually a `Block` from the parser"
+    transpiler = Transpiler(tree)
+    return PythonProgram(transpiler.source(), transpiler.consts, filename)
+
+
+def run(tree, ctx=None):
+    "Transpiles `tree` and runs it, like `tree.eval(ctx)`"
+    return transpile(tree).run(ctx)
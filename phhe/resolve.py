@@ -0,0 +1,441 @@
+"""Lexical addressing: resolves every variable to a frame slot ahead of time
+
+`Context` keeps a stack of dicts and searches all of them on every
+`VarAccess`. Here a resolver pass works out, once, which slot of which frame
+each `VarDeclare`, `VarAccess`, function name and argument refers to.
+Each function call gets one flat list as its frame:
+slot 0 points at the frame the function was defined in, and the argument and
+every variable declared in the body (blocks included) get a slot after that.
+A variable is then found with a (depth, slot) pair, where depth is how many
+function definitions out it lives.
+
+The frames are lexical, but `Context` is dynamic: a function sees the
+variables in whoever called it. So names that are read where they aren't
+certainly declared in the same function (`pyback.Analysis` works those out)
+don't get slots. They're kept in a stack of dicts like `Context.stack`
+instead, which only the blocks and calls that declare one of them push onto.
+For everything else, the slot is the same variable `Context` would find.
+"""
+
+import operator
+from .ast import *
+from .pyback import Analysis, declarations, scope_of
+
+
+ops = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv
+}
+
+
+class FrameInfo:
+    """What the resolver knows about a function's frame"""
+
+    def __init__(self, depth):
+        self.depth = depth
+        # Slot 0 holds the defining frame
+        self.size = 1
+
+
+class Scope:
+    """The resolver's version of one of the dicts in `Context.stack`"""
+
+    def __init__(self, frame, parent):
+        self.frame = frame
+        self.parent = parent
+        self.names = {}
+        # Function bodies get resolved when the scope they're defined in ends,
+        #   so they can see everything declared around them
+        self.pending = []
+
+
+class Closure:
+    """A function value: the resolved function plus the frame it was defined in"""
+
+    def __init__(self, function, env):
+        self.function = function
+        self.env = env
+
+    def __repr__(self):
+        return "Closure(%r)" % self.function.name
+
+    def call(self, arg):
+        function = self.function
+        if function.body is not None:
+            frame = [None] * function.size
+            frame[0] = self.env
+            frame[1] = arg
+            if not function.pushes:
+                return function.body.eval(frame)
+            stack = function.stack
+            stack.append({function.node.args[0]: arg}
+                         if function.dynamic_arg else {})
+            ret = function.body.eval(frame)
+            stack.pop()
+            return ret
+
+
+# The resolved tree. The `eval()` methods take a frame instead of a `Context`
+
+class Const:
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return "Const(%r)" % self.value
+
+    def eval(self, frame):
+        return self.value
+
+
+class Op:
+    def __init__(self, lhs, op, rhs):
+        self.lhs = lhs
+        self.op = op
+        self.fn = ops[op]
+        self.rhs = rhs
+
+    def __repr__(self):
+        return "Op(%r %s %r)" % (self.lhs, self.op, self.rhs)
+
+    def eval(self, frame):
+        return self.fn(self.lhs.eval(frame), self.rhs.eval(frame))
+
+
+class Cond:
+    def __init__(self, cond, if_branch, else_branch):
+        self.cond = cond
+        self.if_branch = if_branch
+        self.else_branch = else_branch
+
+    def __repr__(self):
+        return "Cond(%r, %r, %r)" % (self.cond, self.if_branch,
+                                     self.else_branch)
+
+    def eval(self, frame):
+        if self.cond.eval(frame) != 0:
+            return self.if_branch.eval(frame)
+        elif self.else_branch is not None:
+            return self.else_branch.eval(frame)
+
+
+class Load:
+    """A `VarAccess`. `candidates` are the (depth, slot) pairs it could mean,
+    innermost first. There's usually one, but a name declared in several
+    enclosing scopes gets them all, since `Context` skips bindings that are
+    None and we have to do the same"""
+
+    def __init__(self, name, candidates):
+        self.name = name
+        self.candidates = candidates
+
+    def __repr__(self):
+        return "Load(%r, %r)" % (self.name, self.candidates)
+
+    def eval(self, frame):
+        for depth, slot in self.candidates:
+            f = frame
+            for _ in range(depth):
+                f = f[0]
+            v = f[slot]
+            if v is not None:
+                return v
+
+
+class LoadLocal(Load):
+    "A `Load` from the current frame with only one candidate"
+
+    def __init__(self, name, slot):
+        Load.__init__(self, name, ((0, slot),))
+        self.slot = slot
+
+    def eval(self, frame):
+        return frame[self.slot]
+
+
+class DynamicLoad:
+    "A `VarAccess` of a dynamic name, which looks in the stack of dicts"
+
+    def __init__(self, name, stack):
+        self.name = name
+        self.stack = stack
+
+    def __repr__(self):
+        return "DynamicLoad(%r)" % self.name
+
+    def eval(self, frame):
+        for scope in reversed(self.stack):
+            v = scope.get(self.name)
+            if v is not None:
+                return v
+
+
+class Store:
+    "A `VarDeclare`, which always goes in the current frame"
+
+    def __init__(self, name, slot, value, node):
+        self.name = name
+        self.slot = slot
+        self.value = value
+        # `VarDeclare.eval` returns the value's node, so we do too
+        self.node = node
+
+    def __repr__(self):
+        return "Store(%r, %r, %r)" % (self.name, self.slot, self.value)
+
+    def eval(self, frame):
+        frame[self.slot] = self.value.eval(frame)
+        return self.node
+
+
+class DynamicStore:
+    "A `VarDeclare` of a dynamic name, which goes in the innermost dict"
+
+    def __init__(self, name, value, node, stack):
+        self.name = name
+        self.value = value
+        self.node = node
+        self.stack = stack
+
+    def __repr__(self):
+        return "DynamicStore(%r, %r)" % (self.name, self.value)
+
+    def eval(self, frame):
+        self.stack[-1][self.name] = self.value.eval(frame)
+        return self.node
+
+
+class ResolvedFunction:
+    """A `Function` definition. `body` and `size` are filled in once the
+    body is resolved, which might be after the definition itself.
+    If the name is dynamic, `slot` is None and it goes in `stack` instead.
+    `pushes` is whether calls push a dict, with the argument in it
+    if `dynamic_arg`"""
+
+    def __init__(self, name, slot, node, stack):
+        self.name = name
+        self.slot = slot
+        self.node = node
+        self.stack = stack
+        self.body = None
+        self.size = 1
+        self.pushes = False
+        self.dynamic_arg = False
+
+    def __repr__(self):
+        return "ResolvedFunction(%r, %r, %r)" % (self.name, self.slot,
+                                                 self.body)
+
+    def eval(self, frame):
+        if self.slot is None:
+            self.stack[-1][self.name] = Closure(self, frame)
+        else:
+            frame[self.slot] = Closure(self, frame)
+
+
+class Invoke:
+    "A `Call` to anything but `print`"
+
+    def __init__(self, function, arg):
+        self.function = function
+        self.arg = arg
+
+    def __repr__(self):
+        return "Invoke(%r, %r)" % (self.function, self.arg)
+
+    def eval(self, frame):
+        fun = self.function.eval(frame)
+        return fun.call(self.arg.eval(frame))
+
+
+class Print:
+    def __init__(self, arg):
+        self.arg = arg
+
+    def __repr__(self):
+        return "Print(%r)" % self.arg
+
+    def eval(self, frame):
+        print(self.arg.eval(frame))
+
+
+class Seq:
+    """A `Block`, which doesn't need a scope of its own anymore,
+    unless it declares dynamic names. Then `stack` is the stack of dicts"""
+
+    def __init__(self, *exprs, stack=None):
+        self.exprs = exprs
+        self.stack = stack
+
+    def __repr__(self):
+        return "Seq%r" % (self.exprs,)
+
+    def eval(self, frame):
+        ret = None
+        if self.stack is not None:
+            self.stack.append({})
+        for i in self.exprs:
+            ret = i.eval(frame)
+        if self.stack is not None:
+            self.stack.pop()
+        return ret
+
+
+class Opaque:
+    "Any other node, evaluated the old way"
+
+    def __init__(self, node):
+        self.node = node
+
+    def __repr__(self):
+        return "Opaque(%r)" % self.node
+
+    def eval(self, frame):
+        return self.node.eval(Context())
+
+
+class Program:
+    "The result of `resolve()`, which can be run any number of times"
+
+    def __init__(self, body, size, stack):
+        self.body = body
+        self.size = size
+        self.stack = stack
+
+    def __repr__(self):
+        return "Program(%r)" % self.body
+
+    def eval(self):
+        # This is the dict `Context()` starts with
+        self.stack[:] = [{}]
+        return self.body.eval([None] * self.size)
+
+
+class Resolver:
+    def __init__(self, tree):
+        frame = FrameInfo(0)
+        # This is the scope `Context()` starts with
+        self.scope = Scope(frame, None)
+        self.dynamic = Analysis(tree).dynamic
+        # The stack of dicts for the dynamic names, shared by everything
+        #   that uses it
+        self.stack = []
+
+    def pushes(self, nodes):
+        "Whether the scope `nodes` run in declares any dynamic names"
+        return not self.dynamic.isdisjoint(declarations(nodes))
+
+    def push(self, frame=None):
+        self.scope = Scope(frame or self.scope.frame, self.scope)
+
+    def pop(self):
+        scope = self.scope
+        while scope.pending:
+            self.resolve_body(*scope.pending.pop(0))
+        self.scope = scope.parent
+
+    def declare(self, name):
+        names = self.scope.names
+        slot = names.get(name)
+        if slot is None:
+            frame = self.scope.frame
+            slot = frame.size
+            frame.size += 1
+            names[name] = slot
+        return slot
+
+    def candidates(self, name):
+        depth = self.scope.frame.depth
+        ret = []
+        scope = self.scope
+        while scope is not None:
+            slot = scope.names.get(name)
+            if slot is not None:
+                ret.append((depth - scope.frame.depth, slot))
+            scope = scope.parent
+        return tuple(ret)
+
+    def load(self, name):
+        if name in self.dynamic:
+            return DynamicLoad(name, self.stack)
+        candidates = self.candidates(name)
+        if len(candidates) == 1 and candidates[0][0] == 0:
+            return LoadLocal(name, candidates[0][1])
+        return Load(name, candidates)
+
+    def resolve_body(self, function, node):
+        self.push(FrameInfo(self.scope.frame.depth + 1))
+        # The argument is always slot 1, even if there isn't one
+        if node.args:
+            self.declare(node.args[0])
+            function.dynamic_arg = node.args[0] in self.dynamic
+        else:
+            self.scope.frame.size += 1
+        # A block body pushes its own dict
+        function.pushes = function.dynamic_arg or self.pushes(
+            () if isinstance(node.body, Block) else scope_of(node.body))
+        function.body = self.visit(node.body)
+        frame = self.scope.frame
+        self.pop()
+        function.size = frame.size
+
+    def visit(self, node):
+        if isinstance(node, Literal):
+            return Const(node.value)
+        elif isinstance(node, BinOp):
+            # Long chains like `1 + 2 + 3 + ...` nest on the left,
+            #   so we walk down those with a loop instead of recursion
+            spine = []
+            while isinstance(node, BinOp):
+                spine.append(node)
+                node = node.lhs
+            ret = self.visit(node)
+            for i in reversed(spine):
+                ret = Op(ret, i.op, self.visit(i.rhs))
+            return ret
+        elif isinstance(node, If):
+            else_branch = None
+            cond = self.visit(node.cond)
+            if_branch = self.visit(node.if_branch)
+            if node.else_branch is not None:
+                else_branch = self.visit(node.else_branch)
+            return Cond(cond, if_branch, else_branch)
+        elif isinstance(node, VarDeclare):
+            # The value can still see the old binding, so it goes first
+            value = self.visit(node.value)
+            if node.name in self.dynamic:
+                return DynamicStore(node.name, value, node.value, self.stack)
+            return Store(node.name, self.declare(node.name), value, node.value)
+        elif isinstance(node, VarAccess):
+            return self.load(node.name)
+        elif isinstance(node, Block):
+            self.push()
+            exprs = [self.visit(i) for i in node.exprs]
+            self.pop()
+            return Seq(*exprs, stack=self.stack if self.pushes(node.exprs)
+                       else None)
+        elif isinstance(node, Function):
+            slot = None
+            if node.name not in self.dynamic:
+                slot = self.declare(node.name)
+            function = ResolvedFunction(node.name, slot, node, self.stack)
+            if node.body is not None:
+                self.scope.pending.append((function, node))
+            return function
+        elif isinstance(node, Call):
+            if node.function == 'print':
+                return Print(self.visit(node.args))
+            return Invoke(self.load(node.function), self.visit(node.args))
+        else:
+            return Opaque(node)
+
+
+def resolve(node):
+    "Resolves a whole program, usually the `Block` from `exprs.parse`"
+    resolver = Resolver(node)
+    body = resolver.visit(node)
+    frame = resolver.scope.frame
+    resolver.pop()
+    return Program(body, frame.size, resolver.stack)
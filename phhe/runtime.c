@@ -1,7 +1,42 @@
 // This file is pasted in at the beginning of the generated C code
 // Eventually, we can put all sorts of things in here
-#include <stdio.h>
+// `load_runtime` pastes runtime.h in here, since this gets pasted in too
+#include "runtime.h"
+#include <stdlib.h>
+#include <time.h>
 
 void print(int i) {
     printf("%i\n", i);
 }
+
+// Every counter that's been used, so we can print them at the end
+static struct phhe_counter *phhe_counters = NULL;
+
+static double phhe_now(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+static void phhe_dump(void) {
+    fprintf(stderr, "%12s %12s  %s\n", "calls", "seconds", "function");
+    for (struct phhe_counter *c = phhe_counters; c; c = c->next)
+        fprintf(stderr, "%12lu %12.6f  %s (%s:%d)\n",
+                c->calls, c->seconds, c->name, c->file, c->line);
+}
+
+void phhe_enter(struct phhe_counter *c) {
+    if (c->calls++ == 0) {
+        if (phhe_counters == NULL)
+            atexit(phhe_dump);
+        c->next = phhe_counters;
+        phhe_counters = c;
+    }
+    if (c->depth++ == 0)
+        c->start = phhe_now();
+}
+
+void phhe_exit(struct phhe_counter *c) {
+    if (--c->depth == 0)
+        c->seconds += phhe_now() - c->start;
+}
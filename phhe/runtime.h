@@ -0,0 +1,22 @@
+// This file is pasted in instead of runtime.c when the runtime is compiled
+//   separately and linked in, so it only declares what runtime.c defines
+#include <stdio.h>
+
+void print(int i);
+
+// How many times a function ran and for how long, for `--counters`.
+// The generated code makes one for each function, with just the first three
+struct phhe_counter {
+    const char *name;
+    const char *file;
+    int line;
+    unsigned long calls;
+    // Recursive calls are only timed once, by the outermost one
+    int depth;
+    double start;
+    double seconds;
+    struct phhe_counter *next;
+};
+
+void phhe_enter(struct phhe_counter *c);
+void phhe_exit(struct phhe_counter *c);
@@ -0,0 +1,253 @@
+"""A compile server, so running the compiler thousands of times doesn't
+start Python and import everything thousands of times
+
+    python -m phhe --serve /tmp/phhe.sock
+    python -m phhe.client /tmp/phhe.sock file.ph file.c
+
+It listens on a Unix socket, and keeps parsed and optimized programs in
+memory, along with the on-disk AST and native caches.
+Each connection sends requests and gets responses, one JSON object per
+line each way. A request is
+    {"op": "emit", "source": "print(1)", "filename": "x.ph", "level": 1}
+where "op" is one of the `--mode`s (emit, interpret, python, run, check),
+"ping" or "shutdown". Everything besides "op" is optional, except the
+source. The response has "ok", and then "c", "output" (what the program
+printed), "value", "status" and "timings" depending on the op,
+or "error" if it went wrong.
+A program gets "timeout" seconds to run, which can't be more than the
+server's `timeout`. Interpreted ones are stopped with a TimeoutError,
+and executables are killed.
+
+Connections each get a thread, but only `jobs` requests run at once,
+the rest wait their turn.
+"shutdown" or SIGTERM stops it taking new connections, lets the requests
+that are running finish, and then deletes the socket. It only waits
+`close_timeout` seconds for them, though.
+"""
+
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+import time
+from .ast import *
+from .astcache import ASTCache
+from .driver import Driver
+from .native import NativeCache
+from .purity import LRUCache
+from .tiered import Tiers
+
+modes = ('emit', 'interpret', 'python', 'run', 'check')
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections.add(self.connection)
+            self.server.threads.add(threading.current_thread())
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self.connection)
+            self.server.threads.discard(threading.current_thread())
+        super().finish()
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("a request is a JSON object")
+            except ValueError as e:
+                response = {'ok': False, 'error': 'Bad request: %s' % e}
+            else:
+                response = self.server.respond(request)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+            if self.server.stopping:
+                break
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # `server_close` waits for the requests that are running itself,
+    #   and only for so long, so they can't keep the process going either
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, path, jobs=None, cache=True, max_trees=256,
+                 timeout=60, close_timeout=10):
+        """`path` is where the socket goes. If there's a socket there that
+        nothing is listening on, it's left over, so it's replaced.
+        Anything else that's there is a FileExistsError.
+        `timeout` is the most seconds a program can run for, and
+        `close_timeout` how long `server_close` waits for requests"""
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError("%s is already there, and isn't a socket"
+                                      % path)
+            if not listening(path):
+                os.remove(path)
+        self.path = path
+        self.jobs = threading.BoundedSemaphore(jobs or os.cpu_count() or 1)
+        self.cache = ASTCache() if cache else None
+        self.native = NativeCache()
+        # (source, level) -> optimized tree
+        self.trees = LRUCache(max_trees)
+        self.lock = threading.Lock()
+        # The sockets of the connections that are open
+        self.connections = set()
+        # The threads handling them
+        self.threads = set()
+        self.stopping = False
+        self.timeout = timeout
+        self.close_timeout = close_timeout
+        super().__init__(path, Handler)
+
+    def respond(self, request):
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True}
+        if op == 'shutdown':
+            self.stop()
+            return {'ok': True}
+        if self.stopping:
+            return {'ok': False, 'error': 'The server is shutting down'}
+        if op not in modes:
+            return {'ok': False, 'error': 'Bad request: unknown op %r' % op}
+        if not isinstance(request.get('source'), str):
+            return {'ok': False, 'error': 'Bad request: no source'}
+        problem = check_request(request)
+        if problem is not None:
+            return {'ok': False, 'error': 'Bad request: %s' % problem}
+        with self.jobs:
+            return self.work(request)
+
+    def tree(self, driver, source):
+        "The optimized tree for `source`, parsing it if it's a new one"
+        key = (source, driver.level)
+        with self.lock:
+            tree = self.trees.get(key)
+        if tree is None:
+            tree = driver.optimize(driver.parse(source))
+            with self.lock:
+                self.trees.put(key, tree)
+        return tree
+
+    def work(self, request):
+        op = request['op']
+        filename = request.get('filename')
+        driver = Driver(request.get('level', 1), self.cache,
+                        request.get('counters', False))
+        timeout = min(request.get('timeout', self.timeout), self.timeout)
+        out = io.StringIO()
+        response = {'ok': True}
+        try:
+            tree = self.tree(driver, request['source'])
+            if op == 'check':
+                driver.check(tree)
+            elif op == 'emit':
+                response['c'] = driver.emit(tree, filename=filename)
+            elif op == 'run':
+                completed = driver.execute(tree, filename, self.native,
+                                           capture_output=True, text=True,
+                                           timeout=timeout)
+                out.write(completed.stdout)
+                response['stderr'] = completed.stderr
+                response['status'] = completed.returncode
+            else:
+                # The clock starts once the program is parsed
+                ctx = Context(out=out, deadline=time.monotonic() + timeout)
+                if op == 'python':
+                    ret = driver.run_python(tree, ctx, filename or '<phhe>')
+                else:
+                    if request.get('tiered') is not None:
+                        ctx.tiers = Tiers(tree, request['tiered'], self.native)
+                    ret = driver.interpret(tree, ctx)
+                response['value'] = None if ret is None else str(ret)
+        except Exception as e:
+            # Parse and type errors, but also anything the program does,
+            #   none of which should take the server down
+            response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+        response['output'] = out.getvalue()
+        response['timings'] = driver.timings.stages
+        return response
+
+    def stop(self):
+        """Stops taking connections and requests.
+        `serve_forever` returns once it has"""
+        self.stopping = True
+        # Connections waiting for a request get an end of file, and ones
+        #   working on one can still send the response
+        with self.lock:
+            for i in self.connections:
+                try:
+                    i.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+        # `shutdown` waits for `serve_forever`, so it can't be called
+        #   from the thread running that
+        threading.Thread(target=self.shutdown).start()
+
+    def server_close(self):
+        """Closes the socket, waits up to `close_timeout` seconds for the
+        requests that are running, and deletes the socket file"""
+        super().server_close()
+        deadline = time.monotonic() + self.close_timeout
+        with self.lock:
+            threads = list(self.threads)
+        for i in threads:
+            i.join(max(0, deadline - time.monotonic()))
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def is_int(value):
+    # bools are ints to Python, but not to JSON
+    return type(value) is int
+
+
+def check_request(request):
+    "What's wrong with the fields of `request`, or None if they're fine"
+    level = request.get('level', 1)
+    if not is_int(level) or level not in (0, 1, 2):
+        return 'level is 0, 1 or 2'
+    tiered = request.get('tiered')
+    if tiered is not None and not (is_int(tiered) and tiered > 0):
+        return 'tiered is a number of calls, or null'
+    if type(request.get('counters', False)) is not bool:
+        return 'counters is true or false'
+    timeout = request.get('timeout', 1)
+    if type(timeout) not in (int, float) or not timeout > 0:
+        return 'timeout is a number of seconds'
+    if not isinstance(request.get('filename', ''), (str, type(None))):
+        return 'filename is a str'
+
+
+def listening(path):
+    "Whether a server is listening on the socket at `path`"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def serve(path, jobs=None, cache=True):
+    "Runs a server on `path` until it's told to stop, or gets SIGTERM or SIGINT"
+    server = Server(path, jobs, cache)
+    for i in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(i, lambda signum, frame: server.stop())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
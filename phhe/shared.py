@@ -0,0 +1,94 @@
+"""Builds the generated C as a shared library and loads it with ctypes,
+so Python can call the compiled functions directly
+
+Running the executable from `NativeCache.run` costs a new process every
+time, which is milliseconds. Calling into a library that's already loaded
+is just a C call through ctypes, so it's more like a microsecond:
+
+    program = load(pratt.parse(source))
+    program['fib'](20)
+    program.run()
+
+Every function gets `argtypes` and `restype` from its types, so ints and
+floats are converted to C like the generated code expects, and anything else
+is a `ctypes.ArgumentError`.
+Function declarations without a body (like `putchar`) are left out, they're
+in the C library anyway.
+
+`run()` calls `main`, which runs the whole program. The output comes from
+the C `printf`, so it goes to the real stdout, not `sys.stdout`.
+Anything the C keeps around between calls, like `--counters`, lasts until
+the process exits, and a library can't be unloaded.
+"""
+
+import ctypes
+import sys
+from .codegen import gen_module
+from .native import NativeCache
+
+
+c_types = {
+    'int': ctypes.c_int,
+    'float': ctypes.c_float,
+    'null': None
+}
+
+# The C library, for `fflush`
+libc = ctypes.CDLL(None)
+
+
+class SharedProgram:
+    "A program that's loaded into this process, from `load`"
+
+    def __init__(self, module, path):
+        """`module` is the `codegen.Module` the library was built from,
+        which says what the functions are called and their types"""
+        self.path = path
+        self.lib = ctypes.CDLL(path)
+        self.functions = {}
+        # Without anything at the top level, `main` is only declared
+        self.main = None
+        for fun in module.functions:
+            # `name$body` is the inside of a function with `--counters`
+            if '$' in fun.name or not fun.block.exprs:
+                continue
+            if fun.name == 'main':
+                self.main = self.bind(fun)
+            else:
+                self.functions[fun.name] = self.bind(fun)
+
+    def bind(self, fun):
+        "The ctypes function for the `CFunction` `fun`"
+        ret = getattr(self.lib, fun.name)
+        ret.argtypes = [c_types[fun.args[1]['primitive']]] if fun.args else []
+        ret.restype = c_types[fun.ret_type['primitive']] \
+            if fun.ret_type else None
+        return ret
+
+    def __getitem__(self, name):
+        return self.functions[name]
+
+    def __contains__(self, name):
+        return name in self.functions
+
+    def run(self):
+        "Runs the whole program, like the executable would, and returns its status"
+        # Both Python and C buffer stdout, so flush them around it
+        if self.main is None:
+            return 0
+        sys.stdout.flush()
+        try:
+            return self.main()
+        finally:
+            libc.fflush(None)
+
+
+def load(tree, native=None, counters=False, filename=None, checked=False):
+    """Compiles `tree`, usually a `Block` from the parser, into a shared
+    library (which is cached by `native`) and loads it.
+    `checked` is like for `codegen.Module`.
+    Raises a TypeCheckError if `tree` doesn't type check"""
+    native = native or NativeCache()
+    module = gen_module([tree], 'runtime.h', filename, counters,
+                        checked=checked)
+    return SharedProgram(module, native.build(str(module), shared=True))
@@ -0,0 +1,127 @@
+"""Parses and runs (or compiles) a program one top-level statement at a time
+
+`parse_file` reads the whole file and builds the whole AST before anything
+runs. This reads it a line at a time instead (memory-mapped for files,
+or from stdin), and hands out each top-level statement as soon as its last
+line is read, so a huge program starts running straight away and only one
+statement's AST is around at once.
+
+    for node in statements(read_lines(path)):
+        ...
+
+A statement only goes on to the next line inside `{}` or `()`,
+so we know it's finished when a line closes all of them.
+"""
+
+import mmap
+import shutil
+import sys
+import tempfile
+from parsy import ParseError
+from .ast import *
+from .codegen import Module, gen_expr, load_runtime
+from .optimize import Optimizer
+from .pratt import Parser
+
+
+def read_lines(path):
+    "The lines of the file at `path`, or of stdin if `path` is '-'"
+    if path == '-':
+        yield from sys.stdin
+        return
+    with open(path, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and things like pipes can't be mapped
+            for line in file:
+                yield line.decode()
+            return
+        with data:
+            for line in iter(data.readline, b''):
+                yield line.decode()
+
+
+def depth(line):
+    "How many more brackets `line` opens than it closes"
+    line = line.split('#', 1)[0]
+    return line.count('{') + line.count('(') - line.count('}') - line.count(')')
+
+
+def chunks(lines):
+    "Yields (line number, text) for groups of lines with whole statements in them"
+    chunk = []
+    start = 1
+    open_brackets = 0
+    for number, line in enumerate(lines, 1):
+        if not chunk:
+            start = number
+        chunk.append(line)
+        open_brackets += depth(line)
+        if open_brackets <= 0:
+            yield start, ''.join(chunk)
+            chunk = []
+            open_brackets = 0
+    if chunk:
+        # This one isn't finished, so it's going to be a parse error
+        yield start, ''.join(chunk)
+
+
+def statements(lines):
+    "Yields the top-level statements in `lines`, one at a time"
+    for line, text in chunks(lines):
+        if not text.split('#', 1)[0].strip():
+            continue
+        try:
+            yield from Parser(text, line).parse().exprs
+        except ParseError as e:
+            # Make the position in the error count from the start of the file
+            raise ParseError(e.expected, '\n' * (line - 1) + text,
+                             e.index + line - 1) from None
+
+
+def optimize_each(nodes, level=1):
+    """Optimizes each statement, like `optimize` would the whole program.
+    Except with -O2 unused declarations stay, since we don't know yet
+    what later statements use"""
+    optimizer = Optimizer(level)
+    for node in nodes:
+        yield optimizer.visit(node) if level > 0 else node
+
+
+def run(nodes, ctx=None):
+    """Evaluates each node as soon as it comes, with all of them in `ctx`,
+    and returns the value of the last one, like `Block.eval`"""
+    ctx = ctx or Context()
+    ret = None
+    for node in nodes:
+        ret = node.eval(ctx)
+    return ret
+
+
+def emit(nodes, out, runtime='runtime.c', filename=None, counters=False):
+    """Writes the C for `nodes` to `out`, like `codegen`.
+    The functions are written as soon as each statement is done,
+    and `main` goes through a temporary file until the end"""
+    mod = Module(runtime, filename, counters)
+    main = mod.functions[0]
+    out.write(load_runtime(runtime))
+    out.write('\n')
+
+    with tempfile.TemporaryFile('w+') as body:
+        for node in nodes:
+            mod.types.infer(node)
+            mod.add_str(gen_expr(node, mod))
+            # Nothing needs the types of nodes that are done with
+            mod.types.types.clear()
+
+            mod.write_definitions(out, mod.functions[1:])
+            del mod.functions[1:]
+            mod.globals = []
+            main.block.write_exprs(body)
+            main.block.exprs = []
+
+        out.write('int main()  {\n')
+        body.seek(0)
+        shutil.copyfileobj(body, out)
+        out.write('}\n\n')
@@ -0,0 +1,128 @@
+"""Moves hot functions from the interpreter to native code while it runs
+
+Every call to a `Function` is counted, and once one has been called
+`threshold` times, it's compiled to C with `codegen` (along with every
+function it calls), built as a shared library and loaded with `shared`.
+After that, calls to it go straight to the C.
+A short script never gets that far, so it starts as fast as it always did.
+
+To use it, give the `Context` a `Tiers`, like a `purity.Memo`:
+    ctx = Context(tiers=Tiers(tree))
+
+Only functions where the C gives exactly the same answer get compiled:
+ - pure ones (see `purity`), so they don't print, and don't see the caller's
+   variables, which the C can't do. They can only call pure functions too
+ - ones that take and return ints, and don't have floats anywhere in them,
+   since the C `float` is less precise than a Python one
+ - ones without `/`, since that's integer division in C
+and only calls with an int that fits in a C `int` go to the C.
+The C checks every +, - and * for overflow (see `codegen.Module`), and
+that it doesn't go more calls deep than Python would let the interpreter,
+so it can't run out of C stack. If either happens, the call is interpreted
+again, which is fine, since it's pure. Then the interpreter either gets
+the answer with Python's ints, or raises its RecursionError.
+Everything else, including anything that fails to compile, carries on in
+the interpreter.
+"""
+
+import ctypes
+import subprocess
+import sys
+from .ast import *
+from .infer import Inference
+from .native import NativeCache
+from .purity import Analysis, walk
+from . import shared
+
+INT = {'primitive': 'int'}
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+
+class Tiers:
+    def __init__(self, tree, threshold=1000, native=None):
+        """`tree` is the whole program, to find the pure functions in.
+        `native` is the `NativeCache` for the libraries"""
+        self.threshold = threshold
+        self.native = native or NativeCache()
+        analysis = Analysis(tree)
+        self.functions = {i: analysis.functions[i] for i in analysis.pure
+                          if i in analysis.returns_value}
+        self.counts = {}
+        # name -> the ctypes function, or False if it's staying interpreted
+        self.compiled = {}
+
+    def native_function(self, function, args):
+        """Counts a call to `function`, and returns the C version to call
+        instead, or None to interpret it.
+        The C version returns None if it overflowed, so it has to be
+        interpreted after all"""
+        name = function.name
+        compiled = self.compiled.get(name)
+        if compiled is None:
+            # It has to be the function we analysed, not just the same name
+            if self.functions.get(name) is not function:
+                return None
+            count = self.counts[name] = self.counts.get(name, 0) + 1
+            if count < self.threshold:
+                return None
+            compiled = self.compiled[name] = self.promote(function) or False
+        if compiled is False or type(args) is not int or \
+                not INT_MIN <= args <= INT_MAX:
+            return None
+        return compiled
+
+    def callees(self, function):
+        """`function` and every function it calls, callees first, so they're
+        defined before they're used. None if any of them can't be compiled"""
+        ret = []
+        seen = set()
+
+        def visit(fun):
+            seen.add(fun.name)
+            for node in walk(fun.body):
+                if isinstance(node, BinOp) and node.op == '/':
+                    return False
+                if isinstance(node, Literal) and (
+                        type(node.value) is not int or
+                        not INT_MIN <= node.value <= INT_MAX):
+                    return False
+                if isinstance(node, Call) and node.function not in seen:
+                    callee = self.functions.get(node.function)
+                    if callee is None or not visit(callee):
+                        return False
+            ret.append(fun)
+            return True
+
+        return ret if visit(function) else None
+
+    def promote(self, function):
+        "Compiles `function` and returns the C version, or None if we can't"
+        functions = self.callees(function)
+        if functions is None:
+            return None
+        tree = Block(*functions)
+        types = Inference()
+        try:
+            types.infer(tree)
+        except TypeCheckError:
+            return None
+        for i in functions:
+            if types[i]['argument'] != INT or types[i]['return'] != INT:
+                return None
+
+        try:
+            program = shared.load(tree, self.native, checked=True)
+        except (TypeError, OSError, subprocess.CalledProcessError):
+            return None
+        compiled = program[function.name]
+        overflowed = program.lib.phhe_overflowed
+        overflowed.argtypes = []
+        overflowed.restype = ctypes.c_int
+        ctypes.c_int.in_dll(program.lib, 'phhe_max_depth').value = \
+            sys.getrecursionlimit()
+
+        def call(args):
+            ret = compiled(args)
+            return None if overflowed() else ret
+        return call
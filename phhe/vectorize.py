@@ -0,0 +1,295 @@
+"""Evaluates a function over a whole NumPy array of arguments at once
+
+Calling a `Function` a million times in the interpreter walks its body a
+million times. This walks it once, with arrays where the interpreter would
+have numbers:
+
+    f = vectorize(tree.exprs[0])
+    f(numpy.arange(1000000))
+
+`BinOp`s become array operations. An `If` on an array evaluates each branch
+on just the elements that take it, then puts the results back together,
+or uses `numpy.where` if both branches are cheap enough to just do.
+Calls to other functions are vectorized the same way, recursion included,
+since the elements that stop recursing drop out at each level.
+
+It falls back to calling the function once per element with the interpreter
+where that's the only way to get the same answer:
+ - for functions that could `print`, since the output would come out
+   in a different order
+ - for `If` branches that declare variables, since they're only declared
+   for some of the elements
+ - past `max_depth` nested calls, so deep recursion doesn't blow the stack
+
+Otherwise the results are what the interpreter gives for each element,
+except that ints are NumPy's 64-bit ints, so they can overflow (like in C),
+and the results come back as one array, so they're all the same type.
+
+NumPy is optional, it's only needed to use this module.
+"""
+
+import operator
+from .ast import *
+from .optimize import leaks
+from .purity import walk
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+ops = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv
+}
+
+
+class Unvectorizable(Exception):
+    "Raised inside a function we can't vectorize, so it runs per element"
+
+
+def may_print(function, ctx):
+    """Whether calling `function` could print anything, following every call
+    to a function defined in it or in `ctx`. Names we can't find count too"""
+    todo = [function]
+    seen = set()
+    # Functions defined anywhere in what we've looked at, by name
+    defs = {}
+    calls = set()
+    while todo:
+        while todo:
+            node = todo.pop()
+            if id(node) in seen or node.body is None:
+                continue
+            seen.add(id(node))
+            for i in walk(node.body):
+                if isinstance(i, Function):
+                    defs.setdefault(i.name, []).append(i)
+                    todo.append(i)
+                elif isinstance(i, Call):
+                    calls.add(i.function)
+        # Then everything they call, until there's nothing new
+        for name in calls:
+            if name == 'print':
+                return True
+            found = defs.get(name, [])
+            fun = ctx.lookup(name)
+            if isinstance(fun, Function):
+                found = found + [fun]
+            elif not found:
+                return True
+            todo.extend(i for i in found if id(i) not in seen)
+    return False
+
+
+def number(value):
+    "Whether `value` is a number, or an array of them"
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in 'biuf'
+    return type(value) in (int, float)
+
+
+def cheap(node, env):
+    """Whether `node` is just arithmetic on numbers that can't fail,
+    so both `If` branches can run"""
+    for i in walk(node):
+        if isinstance(i, BinOp):
+            if i.op == '/':
+                return False
+        elif isinstance(i, Literal):
+            if not number(i.value):
+                return False
+        elif isinstance(i, VarAccess):
+            # The interpreter might never read it, if it's not there
+            if not number(env.lookup(i.name)):
+                return False
+        else:
+            return False
+    return True
+
+
+def full(value, n):
+    "`value` as an array of length `n`, if it isn't one already"
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, (int, float)):
+        return np.full(n, value)
+    ret = np.empty(n, dtype=object)
+    ret[:] = [value] * n
+    return ret
+
+
+def merge(mask, a, b, n):
+    "Puts together the results from the elements in `mask` and the rest"
+    parts = [i for i in (a, b) if i is not None]
+    try:
+        dtype = np.result_type(*parts) if len(parts) == 2 else object
+    except TypeError:
+        dtype = object
+    ret = np.empty(n, dtype=dtype)
+    ret[mask] = a
+    ret[~mask] = b
+    return ret
+
+
+class Vectorizer:
+    def __init__(self, ctx=None, max_depth=64):
+        if np is None:
+            raise ImportError("vectorize needs numpy")
+        self.ctx = ctx or Context()
+        self.max_depth = max_depth
+        self.depth = 0
+
+    def call(self, function, args):
+        "Returns an array of `function` called on each of `args`"
+        args = np.asarray(args)
+        # Our own stack, so nothing gets left in `ctx`
+        env = Context(self.ctx.memo)
+        env.stack = list(self.ctx.stack)
+        if may_print(function, env):
+            return self.each(function, args, env, len(args))
+        return full(self.call_function(function, args, env, len(args)),
+                    len(args))
+
+    def call_function(self, function, args, env, n):
+        "Like `Function.call`, with `env` and `args` holding arrays of `n` elements"
+        if function.body is None:
+            return None
+        if n == 0:
+            return np.empty(0)
+        base = len(env.stack)
+        self.depth += 1
+        try:
+            if self.depth > self.max_depth:
+                raise Unvectorizable()
+            env.push_scope()
+            env.add_binding(function.args[0], args)
+            return self.eval(function.body, env, n)
+        except Unvectorizable:
+            del env.stack[base:]
+            return self.each(function, full(args, n), env, n)
+        finally:
+            del env.stack[base:]
+            self.depth -= 1
+
+    def each(self, function, args, env, n):
+        "Calls `function` with the interpreter once for each element"
+        # Scopes without arrays in them are the same for every element
+        scopes = []
+        for scope in env.stack:
+            arrays = {k: v.tolist() for k, v in scope.items()
+                      if isinstance(v, np.ndarray)}
+            scopes.append((scope, arrays))
+        args = full(args, n).tolist()
+
+        ret = []
+        for i in range(n):
+            ctx = Context(env.memo)
+            ctx.stack = [dict(scope, **{k: v[i] for k, v in arrays.items()})
+                         if arrays else scope
+                         for scope, arrays in scopes]
+            ret.append(function.call(ctx, args[i]))
+        if all(isinstance(i, (int, float)) for i in ret):
+            return np.array(ret)
+        # Anything else, like None, is kept as it is
+        out = np.empty(n, dtype=object)
+        out[:] = ret
+        return out
+
+    def subset(self, env, mask):
+        "A copy of `env` with only the elements in `mask`"
+        ret = Context(env.memo)
+        for scope in env.stack:
+            if any(isinstance(v, np.ndarray) for v in scope.values()):
+                scope = {k: v[mask] if isinstance(v, np.ndarray) else v
+                         for k, v in scope.items()}
+            ret.stack.append(scope)
+        # `Context` starts with a scope of its own
+        del ret.stack[0]
+        return ret
+
+    def eval(self, node, env, n):
+        """Like `node.eval(env)`, except that values can be arrays of `n`
+        elements, one for each call"""
+        if isinstance(node, Literal):
+            return node.value
+        elif isinstance(node, BinOp):
+            lhs = self.eval(node.lhs, env, n)
+            rhs = self.eval(node.rhs, env, n)
+            arrays = isinstance(lhs, np.ndarray) or isinstance(rhs, np.ndarray)
+            if node.op == '/' and arrays and (np.asarray(rhs) == 0).any():
+                # NumPy would give inf, the interpreter raises
+                raise ZeroDivisionError('division by zero')
+            return ops[node.op](lhs, rhs)
+        elif isinstance(node, VarAccess):
+            return env.lookup(node.name)
+        elif isinstance(node, VarDeclare):
+            env.add_binding(node.name, self.eval(node.value, env, n))
+            return node.value
+        elif isinstance(node, Block):
+            ret = None
+            env.push_scope()
+            for i in node.exprs:
+                ret = self.eval(i, env, n)
+            env.pop_scope()
+            return ret
+        elif isinstance(node, If):
+            return self.eval_if(node, env, n)
+        elif isinstance(node, Call):
+            if node.function == 'print':
+                raise Unvectorizable()
+            fun = env.lookup(node.function)
+            args = self.eval(node.args, env, n)
+            if not isinstance(fun, Function):
+                raise Unvectorizable()
+            return self.call_function(fun, args, env, n)
+        elif isinstance(node, Function):
+            env.add_binding(node.name, node)
+            return None
+        raise Unvectorizable()
+
+    def eval_if(self, node, env, n):
+        cond = self.eval(node.cond, env, n)
+        if not isinstance(cond, np.ndarray):
+            # Every element goes the same way
+            if cond != 0:
+                return self.eval(node.if_branch, env, n)
+            elif node.else_branch is not None:
+                return self.eval(node.else_branch, env, n)
+            return None
+
+        branches = [node.if_branch, node.else_branch]
+        if any(i is not None and leaks(i) for i in branches):
+            raise Unvectorizable()
+        mask = cond != 0
+
+        if node.else_branch is not None and \
+                cheap(node.if_branch, env) and cheap(node.else_branch, env):
+            return np.where(mask, self.eval(node.if_branch, env, n),
+                            self.eval(node.else_branch, env, n))
+
+        results = []
+        for branch, which in zip(branches, (mask, ~mask)):
+            count = int(which.sum())
+            if branch is None or count == 0:
+                results.append(None)
+            else:
+                results.append(self.eval(branch, self.subset(env, which),
+                                         count))
+        return merge(mask, results[0], results[1], n)
+
+
+def vectorize(function, ctx=None, max_depth=64):
+    """Returns a function that takes an array of arguments, and returns an
+    array of what `function` gives for each of them.
+    `function` is a `Function`, or the name of one in `ctx`"""
+    vectorizer = Vectorizer(ctx, max_depth)
+    if isinstance(function, str):
+        name = function
+        function = vectorizer.ctx.lookup(name)
+        if not isinstance(function, Function):
+            raise NameError("There's no function called %r" % name)
+    return lambda args: vectorizer.call(function, args)
@@ -0,0 +1,409 @@
+"""A bytecode compiler and stack VM
+
+The program is resolved to frame slots first (see `resolve.py`),
+then flattened into one array of instructions. Dynamic names are kept
+in a stack of dicts, like they are there.
+Every instruction is two ints, an opcode and an argument,
+and every expression leaves exactly one value on the stack.
+Running it is a single loop with an explicit call stack,
+so neither long `BinOp` chains nor deep recursion use up the Python stack.
+"""
+
+from array import array
+from .ast import *
+from .resolve import *
+
+
+# Opcodes
+HALT = 0
+CONST = 1        # push consts[arg]
+LOCAL = 2        # push frame[arg]
+LOAD = 3         # push the first non-None of addresses[arg]
+DECLARE = 4      # frame[slot] = top, and replace top with the node
+POP = 5
+ADD = 6
+SUB = 7
+MUL = 8
+DIV = 9
+JUMP = 10        # pc = arg
+JUMP_IF_ZERO = 11  # pop, pc = arg if it was 0
+CLOSURE = 12     # define functions[arg], push None
+CALL = 13        # pop the argument and the function, then call it
+RETURN = 14
+PRINT = 15       # pop, print, push None
+EVAL = 16        # push consts[arg].eval(Context()), for nodes we don't know
+DYNAMIC_LOAD = 17  # push the dynamic name consts[arg]
+DYNAMIC_DECLARE = 18  # like DECLARE, but into the innermost dict
+PUSH_SCOPE = 19  # push a dict for dynamic names
+POP_SCOPE = 20
+
+opnames = {
+    HALT: 'HALT', CONST: 'CONST', LOCAL: 'LOCAL', LOAD: 'LOAD',
+    DECLARE: 'DECLARE', POP: 'POP', ADD: 'ADD', SUB: 'SUB', MUL: 'MUL',
+    DIV: 'DIV', JUMP: 'JUMP', JUMP_IF_ZERO: 'JUMP_IF_ZERO',
+    CLOSURE: 'CLOSURE', CALL: 'CALL', RETURN: 'RETURN', PRINT: 'PRINT',
+    EVAL: 'EVAL', DYNAMIC_LOAD: 'DYNAMIC_LOAD',
+    DYNAMIC_DECLARE: 'DYNAMIC_DECLARE', PUSH_SCOPE: 'PUSH_SCOPE',
+    POP_SCOPE: 'POP_SCOPE'
+}
+
+binops = {'+': ADD, '-': SUB, '*': MUL, '/': DIV}
+
+
+class VMFunction:
+    def __init__(self, name, slot, size, has_body, pushes=False, arg=None):
+        """`slot` is None if the name is dynamic. With `pushes`, calls push
+        a dict, which has the argument in it if `arg` is its name"""
+        self.name = name
+        self.slot = slot
+        self.size = size
+        self.has_body = has_body
+        self.pushes = pushes
+        self.arg = arg
+        # Filled in when the body is compiled
+        self.entry = None
+
+    def __repr__(self):
+        return "VMFunction(%r)" % self.name
+
+
+class VMClosure:
+    def __init__(self, function, env):
+        self.function = function
+        self.env = env
+
+    def __repr__(self):
+        return "VMClosure(%r)" % self.function.name
+
+
+class Label:
+    def __init__(self):
+        self.pos = None
+        # Places in the code to patch once we know `pos`
+        self.fixups = []
+
+
+class Bytecode:
+    "A compiled program"
+
+    def __init__(self, code, consts, addresses, declares, functions, size):
+        self.code = code
+        self.consts = consts
+        self.addresses = addresses
+        self.declares = declares
+        self.functions = functions
+        self.size = size
+
+    def run(self):
+        return run(self)
+
+    def disassemble(self):
+        return disassemble(self)
+
+
+class Compiler:
+    def __init__(self):
+        self.code = array('i')
+        self.consts = []
+        # Maps (type, value) to an index in `consts`, for hashable values
+        self.const_index = {}
+        self.addresses = []
+        self.declares = []
+        self.functions = []
+        # ResolvedFunctions that still need their bodies compiled
+        self.queue = []
+        # Nothing before this may be changed by the peephole optimizer,
+        #   because a jump lands here
+        self.barrier = 0
+
+    def emit(self, op, arg=0):
+        self.code.append(op)
+        self.code.append(arg)
+
+    def const(self, value):
+        try:
+            key = (type(value), value)
+            index = self.const_index.get(key)
+        except TypeError:
+            key = index = None
+        if index is None:
+            index = len(self.consts)
+            self.consts.append(value)
+            if key is not None:
+                self.const_index[key] = index
+        return index
+
+    def place(self, label):
+        label.pos = len(self.code)
+        for i in label.fixups:
+            self.code[i] = label.pos
+        self.barrier = label.pos
+
+    def jump(self, op, label):
+        self.emit(op, 0)
+        label.fixups.append(len(self.code) - 1)
+
+    def discard(self):
+        "Throws away the value of the last expression"
+        code = self.code
+        if len(code) - 2 >= self.barrier and code[-2] in (CONST, LOCAL):
+            # Pushing a value just to pop it is pointless
+            del code[-2:]
+        else:
+            self.emit(POP)
+
+    def compile(self, root):
+        # This uses a list of things to do instead of recursion,
+        #   so deep trees don't hit the recursion limit
+        todo = [root]
+        while todo:
+            item = todo.pop()
+            if type(item) is tuple:
+                action = item[0]
+                if action == 'emit':
+                    self.emit(item[1], item[2])
+                elif action == 'jump':
+                    self.jump(item[1], item[2])
+                elif action == 'place':
+                    self.place(item[1])
+                elif action == 'discard':
+                    self.discard()
+            elif isinstance(item, Const):
+                self.emit(CONST, self.const(item.value))
+            elif isinstance(item, Op):
+                todo.append(('emit', binops[item.op], 0))
+                todo.append(item.rhs)
+                todo.append(item.lhs)
+            elif isinstance(item, Cond):
+                else_label = Label()
+                end_label = Label()
+                else_branch = item.else_branch
+                if else_branch is None:
+                    else_branch = Const(None)
+                todo.extend(reversed([
+                    item.cond,
+                    ('jump', JUMP_IF_ZERO, else_label),
+                    item.if_branch,
+                    ('jump', JUMP, end_label),
+                    ('place', else_label),
+                    else_branch,
+                    ('place', end_label),
+                ]))
+            elif isinstance(item, LoadLocal):
+                self.emit(LOCAL, item.slot)
+            elif isinstance(item, Load):
+                self.addresses.append(item.candidates)
+                self.emit(LOAD, len(self.addresses) - 1)
+            elif isinstance(item, DynamicLoad):
+                self.emit(DYNAMIC_LOAD, self.const(item.name))
+            elif isinstance(item, Store):
+                self.declares.append((item.slot, item.node))
+                todo.append(('emit', DECLARE, len(self.declares) - 1))
+                todo.append(item.value)
+            elif isinstance(item, DynamicStore):
+                self.declares.append((item.name, item.node))
+                todo.append(('emit', DYNAMIC_DECLARE, len(self.declares) - 1))
+                todo.append(item.value)
+            elif isinstance(item, ResolvedFunction):
+                function = VMFunction(
+                    item.name, item.slot, item.size, item.body is not None,
+                    item.pushes, item.node.args[0] if item.dynamic_arg else None)
+                self.functions.append(function)
+                if item.body is not None:
+                    self.queue.append((function, item.body))
+                self.emit(CLOSURE, len(self.functions) - 1)
+            elif isinstance(item, Invoke):
+                todo.append(('emit', CALL, 0))
+                todo.append(item.arg)
+                todo.append(item.function)
+            elif isinstance(item, Print):
+                todo.append(('emit', PRINT, 0))
+                todo.append(item.arg)
+            elif isinstance(item, Seq):
+                if not item.exprs:
+                    self.emit(CONST, self.const(None))
+                    continue
+                steps = []
+                for i in item.exprs:
+                    steps.append(i)
+                    steps.append(('discard',))
+                steps.pop()
+                if item.stack is not None:
+                    steps = [('emit', PUSH_SCOPE, 0)] + steps + \
+                        [('emit', POP_SCOPE, 0)]
+                todo.extend(reversed(steps))
+            elif isinstance(item, Opaque):
+                self.emit(EVAL, self.const(item.node))
+            else:
+                raise TypeError("Can't compile %r" % item)
+
+    def compile_program(self, program):
+        self.compile(program.body)
+        self.emit(HALT)
+
+        # Function bodies go after the main program
+        while self.queue:
+            function, body = self.queue.pop(0)
+            self.barrier = function.entry = len(self.code)
+            self.compile(body)
+            self.emit(RETURN)
+
+        return Bytecode(self.code, self.consts, self.addresses,
+                        self.declares, self.functions, program.size)
+
+
+def compile_vm(node):
+    "Compiles an AST, usually the `Block` from `exprs.parse`, to bytecode"
+    return Compiler().compile_program(resolve(node))
+
+
+def run(bytecode):
+    code = bytecode.code
+    consts = bytecode.consts
+    addresses = bytecode.addresses
+    declares = bytecode.declares
+    functions = bytecode.functions
+
+    frame = [None] * bytecode.size
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # The dicts for dynamic names, starting with the one `Context()` has
+    scopes = [{}]
+    # (return address, frame, whether it pushed a dict) for each call
+    #   in progress
+    calls = []
+    pc = 0
+
+    while True:
+        op = code[pc]
+        arg = code[pc + 1]
+        pc += 2
+
+        if op == LOCAL:
+            push(frame[arg])
+        elif op == CONST:
+            push(consts[arg])
+        elif op == ADD:
+            rhs = pop()
+            stack[-1] = stack[-1] + rhs
+        elif op == SUB:
+            rhs = pop()
+            stack[-1] = stack[-1] - rhs
+        elif op == MUL:
+            rhs = pop()
+            stack[-1] = stack[-1] * rhs
+        elif op == DIV:
+            rhs = pop()
+            stack[-1] = stack[-1] / rhs
+        elif op == JUMP_IF_ZERO:
+            if not pop() != 0:
+                pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == LOAD:
+            v = None
+            for depth, slot in addresses[arg]:
+                f = frame
+                for _ in range(depth):
+                    f = f[0]
+                v = f[slot]
+                if v is not None:
+                    break
+            push(v)
+        elif op == CALL:
+            x = pop()
+            fun = pop()
+            if type(fun) is VMClosure:
+                function = fun.function
+                if function.has_body:
+                    calls.append((pc, frame, function.pushes))
+                    if function.pushes:
+                        scopes.append({} if function.arg is None
+                                      else {function.arg: x})
+                    frame = [None] * function.size
+                    frame[0] = fun.env
+                    frame[1] = x
+                    pc = function.entry
+                else:
+                    push(None)
+            else:
+                push(fun.call(x))
+        elif op == RETURN:
+            pc, frame, pushed = calls.pop()
+            if pushed:
+                scopes.pop()
+        elif op == POP:
+            pop()
+        elif op == DECLARE:
+            slot, node = declares[arg]
+            frame[slot] = stack[-1]
+            stack[-1] = node
+        elif op == CLOSURE:
+            function = functions[arg]
+            if function.slot is None:
+                scopes[-1][function.name] = VMClosure(function, frame)
+            else:
+                frame[function.slot] = VMClosure(function, frame)
+            push(None)
+        elif op == DYNAMIC_LOAD:
+            name = consts[arg]
+            v = None
+            for scope in reversed(scopes):
+                v = scope.get(name)
+                if v is not None:
+                    break
+            push(v)
+        elif op == DYNAMIC_DECLARE:
+            name, node = declares[arg]
+            scopes[-1][name] = stack[-1]
+            stack[-1] = node
+        elif op == PUSH_SCOPE:
+            scopes.append({})
+        elif op == POP_SCOPE:
+            scopes.pop()
+        elif op == PRINT:
+            print(stack[-1])
+            stack[-1] = None
+        elif op == EVAL:
+            push(consts[arg].eval(Context()))
+        elif op == HALT:
+            return pop()
+        else:
+            raise ValueError("Bad opcode %r at %r" % (op, pc - 2))
+
+
+def disassemble(bytecode):
+    "Returns a readable listing of the bytecode"
+    entries = {}
+    for i in bytecode.functions:
+        if i.entry is not None:
+            entries[i.entry] = i.name
+
+    lines = []
+    code = bytecode.code
+    for pc in range(0, len(code), 2):
+        if pc in entries:
+            lines.append('')
+            lines.append('%s:' % entries[pc])
+        op = code[pc]
+        arg = code[pc + 1]
+        line = '%6d %-13s' % (pc, opnames.get(op, op))
+
+        if op in (CONST, EVAL, DYNAMIC_LOAD):
+            line += '%d (%r)' % (arg, bytecode.consts[arg])
+        elif op == LOCAL:
+            line += '%d' % arg
+        elif op == LOAD:
+            line += '%d %r' % (arg, bytecode.addresses[arg])
+        elif op == DECLARE:
+            line += '%d (slot %d)' % (arg, bytecode.declares[arg][0])
+        elif op == DYNAMIC_DECLARE:
+            line += '%d (%s)' % (arg, bytecode.declares[arg][0])
+        elif op in (JUMP, JUMP_IF_ZERO):
+            line += '%d' % arg
+        elif op == CLOSURE:
+            line += '%d (%s)' % (arg, bytecode.functions[arg].name)
+        lines.append(line.rstrip())
+
+    return '\n'.join(lines)
@@ -4,7 +4,28 @@ import unittest
 from test_parse import *
 from test_interpreter import *
 from test_types import *
+from test_ast import *
 from test_codegen import *
+from test_closures import *
+from test_resolve import *
+from test_vm import *
+from test_pratt import *
+from test_astcache import *
+from test_native import *
+from test_purity import *
+from test_optimize import *
+from test_infer import *
+from test_batch import *
+from test_benchmarks import *
+from test_profiler import *
+from test_vectorize import *
+from test_stream import *
+from test_driver import *
+from test_pyback import *
+from test_shared import *
+from test_tiered import *
+from test_server import *
+from test_build import *
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,46 @@
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+
+
+class TestNodes(TestCase):
+    def test_slots(self):
+        for node in [Literal(1), VarAccess('x'), Block()]:
+            self.assertFalse(hasattr(node, '__dict__'))
+
+    def test_eq_hash(self):
+        source = 'fun f(x: {primitive: int}) = { y = x * 2  if y then y else 1 }'
+        a = exprs.parse(source)
+        b = exprs.parse(source)
+        self.assertIsNot(a, b)
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len({a, b}), 1)
+
+        self.assertNotEqual(exprs.parse('1 + 2'), exprs.parse('1 + 3'))
+        # These print different things
+        self.assertNotEqual(Literal(1), Literal(1.0))
+        self.assertNotEqual(Literal(1), VarAccess(1))
+
+    def test_deep(self):
+        tree = Literal(0)
+        for i in range(50000):
+            tree = BinOp(tree, '+', Literal(i % 10))
+        self.assertIsInstance(hash(tree), int)
+
+    def test_hash_cons(self):
+        make = HashCons()
+        self.assertIs(make(Literal, 1), make(Literal, 1))
+        self.assertIsNot(make(Literal, 1), make(Literal, 1.0))
+
+        tree = exprs.parse('''
+x = (a + 1) * (a + 1)
+y = { 2 + 3 }
+z = { 2 + 3 }
+''')
+        shared = make.share(tree)
+        self.assertEqual(shared, tree)
+        x, y, z = shared.exprs
+        self.assertIs(x.value.lhs, x.value.rhs)
+        self.assertIs(y.value, z.value)
+        self.assertIs(make.share(exprs.parse('{ 2 + 3 }')).exprs[0], y.value)
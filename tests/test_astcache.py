@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+from phhe.astcache import *
+from phhe.vm import compile_vm
+
+
+class TestASTCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = ASTCache(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_roundtrip(self):
+        with open('tests/test.ph', 'rb') as f:
+            source = f.read()
+        tree = exprs.parse(source.decode())
+        self.assertEqual(unflatten(flatten(tree)), tree)
+
+        self.assertIsNone(self.cache.get(source))
+        self.assertEqual(self.cache.parse(source), tree)
+        self.assertEqual(self.cache.get(source), tree)
+
+    def test_lines(self):
+        source = b'x = 1\n\nfun f(a: {primitive: int}) = {\n  a\n}\nf(x)\n'
+        self.cache.parse(source)
+        tree = self.cache.get(source)
+        self.assertEqual([i.line for i in tree.exprs], [1, 3, 6])
+        self.assertEqual(tree.exprs[1].body.exprs[0].line, 4)
+
+    def test_everything(self):
+        source = b'''
+fun putchar ( x : {primitive : int }): {primitive: int}
+fun f(i: {primitive: int}) = if i then print(i) else { x = -2.5 }
+f(f(1) + 2 * 3)
+'''
+        self.cache.parse(source)
+        self.assertEqual(self.cache.get(source), exprs.parse(source.decode()))
+
+    def test_deep(self):
+        tree = Literal(0)
+        for i in range(20000):
+            tree = BinOp(tree, '+', Literal(1))
+        tree = Block(tree)
+        self.cache.put(b'deep', tree)
+        self.assertEqual(compile_vm(self.cache.get(b'deep')).run(), 20000)
+
+    def test_corrupt(self):
+        self.cache.parse(b'x = 1')
+        [entry] = os.listdir(self.dir.name)
+        with open(os.path.join(self.dir.name, entry), 'wb') as f:
+            f.write(b'nonsense')
+        self.assertIsNone(self.cache.get(b'x = 1'))
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_eviction(self):
+        self.cache.max_bytes = 100
+        for i in range(10):
+            self.cache.parse(b'x = %d' % i)
+            os.utime(self.cache.entry(self.cache.key(b'x = %d' % i)),
+                     (i, i))
+        total = sum(os.path.getsize(os.path.join(self.dir.name, i))
+                    for i in os.listdir(self.dir.name))
+        self.assertLessEqual(total, 100)
+        # The newest one is kept
+        self.assertEqual(self.cache.get(b'x = 9'),
+                         Block(VarDeclare('x', Literal(9))))
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import tempfile
+
+from context import *
+from phhe.batch import *
+
+
+class TestBatch(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.dir.name, 'src')
+        self.out = os.path.join(self.dir.name, 'out')
+        files = {
+            'a.ph': 'print(1 + 2)\n',
+            'sub/b.ph': 'fun f(x: {primitive: int}) = x * 2\nprint(f(21))\n',
+            'sub/c.ph': '(\n',
+            'notes.txt': 'not a program\n',
+        }
+        for name, text in files.items():
+            path = os.path.join(self.src, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def compile(self, **kwargs):
+        return compile_all([self.src], self.out, cache=False, **kwargs)
+
+    def test_batch(self):
+        results = self.compile(jobs=2)
+        self.assertEqual([os.path.relpath(i.dest, self.out) for i in results],
+                         ['a.c', os.path.join('sub', 'b.c'),
+                          os.path.join('sub', 'c.c')])
+        self.assertIsNone(results[0].error)
+        self.assertIsNone(results[1].error)
+        self.assertIn('ParseError', results[2].error)
+        self.assertFalse(os.path.exists(results[2].dest))
+
+        # Doing it again in one process gives the same C
+        with open(results[1].dest) as f:
+            c = f.read()
+        again = self.compile(jobs=1)
+        self.assertEqual([i.error for i in again], [i.error for i in results])
+        with open(again[1].dest) as f:
+            self.assertEqual(f.read(), c)
+
+    def test_cc(self):
+        results = self.compile(jobs=2, cc='cc')
+        self.assertIsNone(results[2].exe)
+        output = subprocess.run([results[1].exe], capture_output=True,
+                                text=True).stdout
+        self.assertEqual(output, '42\n')
+
+    def test_clash(self):
+        # Both of these would be x.c in `out`
+        for name in ('one', 'two'):
+            os.makedirs(os.path.join(self.dir.name, name))
+            with open(os.path.join(self.dir.name, name, 'x.ph'), 'w') as f:
+                f.write('print(1)\n')
+        results = compile_all(
+            [os.path.join(self.dir.name, 'one', 'x.ph'),
+             os.path.join(self.dir.name, 'two', 'x.ph'),
+             os.path.join(self.src, 'a.ph')], self.out, jobs=2, cache=False)
+        # Still sorted by path: one/x.ph, src/a.ph, two/x.ph
+        self.assertEqual([os.path.basename(i.dest) for i in results],
+                         ['x.c', 'a.c', 'x.c'])
+        self.assertIn('Another file', results[0].error)
+        self.assertIsNone(results[1].error)
+        self.assertIn('Another file', results[2].error)
+        self.assertFalse(os.path.exists(os.path.join(self.out, 'x.c')))
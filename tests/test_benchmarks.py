@@ -0,0 +1,37 @@
+import io
+import json
+from contextlib import redirect_stdout
+
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+from phhe import pratt
+from benchmarks.generate import *
+from benchmarks.run import *
+
+
+class TestBenchmarks(TestCase):
+    def test_generate(self):
+        source = generate(3, size=15, depth=3, recursion=10, functions=3)
+        self.assertEqual(source, generate(3, size=15, depth=3, recursion=10,
+                                          functions=3))
+        self.assertNotEqual(source, generate(4, size=15, depth=3,
+                                             recursion=10, functions=3))
+        tree = exprs.parse(source)
+        self.assertEqual(tree, pratt.parse(source))
+        with redirect_stdout(io.StringIO()) as out:
+            tree.eval(Context())
+        self.assertTrue(out.getvalue())
+
+    def test_sizes(self):
+        small = generate(0, size=10, depth=2)
+        self.assertLess(len(small), len(generate(0, size=100, depth=2)))
+        self.assertLess(len(small), len(generate(0, size=10, depth=5)))
+
+    def test_benchmark(self):
+        result = benchmark('tiny', dict(size=5, depth=2, recursion=5,
+                                        functions=2), repeat=1, cc=True)
+        # It has to be JSON
+        result = json.loads(json.dumps(result))
+        self.assertEqual(set(result['timings']), set(stages))
+        self.assertGreater(result['nodes'], 0)
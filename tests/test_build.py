@@ -0,0 +1,102 @@
+import contextlib
+import io
+import os
+import subprocess
+import tempfile
+
+from context import *
+from phhe.ast import *
+from phhe import astcache, parse, pratt
+from phhe.build import *
+from phhe.native import NativeCache
+
+
+class TestBuild(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.write('lib', 'fun sq(n: {primitive: int}) = n * n\nprint(7)\n')
+        self.write('util', 'import lib\nfun quad(n: {primitive: int}) = sq(sq(n))\n')
+        self.write('main', 'import util\nimport lib\nprint(quad(2))\nsq(5)\n')
+        self.main = self.path('main')
+        self.build = Build(os.path.join(self.dir.name, 'build'),
+                           native=NativeCache(os.path.join(self.dir.name, 'native')))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name + '.ph')
+
+    def write(self, name, source):
+        with open(self.path(name), 'w') as f:
+            f.write(source)
+
+    def run_exe(self):
+        exe = self.build.build(self.main)
+        return subprocess.run([exe], capture_output=True, text=True).stdout
+
+    def test_parse(self):
+        source = 'import lib\nimport = 3\nimport(2)'
+        tree = pratt.parse(source)
+        self.assertEqual(tree, parse.exprs.parse(source))
+        self.assertEqual(tree.exprs[0], Import('lib'))
+        self.assertEqual(astcache.unflatten(astcache.flatten(tree)), tree)
+
+    def test_link(self):
+        tree = link(self.main)
+        # `lib` is only put in once, where `util` imports it
+        self.assertEqual(len(tree.exprs), 5)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(tree.eval(Context()), 25)
+        self.assertEqual(out.getvalue(), '7\n16\n')
+
+    def test_errors(self):
+        self.write('lib', 'import main\n')
+        with self.assertRaisesRegex(ImportError, 'main -> util -> lib -> main'):
+            link(self.main)
+        with self.assertRaisesRegex(ImportError, 'main -> util -> lib -> main'):
+            self.build.build(self.main)
+        self.write('lib', 'import nope\n')
+        with self.assertRaisesRegex(ImportError, 'no module nope'):
+            link(self.main)
+        with self.assertRaisesRegex(ImportError, 'no module nope'):
+            self.build.build(self.main)
+        self.write('lib', '{ import util }\n')
+        with self.assertRaisesRegex(ImportError, 'top level'):
+            link(self.main)
+        with self.assertRaises(ImportError):
+            pratt.parse('import lib').eval(Context())
+
+    def test_types(self):
+        # A float would be cut down to an int in the C
+        self.write('lib', 'fun sq(n: {primitive: int}) = 1.5\n')
+        with self.assertRaisesRegex(TypeError, 'sq takes int, but gets float'):
+            self.build.build(self.main)
+        # And there's no C type for a mix of the two
+        self.write('lib', 'fun sq(n: {primitive: int}) = n * 2.5\n')
+        with self.assertRaisesRegex(TypeError, 'lib: sq takes int and returns null'):
+            self.build.build(self.main)
+
+    def test_build(self):
+        # Same as the interpreter, except `main` doesn't print its value
+        self.assertEqual(self.run_exe(), '7\n16\n')
+        self.assertEqual(self.build.rebuilt, ['lib', 'util', 'main'])
+        self.build.build(self.main)
+        self.assertEqual(self.build.rebuilt, [])
+
+        # The type of `sq` is the same, so only `lib` changes
+        self.write('lib', 'fun sq(n: {primitive: int}) = n + n\nprint(8)\n')
+        self.assertEqual(self.run_exe(), '8\n8\n')
+        self.assertEqual(self.build.rebuilt, ['lib'])
+
+        # Now it's floats, so `util` has to be compiled again,
+        #   and the type of `quad` changes, so `main` does too
+        self.write('lib', 'fun sq(n: {primitive: float}) = n * 1.5\n')
+        self.build.build(self.main)
+        self.assertEqual(self.build.rebuilt, ['lib', 'util', 'main'])
+
+        # A new build with the same directory remembers all that
+        build = Build(self.build.directory, native=self.build.native)
+        self.write('main', 'import util\nprint(3)\n')
+        build.build(self.main)
+        self.assertEqual(build.rebuilt, ['main'])
@@ -0,0 +1,45 @@
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+from phhe.closures import *
+
+
+def run(code):
+    return compile_closure(exprs.parse(code))(Context())
+
+
+class TestClosures(TestCase):
+    "The closure compiler should agree with `eval()`"
+
+    def test_file(self):
+        tree = parse_file('tests/test.ph')
+        self.assertEqual(compile_closure(tree)(Context()),
+                         tree.eval(Context()))
+
+    def test_binop(self):
+        code = '8 + 1.2 + 9 * (2 - 3) / -2'
+        self.assertEqual(run(code), exprs.parse(code).eval(Context()))
+
+    def test_if(self):
+        self.assertEqual(run('if 0 then 1 else 2'), 2)
+        self.assertEqual(run('if 1.2 then 21'), 21)
+        self.assertIsNone(run('if 0.0 then 12'))
+
+    def test_recursion(self):
+        code = '''
+fun fib(n: {primitive: int}) = if n then (if n - 1 then fib(n - 1) + fib(n - 2) else 1) else 0
+fib(15)
+'''
+        self.assertEqual(run(code), 610)
+        self.assertEqual(run(code), exprs.parse(code).eval(Context()))
+
+    def test_scopes(self):
+        # The inner `y` shadows, and functions see the caller's scope
+        self.assertEqual(run('''
+y = 3
+fun f(x: {primitive: int}) = x + y
+{
+    y = 10
+    f(1)
+}
+'''), 11)
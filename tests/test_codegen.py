@@ -1,5 +1,7 @@
 import subprocess
+import io
 import os
+import tempfile
 
 from context import *
 
@@ -7,20 +9,25 @@ import parsy
 from phhe.parse import *
 from phhe.ast import *
 from phhe.codegen import *
+from phhe import pratt
 
 
-def compile_and_run(code):
+def compile_and_run(code, **kwargs):
     e = exprs.parse(code)
-    s = str(codegen([e]))
-    f = open('test.c', 'w')
-    f.write(s)
-    f.close()
-    subprocess.run(['cc', '-o', 'test.out', 'test.c'], check=True)
+    return run_c(str(codegen([e], **kwargs))).stdout
 
-    completed = subprocess.run(['.' + os.sep + 'test.out'],
-                               capture_output=True, text=True)
 
-    return completed.stdout
+def run_c(s):
+    with tempfile.TemporaryDirectory() as d:
+        c_file = os.path.join(d, 'test.c')
+        exe = os.path.join(d, 'test.out')
+        with open(c_file, 'w') as f:
+            f.write(s)
+        # Calling something that isn't declared is an error in newer compilers
+        subprocess.run(['cc', '-Werror=implicit-function-declaration',
+                        '-o', exe, c_file], check=True)
+
+        return subprocess.run([exe], capture_output=True, text=True)
 
 
 class TestCodegen(TestCase):
@@ -72,3 +79,56 @@ if 1 + 2 then print(12) else print(13)
 if 12 / 2 - 6 then print(14) else print(15)
 ''')
         self.assertEqual(output, '6\n12\n15\n')
+
+    def test_stream(self):
+        with open('tests/test.ph') as f:
+            source = f.read()
+        tree = exprs.parse(source + '''
+fun f(x: {primitive: int}) = if x then { y = x if y then 1 else 2 } else 3
+''')
+        out = io.StringIO()
+        self.assertIsNone(codegen([tree], out))
+        self.assertEqual(out.getvalue(), codegen([tree]))
+
+    def test_tail_call(self):
+        # Without the loop this would overflow the C stack
+        output = compile_and_run('''
+fun count(n: {primitive: int}): {primitive: int} = if n then count(n - 1) else 42
+print(count(10000000))
+''')
+        self.assertEqual(output, '42\n')
+
+    def test_lines(self):
+        tree = pratt.parse('''
+fun twice(x: {primitive: int}): {primitive: int} = x * 2
+y = twice(4)
+
+print(y)
+''')
+        c = codegen([tree], filename='dir/my "file".ph')
+        self.assertIn('#line 2 "dir/my \\"file\\".ph"\nint twice(', c)
+        self.assertIn('#line 3 "dir/my \\"file\\".ph"\n\tint y$0', c)
+        self.assertIn('#line 5 "dir/my \\"file\\".ph"\n\tprint(', c)
+        self.assertEqual(run_c(c).stdout, '8\n')
+        # Without a filename it's the same as it always was
+        self.assertNotIn('#line', codegen([tree]))
+
+    def test_counters(self):
+        code = '''
+fun count(n: {primitive: int}): {primitive: int} = if n then count(n - 1) else 42
+fun twice(n: {primitive: int}): {primitive: int} = count(n) + count(n)
+print(twice(5))
+'''
+        completed = run_c(codegen([pratt.parse(code)], filename='c.ph',
+                                  counters=True))
+        self.assertEqual(completed.stdout, '84\n')
+        lines = completed.stderr.splitlines()
+        self.assertEqual(lines[0].split(), ['calls', 'seconds', 'function'])
+        calls = {i.split()[2]: (int(i.split()[0]), i.split()[3])
+                 for i in lines[1:]}
+        # The tail calls are a loop, so they don't count
+        self.assertEqual(calls, {'count': (2, '(c.ph:2)'),
+                                 'twice': (1, '(c.ph:3)')})
+
+        # Nothing's printed if nothing's counted
+        self.assertEqual(run_c(codegen([pratt.parse('print(1)')])).stderr, '')
@@ -0,0 +1,109 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+from context import *
+import phhe
+from phhe.driver import *
+
+
+class FakeClock:
+    "Goes up by one every time it's read"
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+class TestDriver(TestCase):
+    def test_api(self):
+        with redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(phhe.run('print(2)\n1 + 2'), 3)
+        self.assertEqual(out.getvalue(), '2\n')
+
+        with redirect_stdout(io.StringIO()) as out:
+            c = phhe.compile('print(1 + 2)', filename='x.ph')
+        # Compiling doesn't run anything
+        self.assertEqual(out.getvalue(), '')
+        self.assertIn('#line 1 "x.ph"', c)
+        self.assertIn('print(3)', c)
+
+        phhe.check('x = 1 + 2')
+        with self.assertRaises(TypeCheckError):
+            phhe.check('c = 1\nx = if c then 1 else 2.0')
+
+    def test_timings(self):
+        timings = Timings(FakeClock())
+        driver = Driver(timings=timings)
+        tree = driver.optimize(driver.parse('x = 1'))
+        driver.parse('y = 2')
+        self.assertEqual(timings.stages, [['parse', 2], ['optimize', 1]])
+        self.assertEqual(timings.total(), 3)
+        self.assertEqual(timings.report().splitlines()[-1].split(),
+                         ['total', '3.000000s'])
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as d:
+            driver = Driver()
+            tree = driver.parse('fun sq(n: {primitive: int}) = n * n')
+            program = driver.load(tree, native=phhe.native.NativeCache(d))
+            self.assertEqual(program['sq'](7), 49)
+            self.assertEqual([i[0] for i in driver.timings.stages],
+                             ['parse', 'load'])
+
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'test.ph')
+            dest = os.path.join(d, 'test.c')
+            with open(path, 'w') as f:
+                f.write('print(7)\n')
+
+            def cli(*args):
+                return subprocess.run(
+                    [sys.executable, '-m', 'phhe', '--no-cache', path] +
+                    list(args), capture_output=True, text=True)
+
+            self.assertEqual(cli().stdout, '7\n')
+            # Writing the C doesn't interpret it too
+            completed = cli(dest, '--time')
+            self.assertEqual(completed.stdout, '')
+            with open(dest) as f:
+                self.assertIn('print(7)', f.read())
+            stages = [i.split()[0] for i in completed.stderr.splitlines()]
+            self.assertEqual(stages, ['read', 'parse', 'optimize', 'codegen',
+                                      'total'])
+            self.assertIn('print(7)', cli('--mode', 'emit').stdout)
+            self.assertEqual(cli('--mode', 'python').stdout, '7\n')
+
+            completed = cli('--mode', 'check')
+            self.assertEqual((completed.returncode, completed.stdout), (0, ''))
+            with open(path, 'w') as f:
+                f.write('c = 1\nx = if c then 1 else 2.0\n')
+            # Every mode that compiles it says what's wrong, without a
+            #   traceback
+            for args in [('--mode', 'check'), ('--mode', 'run'),
+                         ('--stream', '--mode', 'emit')]:
+                completed = cli(*args)
+                self.assertEqual(completed.returncode, 1)
+                self.assertTrue(completed.stderr.startswith(
+                    path + ': TypeCheckError: '), args)
+
+            with open(path, 'w') as f:
+                f.write('x = 1\ny = (2 +\n')
+            completed = cli('--stream')
+            self.assertEqual(completed.returncode, 1)
+            self.assertTrue(completed.stderr.startswith(path + ': ParseError: '))
+
+            # The C compiler doesn't like this one
+            with open(path, 'w') as f:
+                f.write('fun f(n: {primitive: int}) = n * 2.5\nprint(f(1))\n')
+            completed = cli('--mode', 'run')
+            self.assertEqual(completed.returncode, 1)
+            self.assertTrue(completed.stderr.rstrip().splitlines()[-1].startswith(
+                path + ': CalledProcessError: '))
@@ -0,0 +1,48 @@
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+from phhe.infer import *
+
+INT = {'primitive': 'int'}
+FLOAT = {'primitive': 'float'}
+
+
+class TestInfer(TestCase):
+    def test_types(self):
+        tree = exprs.parse('''
+x = 1 + 2
+y = { z = 1.5  z * 2.0 }
+fun f(n: {primitive: int}) = n * x
+w = f(3)
+''')
+        types = infer(tree)
+        x, y, f, w = tree.exprs
+        self.assertEqual(types[x.value], INT)
+        self.assertEqual(types[x.value.lhs], INT)
+        self.assertEqual(types[y.value], FLOAT)
+        self.assertEqual(types[f], {'primitive': 'function',
+                                    'return': INT, 'argument': INT})
+        self.assertEqual(types[w.value], INT)
+        self.assertEqual(types[x], NULL)
+        self.assertNotIn(Literal(1), types)
+
+    def test_same_as_type(self):
+        for source in ['1 + 2.5', '{ 1.5 }', 'if 1 then 2 else 3', 'x',
+                       'fun f(n: {primitive: int}): {primitive: int} = f(n)']:
+            tree = exprs.parse(source)
+            self.assertEqual(infer(tree)[tree], tree.type(Context()))
+
+    def test_nested_argument(self):
+        tree = exprs.parse('''
+fun outer(q: {primitive: int}) = {
+    fun inner(r: {primitive: int}) = r + q
+    inner(q)
+}
+''')
+        self.assertEqual(infer(tree)[tree.exprs[0]]['return'], INT)
+
+    def test_errors(self):
+        with self.assertRaises(TypeCheckError):
+            infer(exprs.parse('if 1 then 2 else 3.5'))
+        with self.assertRaises(TypeCheckError):
+            infer(exprs.parse('fun f(n: {primitive: int}): {primitive: float} = n'))
@@ -48,3 +48,28 @@ class TestInterpreter(TestCase):
             21
         )
         self.assertIsNone(if_expr.parse('if 0.0 then 12').eval(Context()))
+
+    def test_tail_calls(self):
+        # Neither of these would fit on the Python stack without
+        #   tail calls
+        self.assertEqual(exprs.parse('''
+fun count(n: {primitive: int}) = if n then count(n - 1) else 42
+count(100000)
+''').eval(Context()), 42)
+        self.assertEqual(exprs.parse('''
+fun even(n: {primitive: int}) = if n then odd(n - 1) else 1
+fun odd(n: {primitive: int}) = if n then { m = n - 1 even(m) } else 0
+even(100001)
+''').eval(Context()), 0)
+
+    def test_tail_call_scope(self):
+        # What we tail call still sees our variables
+        self.assertEqual(exprs.parse('''
+fun g(x: {primitive: int}) = x + z
+fun h(z: {primitive: int}) = g(1)
+h(5)
+''').eval(Context()), 6)
+        self.assertEqual(exprs.parse('''
+fun outer(q: {primitive: int}) = { fun inner(r: {primitive: int}) = r + q  inner(q) }
+outer(4)
+''').eval(Context()), 8)
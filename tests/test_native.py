@@ -0,0 +1,64 @@
+import os
+import subprocess
+import tempfile
+import threading
+
+from context import *
+from phhe.parse import *
+from phhe.codegen import *
+from phhe.native import *
+
+
+def c_code(code):
+    return codegen([exprs.parse(code)], runtime='runtime.h')
+
+
+class TestNative(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = NativeCache(self.dir.name, max_entries=3)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_code(self, code):
+        return self.cache.run(c_code(code), capture_output=True,
+                              text=True).stdout
+
+    def test_run(self):
+        self.assertEqual(self.run_code('''
+fun test(i: {primitive: int}) = i + 2
+print(test(4))
+'''), '6\n')
+
+    def test_cached(self):
+        source = c_code('print(12)')
+        exe = self.cache.build(source)
+        inode = os.stat(exe).st_ino
+        self.assertEqual(self.cache.build(source), exe)
+        # It wasn't rebuilt, which would have replaced the file
+        self.assertEqual(os.stat(exe).st_ino, inode)
+        # The runtime is only built once
+        self.run_code('print(13)')
+        objects = [i for i in os.listdir(self.dir.name) if i.endswith('.o')]
+        self.assertEqual(len(objects), 1)
+
+    def test_eviction(self):
+        for i in range(5):
+            self.assertEqual(self.run_code('print(%d)' % i), '%d\n' % i)
+        self.assertEqual(len(self.cache.entries()), 3)
+
+    def test_concurrent(self):
+        outputs = []
+
+        def run():
+            outputs.append(self.run_code('print(99)'))
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        self.assertEqual(outputs, ['99\n'] * 4)
+        self.assertEqual(len(self.cache.entries()), 1)
+        # No temporary files are left over
+        self.assertEqual(len(os.listdir(self.dir.name)), 2)
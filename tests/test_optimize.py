@@ -0,0 +1,81 @@
+import io
+from contextlib import redirect_stdout
+
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+from phhe.optimize import *
+
+
+def run(tree):
+    out = io.StringIO()
+    with redirect_stdout(out):
+        ret = tree.eval(Context())
+    return ret, out.getvalue()
+
+
+class TestOptimize(TestCase):
+    def test_fold(self):
+        self.assertEqual(optimize(exprs.parse('1 + 2 * 3 - 4')),
+                         Block(Literal(3)))
+        self.assertEqual(optimize(exprs.parse('1.5 * 2.0')),
+                         Block(Literal(3.0)))
+        # These mean different things in C and the interpreter, or fail
+        for source in ['7 / 2', '1 + 2.0', '1.0 / 0.0', '65536 * 65536']:
+            tree = exprs.parse(source)
+            self.assertEqual(optimize(tree, 2), tree)
+
+    def test_branches(self):
+        self.assertEqual(optimize(exprs.parse('''
+if 2 - 2 then print(1) else print(2)
+if 0 then print(3)
+if 1 then { x = 4 print(x) }
+''')), Block(Call('print', Literal(2)),
+             Block(VarDeclare('x', Literal(4)), Call('print', VarAccess('x')))))
+        # The declaration would end up in a different scope in C
+        tree = exprs.parse('if 1 then x = 4\nx')
+        self.assertEqual(optimize(tree), tree)
+
+    def test_propagate(self):
+        self.assertEqual(optimize(exprs.parse('''
+x = 3
+y = x * 2
+z = 5
+if y - 6 then print(x) else print(y + 1)
+'''), 2), Block(Call('print', Literal(7))))
+        # The function sees its caller's x, not this one
+        tree = exprs.parse('''
+x = 3
+fun f(n: {primitive: int}) = n + x
+f(1)
+''')
+        self.assertEqual(optimize(tree, 2), tree)
+
+    def test_same_result(self):
+        with open('tests/test.ph') as f:
+            test_ph = f.read()
+        sources = [
+            test_ph,
+            '''
+x = 1
+if 0 then x = 2
+if x then print(x) else print(0)
+{ x = 5 print(x) }
+print(x)
+x = print(9)
+x
+''',
+            '''
+n = 10
+fun f(m: {primitive: int}) = n + m
+{ n = 2 print(f(n * 3)) }
+print(if n - 10 then 1 else 2.5 * 2.0)
+''']
+        for source in sources:
+            tree = exprs.parse(source)
+            expected = run(tree)
+            for level in (0, 1, 2):
+                ret, out = run(optimize(tree, level))
+                self.assertEqual(out, expected[1])
+                if not isinstance(ret, DictEq):
+                    self.assertEqual(ret, expected[0])
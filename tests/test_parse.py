@@ -59,3 +59,43 @@ class TestParse(TestCase):
                          If(Literal(0), Literal(1), Literal(2)))
         self.assertEqual(if_expr.parse('if 12.3 then print(55)'),
                          If(Literal(12.3), Call('print', Literal(55))))
+
+
+class TestPackrat(TestCase):
+    def tearDown(self):
+        disable_packrat()
+
+    def test_same_result(self):
+        with open('tests/test.ph') as f:
+            source = f.read()
+        plain = exprs.parse(source)
+        enable_packrat()
+        self.assertEqual(exprs.parse(source), plain)
+        self.assertEqual(binop.parse('8+ 1.2 +9 *(2 - 3) / -2'),
+                         BinOp(BinOp(Literal(8), '+', Literal(1.2)), '+',
+                               BinOp(BinOp(Literal(9), '*',
+                                           BinOp(Literal(2), '-', Literal(3))),
+                                     '/', Literal(-2))))
+        with self.assertRaises(parsy.ParseError):
+            binop.parse('3 ++ 2')
+
+    def test_backtracking(self):
+        # Each `if(` is tried as an if expression and then as a call,
+        #   which is exponential without memoization
+        source = 'if(' * 12 + '1' + ')' * 12
+        enable_packrat()
+        tree = exprs.parse(source)
+        expected = Literal(1)
+        for i in range(12):
+            expected = Call('if', expected)
+        self.assertEqual(tree, Block(expected))
+
+    def test_bounded(self):
+        enable_packrat(max_entries=10)
+        self.assertEqual(exprs.parse('x = 1 + 2 * 3\ny = x'),
+                         Block(VarDeclare('x', BinOp(Literal(1), '+',
+                               BinOp(Literal(2), '*', Literal(3)))),
+                               VarDeclare('y', VarAccess('x'))))
+        self.assertLessEqual(len(packrat_state.table), 10)
+        disable_packrat()
+        self.assertEqual(len(packrat_state.table), 0)
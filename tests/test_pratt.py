@@ -0,0 +1,78 @@
+from context import *
+
+import parsy
+from phhe.parse import *
+from phhe.ast import *
+from phhe import pratt
+
+
+class TestPratt(TestCase):
+    "The hand-written parser should give the same AST as the parsy one"
+
+    def assertSame(self, code):
+        self.assertEqual(pratt.parse(code), exprs.parse(code))
+        self.assertEqual(repr(pratt.parse(code)), repr(exprs.parse(code)))
+
+    def test_file(self):
+        self.assertEqual(pratt.parse_file('tests/test.ph'),
+                         parse_file('tests/test.ph'))
+
+    def test_binop(self):
+        self.assertSame('8+ 1.2 +9 *(2 - 3) / -2')
+        self.assertSame('3 -2\n3\n-2\n+4')
+        self.assertSame('x-2*y/3-4')
+
+    def test_function(self):
+        self.assertSame('''
+fun putchar ( x : {primitive : int }): {primitive: int}
+fun test(i: {primitive: int}) = i + 2
+fun nothing()
+putchar(test(53)) # comment
+''')
+
+    def test_if(self):
+        self.assertSame('if 0 then 1 else 2')
+        self.assertSame('if x then if y then 1 else 2')
+        # `else` on the next line isn't part of the if
+        self.assertSame('if c then x\nelse y')
+        # These aren't if expressions, so `if` is a name
+        self.assertSame('if(3)')
+        self.assertSame('if x = then 1')
+        self.assertSame('if = 3\nthen = if + 1')
+
+    def test_blocks(self):
+        self.assertSame('''
+{ y = 100 }
+{
+    # comments go between expressions
+    z = 2 x 3
+    print({ z })
+}
+''')
+
+    def test_lines(self):
+        tree = pratt.parse('''x = 1
+
+fun f(a: {primitive: int}) = {
+    a + 2
+}
+if x then f(x) else {
+    x
+}
+''')
+        self.assertEqual([i.line for i in tree.exprs], [1, 3, 6])
+        self.assertEqual(tree.exprs[0].value.line, 1)
+        self.assertEqual(tree.exprs[1].body.exprs[0].line, 4)
+        self.assertEqual(tree.exprs[2].else_branch.exprs[0].line, 7)
+        # Lines aren't part of what makes nodes equal
+        self.assertEqual(tree, exprs.parse('''x = 1
+fun f(a: {primitive: int}) = { a + 2 }
+if x then f(x) else { x }'''))
+
+    def test_errors(self):
+        for code in ['3 ++ 2', '12.', '.54', 'let = 3', 'x = 3 + # no\n4',
+                     'fun f(x) = x', 'f(3 4)', '{ 3']:
+            with self.assertRaises(parsy.ParseError):
+                exprs.parse(code)
+            with self.assertRaises(parsy.ParseError):
+                pratt.parse(code)
@@ -0,0 +1,67 @@
+import io
+from contextlib import redirect_stdout
+
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+from phhe.profiler import *
+from phhe import ast
+
+
+class FakeClock:
+    "Goes up by one every time it's read"
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+class TestProfiler(TestCase):
+    def test_profile(self):
+        tree = exprs.parse('''
+fun sq(x: {primitive: int}) = x * x
+fun count(n: {primitive: int}) = if n then { y = sq(n) count(n - 1) } else 0
+fun rec(n: {primitive: int}) = if n then rec(n - 1) + 1 else 0
+count(10)
+print(rec(5))
+''')
+        originals = [Block.eval, Call.tail_eval, Function.run, ast.tail_eval]
+        with redirect_stdout(io.StringIO()) as out:
+            with Profiler(FakeClock()) as profiler:
+                tree.eval(Context())
+        self.assertEqual(out.getvalue(), '5\n')
+        # Everything is back to normal afterwards
+        self.assertEqual([Block.eval, Call.tail_eval, Function.run,
+                          ast.tail_eval], originals)
+
+        calls = {stats.label: stats.count
+                 for node, stats in profiler.functions.values()}
+        self.assertEqual(calls, {'Function <main>': 1, 'Function count': 11,
+                                 'Function sq': 10, 'Function rec': 6})
+        for node, stats in profiler.functions.values():
+            self.assertLessEqual(stats.self_time, stats.total)
+        [(node, stats)] = [i for i in profiler.nodes.values()
+                           if i[1].label == 'BinOp *']
+        self.assertEqual(stats.count, 10)
+
+        stacks = [i.split(' ')[0] for i in profiler.collapsed()]
+        self.assertIn('<main>;count;sq', stacks)
+        # count tail calls itself, so it's never under itself
+        self.assertNotIn('<main>;count;count', stacks)
+        self.assertIn('<main>;rec;rec;rec', stacks)
+        total = sum(int(i.split(' ')[1]) for i in profiler.collapsed())
+        main = [stats for node, stats in profiler.functions.values()
+                if stats.label == 'Function <main>'][0]
+        self.assertEqual(total, round(main.total * 1e6))
+
+        report = profiler.report(3)
+        self.assertIn('Top 3 functions', report)
+        self.assertIn('Top 3 nodes', report)
+
+    def test_nested(self):
+        with Profiler():
+            with self.assertRaises(RuntimeError):
+                Profiler().start()
@@ -0,0 +1,54 @@
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+from phhe.purity import *
+
+
+class TestPurity(TestCase):
+    def test_analysis(self):
+        tree = exprs.parse('''
+fun putchar(x: {primitive: int}): {primitive: int}
+fun double(x: {primitive: int}) = x * 2
+fun quad(x: {primitive: int}) = { y = double(x) double(y) }
+fun loud(x: {primitive: int}) = print(x)
+fun ffi(x: {primitive: int}) = putchar(x)
+fun calls_loud(x: {primitive: int}) = loud(x) + 1
+fun free(x: {primitive: int}) = x + z
+fun maybe(x: {primitive: int}) = { if x then y = 1  y }
+fun rec(n: {primitive: int}) = if n then rec(n - 1) + 1 else 0
+''')
+        self.assertEqual(set(pure_functions(tree)),
+                         {'double', 'quad', 'rec'})
+
+    def test_memo(self):
+        tree = exprs.parse('''
+fun fib(n: {primitive: int}) = if n then (if n - 1 then fib(n - 1) + fib(n - 2) else 1) else 0
+fib(60)
+''')
+        memo = Memo(tree)
+        self.assertEqual(tree.eval(Context(memo=memo)), 1548008755920)
+        hits, misses = memo.stats()['fib']
+        # Without memoization this would take billions of calls
+        self.assertEqual(misses, 61)
+        self.assertLess(hits, 100)
+
+    def test_types(self):
+        # 1 and 1.0 shouldn't share an entry
+        tree = exprs.parse('''
+fun inc(n: {primitive: int}) = n + 1
+x = inc(1)
+inc(1.0)
+''')
+        ret = tree.eval(Context(memo=Memo(tree)))
+        self.assertIs(type(ret), float)
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        # 'b' was the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
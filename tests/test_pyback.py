@@ -0,0 +1,85 @@
+import contextlib
+import io
+
+from context import *
+from phhe.ast import *
+from phhe import pratt
+from phhe.pyback import *
+
+
+class TestPyBack(TestCase):
+    def same(self, code):
+        "Checks the Python gives the same output and value as the interpreter"
+        tree = pratt.parse(code)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            expected = tree.eval(Context())
+        program = transpile(tree)
+        with contextlib.redirect_stdout(io.StringIO()) as got:
+            self.assertEqual(program.run(), expected)
+        self.assertEqual(got.getvalue(), out.getvalue())
+        return program
+
+    def test_arithmetic(self):
+        program = self.same('''
+fun score(x: {primitive: int}) = { y = x * 3 + 1  if y - 10 then y * 2 else 0 }
+print(score(5))
+print(score(3))
+7 / 2
+''')
+        self.assertIn('def ', program.source)
+
+    def test_recursion(self):
+        self.same('''
+fun fib(n: {primitive: int}) = if n then (if n - 1 then fib(n - 1) + fib(n - 2) else 1) else 0
+fib(15)
+''')
+
+    def test_tail_call(self):
+        # Far deeper than the Python stack
+        program = self.same('''
+fun count(n: {primitive: int}): {primitive: int} = if n then count(n - 1) else 42
+count(100000)
+''')
+        self.assertIn('while True', program.source)
+
+    def test_dynamic(self):
+        self.same('''
+fun f(a: {primitive: int}) = a + x
+fun g(b: {primitive: int}) = { x = b * 2  f(1) + 0 }
+print(g(5))
+x = 100
+fun h(c: {primitive: int}) = { x = c  f(c) * 1 }
+print(h(3))
+f(0)
+''')
+
+    def test_tail_call_scope(self):
+        # f still sees g's `x`, and count's loop still sees `y`
+        self.same('''
+x = 1
+fun f(a: {primitive: int}) = a + x
+fun g(b: {primitive: int}) = { x = 50  f(b) }
+print(g(2))
+fun count(n: {primitive: int}) = if n then { if n - 3 then 0 else y = n  count(n - 1) } else y
+count(5)
+''')
+
+    def test_none(self):
+        # Binding None doesn't hide the `y` further out
+        self.same('''
+y = 3
+fun f(a: {primitive: int}) = { y = print(a)  y }
+f(7)
+''')
+
+    def test_conditional(self):
+        self.same('''
+fun f(n: {primitive: int}) = { z = 1  { if n then z = 5  print(z) }  z }
+print(f(0))
+f(1)
+''')
+
+    def test_rerun(self):
+        program = transpile(pratt.parse('x = 4\nx * 2'))
+        self.assertEqual(program.run(), 8)
+        self.assertEqual(program.run(), 8)
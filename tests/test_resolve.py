@@ -0,0 +1,87 @@
+from context import *
+import contextlib
+import io
+from phhe.ast import *
+from phhe.parse import *
+from phhe.resolve import *
+
+
+def run(code):
+    return resolve(exprs.parse(code)).eval()
+
+
+class TestResolve(TestCase):
+    "The frame-based evaluator should agree with `eval()`"
+
+    def test_file(self):
+        tree = parse_file('tests/test.ph')
+        self.assertEqual(resolve(tree).eval(), tree.eval(Context()))
+
+    def test_slots(self):
+        program = resolve(exprs.parse('''
+x = 1
+fun f(a: {primitive: int}) = {
+    y = a + x
+    y
+}
+'''))
+        x, f = program.body.exprs
+        # f reads `x` without declaring it, so it's dynamic
+        self.assertIsInstance(x, DynamicStore)
+        self.assertEqual(f.slot, 1)
+        y, access = f.body.exprs
+        # `a` is slot 1 of f's frame
+        self.assertEqual(y.value.lhs.candidates, ((0, 1),))
+        self.assertIsInstance(y.value.rhs, DynamicLoad)
+        self.assertEqual(access.candidates, ((0, 2),))
+
+    def test_dynamic(self):
+        # Functions see their caller's variables, like with `Context`
+        for code, value in [('''
+y = 3
+fun f(x: {primitive: int}) = x + y
+{
+    y = 10
+    f(1)
+}
+''', 11), ('''
+fun g(x: {primitive: int}) = x + z
+fun h(z: {primitive: int}) = g(1)
+h(5)
+''', 6), ('''
+fun outer(q: {primitive: int}) = { fun inner(r: {primitive: int}) = r + q  inner(q) }
+outer(4)
+''', 8)]:
+            self.assertEqual(exprs.parse(code).eval(Context()), value)
+            self.assertEqual(run(code), value)
+
+    def test_recursion(self):
+        code = '''
+fun fib(n: {primitive: int}) = if n then (if n - 1 then fib(n - 1) + fib(n - 2) else 1) else 0
+fib(15)
+'''
+        self.assertEqual(run(code), 610)
+
+    def test_mutual_recursion(self):
+        self.assertEqual(run('''
+fun even(n: {primitive: int}) = if n then odd(n - 1) else 1
+fun odd(n: {primitive: int}) = if n then even(n - 1) else 0
+even(10) + odd(7) * 10
+'''), 11)
+
+    def test_shadowing(self):
+        # A binding that's None doesn't hide the outer one
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            ret = run('''
+x = 5
+{
+    x = print(x)
+    if 0 then y = 2
+    y = x + 1
+    if 1 then x = y * 2
+    x
+}
+''')
+        self.assertEqual(ret, 12)
+        self.assertEqual(out.getvalue(), '5\n')
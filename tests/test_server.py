@@ -0,0 +1,167 @@
+import contextlib
+import io
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from context import *
+from phhe.client import *
+from phhe.server import *
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'phhe.sock')
+        self.server = Server(self.path, jobs=2, cache=False)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        if not self.server.stopping:
+            self.server.stop()
+        self.thread.join()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def test_modes(self):
+        source = 'fun f(x: {primitive: int}) = x * 2\nprint(f(4))\nf(10)'
+        with Client(self.path) as client:
+            self.assertEqual(client.request('ping'), {'ok': True})
+            response = client.request('emit', source=source, filename='x.ph')
+            self.assertTrue(response['ok'])
+            self.assertIn('#line 2 "x.ph"', response['c'])
+            for mode in ('interpret', 'python'):
+                response = client.request(mode, source=source)
+                self.assertEqual((response['output'], response['value']),
+                                 ('8\n', '20'))
+            response = client.request('check', source='x = 1')
+            self.assertEqual([i[0] for i in response['timings']],
+                             ['parse', 'optimize', 'check'])
+            # The second time, it's already parsed
+            response = client.request('check', source='x = 1')
+            self.assertEqual([i[0] for i in response['timings']], ['check'])
+
+    def test_errors(self):
+        with Client(self.path) as client:
+            response = client.request('emit', source='x = (')
+            self.assertFalse(response['ok'])
+            self.assertTrue(response['error'].startswith('ParseError: '))
+            response = client.request('interpret', source='print(1)\n1 / 0')
+            self.assertEqual(response['output'], '1\n')
+            self.assertTrue(response['error'].startswith('ZeroDivisionError'))
+            response = client.request('frobnicate', source='1')
+            self.assertIn('unknown op', response['error'])
+            for field, value in [('level', 3), ('level', '1'),
+                                 ('level', True), ('tiered', 'yes'),
+                                 ('tiered', 0), ('counters', 1),
+                                 ('timeout', -1), ('filename', 2)]:
+                response = client.request('interpret', source='1',
+                                          **{field: value})
+                self.assertTrue(response['error'].startswith('Bad request: '),
+                                (field, value))
+            self.assertTrue(client.request('interpret', source='1', level=2,
+                                           tiered=None, counters=True)['ok'])
+            # It's still there after all that
+            self.assertTrue(client.request('ping')['ok'])
+
+    def test_concurrent(self):
+        results = {}
+
+        def work(i):
+            with Client(self.path) as client:
+                results[i] = client.request(
+                    'interpret', source='x = %d\nprint(x)\nx * 2' % i)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        # Each one only sees what it printed
+        for i in range(8):
+            self.assertEqual((results[i]['output'], results[i]['value']),
+                             ('%d\n' % i, str(i * 2)))
+
+    def test_timeout(self):
+        source = 'fun f(n: {primitive: int}) = f(n)\nf(1)'
+        with Client(self.path) as client:
+            for mode in ('interpret', 'python'):
+                response = client.request(mode, source=source, timeout=0.2)
+                self.assertTrue(response['error'].startswith('TimeoutError'))
+            self.assertTrue(client.request('ping')['ok'])
+
+    def test_tiered(self):
+        # Promoted code that recurses forever doesn't take the server down
+        source = ('fun f(n: {primitive: int}): {primitive: int} = '
+                  'if n then f(n + 1) - f(n + 2) else 0\nf(1)')
+        with Client(self.path) as client:
+            response = client.request('interpret', source=source, tiered=1)
+            self.assertTrue(response['error'].startswith('RecursionError'))
+            self.assertTrue(client.request('ping')['ok'])
+
+    def test_client_errors(self):
+        path = os.path.join(self.dir.name, 'x.ph')
+        with open(path, 'w') as f:
+            f.write('print(1)')
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            status = main([os.path.join(self.dir.name, 'nope.sock'), path])
+        self.assertEqual(status, 1)
+        self.assertTrue(err.getvalue().startswith(path + ': '))
+
+        # One that hangs up instead of answering
+        rude = os.path.join(self.dir.name, 'rude.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            listener.bind(rude)
+            listener.listen()
+            thread = threading.Thread(
+                target=lambda: listener.accept()[0].close())
+            thread.start()
+            err = io.StringIO()
+            with contextlib.redirect_stderr(err):
+                status = main([rude, path])
+            thread.join()
+        self.assertEqual(status, 1)
+        self.assertIn('closed the connection', err.getvalue())
+
+    def test_close_timeout(self):
+        # A request that's still running doesn't hold up `server_close`
+        self.server.close_timeout = 0.2
+        client = Client(self.path)
+        self.server.timeout = 2
+        thread = threading.Thread(target=client.request, args=(
+            'interpret',), kwargs={'source': 'fun f(n: {primitive: int}) = f(n)\nf(1)'})
+        thread.start()
+        # Long enough for it to be running
+        time.sleep(0.3)
+        self.server.stop()
+        self.thread.join()
+        start = time.monotonic()
+        self.server.server_close()
+        self.assertLess(time.monotonic() - start, 1)
+        thread.join()
+        client.close()
+
+    def test_shutdown(self):
+        idle = Client(self.path)
+        with Client(self.path) as client:
+            self.assertTrue(client.request('shutdown')['ok'])
+        self.thread.join()
+        self.server.server_close()
+        # The idle connection was closed, rather than holding it up
+        with self.assertRaises(ServerError):
+            idle.request('ping')
+        idle.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_not_a_socket(self):
+        path = os.path.join(self.dir.name, 'file.ph')
+        with open(path, 'w') as f:
+            f.write('print(1)')
+        with self.assertRaises(FileExistsError):
+            Server(path, cache=False)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'print(1)')
@@ -0,0 +1,66 @@
+import ctypes
+import os
+import sys
+import tempfile
+
+from context import *
+from phhe import pratt
+from phhe.native import NativeCache
+from phhe.shared import *
+
+
+class TestShared(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = NativeCache(self.dir.name)
+        self.source = '''
+fun fib(n: {primitive: int}): {primitive: int} = if n then (if n - 1 then fib(n - 1) + fib(n - 2) else 1) else 0
+fun half(x: {primitive: float}) = x / 2.0
+fun putchar(x: {primitive: int}): {primitive: int}
+print(fib(10))
+'''
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_functions(self):
+        program = load(pratt.parse(self.source), self.cache)
+        self.assertEqual(program['fib'](20), 6765)
+        self.assertEqual(program['half'](3.0), 1.5)
+        # ints are converted to floats, but not the other way
+        self.assertEqual(program['half'](3), 1.5)
+        with self.assertRaises(ctypes.ArgumentError):
+            program['fib'](1.5)
+        # Just a declaration, it's from libc
+        self.assertNotIn('putchar', program)
+
+    def test_run(self):
+        program = load(pratt.parse(self.source), self.cache)
+        # The C writes straight to file descriptor 1
+        with tempfile.TemporaryFile('w+') as out:
+            sys.stdout.flush()
+            stdout = os.dup(1)
+            os.dup2(out.fileno(), 1)
+            try:
+                self.assertEqual(program.run(), 0)
+            finally:
+                os.dup2(stdout, 1)
+                os.close(stdout)
+            out.seek(0)
+            self.assertEqual(out.read(), '55\n')
+
+    def test_cache(self):
+        first = load(pratt.parse(self.source), self.cache)
+        second = load(pratt.parse(self.source), self.cache)
+        self.assertEqual(first.path, second.path)
+        self.assertTrue(first.path.endswith('.so'))
+        self.assertEqual(len(self.cache.entries()), 1)
+        # Executables are cached alongside them
+        self.cache.build('int main() { return 0; }')
+        self.assertEqual(len(self.cache.entries()), 2)
+
+    def test_counters(self):
+        program = load(pratt.parse(self.source), self.cache, counters=True)
+        # It's the wrapper that's called, not `fib$body`
+        # Calling them would print the counts when the tests exit
+        self.assertEqual(set(program.functions), {'fib', 'half'})
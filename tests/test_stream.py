@@ -0,0 +1,74 @@
+import contextlib
+import io
+import os
+import tempfile
+
+from context import *
+import parsy
+from phhe.ast import *
+from phhe.codegen import codegen
+from phhe import pratt
+from phhe.stream import *
+
+
+class TestStream(TestCase):
+    source = '''# a comment
+fun sq(x: {primitive: int}): {primitive: int} = x * x
+y = {
+    z = sq(3)   # nine (
+    z + 1
+}
+
+print(y) print(sq(2))
+y + 1
+'''
+
+    def test_statements(self):
+        lines = io.StringIO(self.source)
+        nodes = list(statements(lines))
+        self.assertEqual(nodes, list(pratt.parse(self.source).exprs))
+        self.assertEqual([i.line for i in nodes], [2, 3, 8, 8, 9])
+
+    def test_lazy(self):
+        def lines():
+            yield 'x = 1\n'
+            yield 'x + \n'
+            raise AssertionError("read too far")
+        # The first statement comes out before the rest is read
+        self.assertEqual(next(statements(lines())), VarDeclare('x', Literal(1)))
+
+    def test_errors(self):
+        with self.assertRaises(parsy.ParseError) as e:
+            list(statements(['x = 1\n', 'y = {\n', '  2 +\n', '}\n']))
+        # Same as parsing the whole file, not just the statement
+        self.assertEqual(e.exception.line_info(), '2:5')
+        with self.assertRaises(parsy.ParseError):
+            list(statements(['y = {\n', '  2\n']))
+
+    def test_run(self):
+        ctx = Context()
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(run(statements(io.StringIO(self.source)), ctx), 11)
+        self.assertEqual(out.getvalue(), '10\n4\n')
+        # Everything's still in `ctx`
+        self.assertEqual(ctx.lookup('y'), 10)
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'test.ph')
+            with open(path, 'w') as f:
+                f.write(self.source)
+            self.assertEqual(''.join(read_lines(path)), self.source)
+            # An empty file can't be memory-mapped
+            open(path, 'w').close()
+            self.assertEqual(list(read_lines(path)), [])
+
+    def test_emit(self):
+        out = io.StringIO()
+        emit(statements(io.StringIO(self.source)), out)
+        c = out.getvalue()
+        whole = codegen([pratt.parse(self.source)])
+        # The same main function as generating it all at once
+        self.assertEqual(c[c.index('int main()'):],
+                         whole[whole.index('int main()'):])
+        self.assertIn('int sq(int x)', c)
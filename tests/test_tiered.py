@@ -0,0 +1,102 @@
+import contextlib
+import io
+import tempfile
+
+from context import *
+from phhe.ast import *
+from phhe import pratt
+from phhe.native import NativeCache
+from phhe.tiered import *
+
+
+class TestTiered(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        # Warnings are errors, so anything the C compiler is unsure about
+        #   shows up as a function that didn't get compiled
+        self.cache = NativeCache(self.dir.name, flags=['-O2', '-Werror'])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_tiered(self, code, cache=None):
+        "Checks it gives the same output and value as without tiers"
+        tree = pratt.parse(code)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            expected = tree.eval(Context())
+        tiers = Tiers(tree, 3, cache or self.cache)
+        with contextlib.redirect_stdout(io.StringIO()) as got:
+            self.assertEqual(tree.eval(Context(tiers=tiers)), expected)
+        self.assertEqual(got.getvalue(), out.getvalue())
+        return tiers
+
+    def test_promote(self):
+        tiers = self.run_tiered('''
+fun sq(n: {primitive: int}) = n * n
+fun fib(n: {primitive: int}): {primitive: int} = if n then (if n - 1 then fib(n - 1) + sq(0) + fib(n - 2) else 1) else 0
+print(fib(12))
+fib(15)
+''')
+        self.assertTrue(tiers.compiled['fib'])
+
+    def test_big(self):
+        # Too big for a C int, so these stay in the interpreter
+        tiers = self.run_tiered('''
+fun sq(n: {primitive: int}) = n * n
+sq(3) + sq(3) + sq(3) + sq(100000 * 100000) + sq(3)
+''')
+        self.assertTrue(tiers.compiled['sq'])
+
+    def test_overflow(self):
+        # 100000 fits in an int, but its square doesn't
+        tiers = self.run_tiered('''
+fun sq(n: {primitive: int}) = n * n
+fun f(n: {primitive: int}) = sq(n) + 1
+f(3) + f(3) + f(3) + f(3) + f(100000) + f(3)
+''')
+        self.assertTrue(tiers.compiled['f'])
+
+    def test_deep(self):
+        # This never stops recursing, which the C can't either, so it has
+        #   to give up and let the interpreter raise its RecursionError
+        tree = pratt.parse('''
+fun f(n: {primitive: int}): {primitive: int} = if n then f(n + 1) - f(n + 2) else 0
+f(1)
+''')
+        tiers = Tiers(tree, 1, self.cache)
+        with self.assertRaises(RecursionError):
+            tree.eval(Context(tiers=tiers))
+        self.assertTrue(tiers.compiled['f'])
+
+    def test_threshold(self):
+        tree = pratt.parse('''
+fun sq(n: {primitive: int}) = n * n
+sq(2) + sq(3)
+''')
+        tiers = Tiers(tree, 3, self.cache)
+        self.assertEqual(tree.eval(Context(tiers=tiers)), 13)
+        self.assertEqual(tiers.compiled, {})
+        self.assertEqual(tiers.counts, {'sq': 2})
+
+    def test_interpreted(self):
+        tiers = self.run_tiered('''
+fun loud(n: {primitive: int}) = { print(n)  n }
+fun outer(n: {primitive: int}) = n + scale
+fun half(n: {primitive: int}) = n / 2
+fun scaled(n: {primitive: float}) = n * 1.5
+fun calls(n: {primitive: int}) = loud(n) + 1
+scale = 10
+fun all(n: {primitive: int}) = loud(n) + outer(n) + half(n) + scaled(n) + calls(n)
+all(1) + all(2) + all(3) + all(4) + all(5)
+''')
+        # The rest aren't pure, so they aren't even counted
+        self.assertEqual(set(tiers.compiled), {'half', 'scaled'})
+        self.assertFalse(any(tiers.compiled.values()))
+
+    def test_fallback(self):
+        # The compiler doesn't work, so it just carries on
+        tiers = self.run_tiered('''
+fun sq(n: {primitive: int}) = n * n
+sq(2) + sq(3) + sq(4) + sq(5)
+''', NativeCache(self.dir.name, cc='false'))
+        self.assertEqual(tiers.compiled, {'sq': False})
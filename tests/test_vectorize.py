@@ -0,0 +1,74 @@
+import contextlib
+import io
+
+from context import *
+from phhe.ast import *
+from phhe import pratt
+from phhe.vectorize import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class TestVectorize(TestCase):
+    def setUp(self):
+        tree = pratt.parse('''
+fun score(x: {primitive: int}) = { y = x * 3 + 1  if y - 10 then y * 2 else 0 }
+fun fact(n: {primitive: int}) = if n then n * fact(n - 1) else 1
+fun inv(n: {primitive: int}) = if n then 10 / n else 0
+fun loud(n: {primitive: int}) = { print(n) n }
+fun maybe(n: {primitive: int}) = if n then 1
+fun decl(n: {primitive: int}) = { if n then z = 5 else z = 6  z }
+fun outer(n: {primitive: int}) = n + scale
+fun unbound(n: {primitive: int}) = if n then n + q else 0
+''')
+        self.ctx = Context()
+        for i in tree.exprs:
+            i.eval(self.ctx)
+
+    def assertSame(self, name, xs, **kwargs):
+        "It should give what the interpreter does for each one"
+        got = vectorize(name, self.ctx, **kwargs)(numpy.array(xs))
+        function = self.ctx.lookup(name)
+        self.assertEqual(got.tolist(), [function.call(self.ctx, x) for x in xs])
+        return got
+
+    def test_arithmetic(self):
+        got = self.assertSame('score', list(range(-5, 10)))
+        self.assertEqual(got.dtype, numpy.int64)
+        # Only the elements that take a branch run it, so no dividing by 0
+        self.assertSame('inv', [0, 1, 2, 4, 0])
+
+    def test_recursion(self):
+        self.assertSame('fact', list(range(10)))
+        # Past `max_depth` it's done one at a time by the interpreter
+        self.assertSame('fact', [3, 5, 20], max_depth=4)
+
+    def test_fallback(self):
+        self.assertSame('maybe', [0, 1, 2])
+        self.assertSame('decl', [0, 1, 0])
+        # `q` isn't there, but no element reads it
+        self.assertSame('unbound', [0, 0])
+        # NumPy would say inf, but it should fail like the interpreter
+        with self.assertRaises(ZeroDivisionError):
+            vectorize(pratt.parse('fun f(n: {primitive: int}) = 1 / n').exprs[0],
+                      self.ctx)(numpy.arange(3))
+
+    def test_scope(self):
+        # Scoping is dynamic, so the function sees what's in `ctx`
+        self.ctx.add_binding('scale', 100)
+        self.assertEqual(self.assertSame('outer', [1, 2]).tolist(), [101, 102])
+        # And doesn't leave anything behind in it
+        self.assertEqual(len(self.ctx.stack), 1)
+
+    def test_print(self):
+        self.assertTrue(may_print(self.ctx.lookup('loud'), self.ctx))
+        self.assertFalse(may_print(self.ctx.lookup('fact'), self.ctx))
+        with io.StringIO() as out, contextlib.redirect_stdout(out):
+            got = vectorize('loud', self.ctx)(numpy.arange(3))
+            # In the same order as calling it three times
+            self.assertEqual(out.getvalue(), '0\n1\n2\n')
+        self.assertEqual(got.tolist(), [0, 1, 2])
@@ -0,0 +1,79 @@
+from context import *
+from phhe.ast import *
+from phhe.parse import *
+from phhe.vm import *
+
+
+def run_vm(code):
+    return compile_vm(exprs.parse(code)).run()
+
+
+class TestVM(TestCase):
+    "The bytecode VM should agree with `eval()`"
+
+    def test_file(self):
+        tree = parse_file('tests/test.ph')
+        self.assertEqual(compile_vm(tree).run(), tree.eval(Context()))
+
+    def test_if(self):
+        self.assertEqual(run_vm('if 0 then 1 else 2'), 2)
+        self.assertEqual(run_vm('if 1.2 then 21'), 21)
+        self.assertIsNone(run_vm('if 0.0 then 12'))
+
+    def test_recursion(self):
+        self.assertEqual(run_vm('''
+fun fib(n: {primitive: int}) = if n then (if n - 1 then fib(n - 1) + fib(n - 2) else 1) else 0
+fib(15)
+'''), 610)
+
+    def test_dynamic(self):
+        # Functions see their caller's variables, like with `Context`
+        for code, value in [('''
+y = 3
+fun f(x: {primitive: int}) = x + y
+{
+    y = 10
+    f(1)
+}
+''', 11), ('''
+fun g(x: {primitive: int}) = x + z
+fun h(z: {primitive: int}) = g(1)
+h(5)
+''', 6), ('''
+fun outer(q: {primitive: int}) = { fun inner(r: {primitive: int}) = r + q  inner(q) }
+outer(4)
+''', 8)]:
+            self.assertEqual(exprs.parse(code).eval(Context()), value)
+            self.assertEqual(run_vm(code), value)
+
+    def test_deep_recursion(self):
+        # Far past the Python recursion limit
+        self.assertEqual(run_vm('''
+fun count(n: {primitive: int}) = if n then 1 + count(n - 1) else 0
+count(50000)
+'''), 50000)
+
+    def test_long_binop(self):
+        tree = Literal(0)
+        for i in range(50000):
+            tree = BinOp(tree, '+', Literal(1))
+        self.assertEqual(compile_vm(Block(tree)).run(), 50000)
+
+    def test_disassemble(self):
+        listing = compile_vm(exprs.parse('''
+fun inc(x: {primitive: int}) = x + 1
+inc(2)
+''')).disassemble()
+        self.assertEqual(listing, '''\
+     0 CLOSURE      0 (inc)
+     2 POP
+     4 LOCAL        1
+     6 CONST        0 (2)
+     8 CALL
+    10 HALT
+
+inc:
+    12 LOCAL        1
+    14 CONST        1 (1)
+    16 ADD
+    18 RETURN''')